@@ -36,30 +36,49 @@ class BackendService {
     return dotIndex != -1 ? fileName.substring(dotIndex + 1) : 'jpg';
   }
 
+  // Multipart 'file' field for an image, read as bytes on web where paths are blob URLs
+  static Future<http.MultipartFile> _imageFile(String imagePath) async {
+    if (kIsWeb) {
+      // For web: read file as bytes and create multipart file
+      var bytes = await _readFileAsBytesWeb(imagePath);
+      return http.MultipartFile.fromBytes(
+        'file',
+        bytes,
+        filename: 'image.${_getFileExtension(imagePath).toLowerCase()}',
+        contentType: MediaType('image', _getFileExtension(imagePath).toLowerCase()),
+      );
+    }
+    // For mobile: use the existing method
+    return http.MultipartFile.fromPath('file', imagePath);
+  }
+
+  // The error message of a failed response. Rate limit (429) and upload size (413)
+  // rejections may come with an HTML body, so fall back to the status line.
+  static String _errorMessage(int statusCode, String? reasonPhrase, String body, String fallback) {
+    try {
+      var jsonResponse = json.decode(body);
+      if (jsonResponse is Map && jsonResponse['error'] != null) {
+        return jsonResponse['error'].toString();
+      }
+    } on FormatException {
+      return '$statusCode ${reasonPhrase ?? fallback}';
+    }
+    return fallback;
+  }
+
   static Future<Map<String, dynamic>> analyzeImage(String imagePath) async {
     try {
       var request = http.MultipartRequest('POST', Uri.parse('$baseUrl/analyze'));
-
-      if (kIsWeb) {
-        // For web: read file as bytes and create multipart file
-        var bytes = await _readFileAsBytesWeb(imagePath);
-        var multipartFile = http.MultipartFile.fromBytes(
-          'file',
-          bytes,
-          filename: 'image.${_getFileExtension(imagePath).toLowerCase()}',
-          contentType: MediaType('image', _getFileExtension(imagePath).toLowerCase()),
-        );
-        request.files.add(multipartFile);
-      } else {
-        // For mobile: use the existing method
-        request.files.add(await http.MultipartFile.fromPath('file', imagePath));
-      }
+      request.files.add(await _imageFile(imagePath));
 
       var response = await request.send();
       var responseData = await response.stream.bytesToString();
+      if (response.statusCode != 200) {
+        throw Exception(_errorMessage(response.statusCode, response.reasonPhrase, responseData, 'Analysis failed'));
+      }
       var jsonResponse = json.decode(responseData);
 
-      if (response.statusCode == 200 && jsonResponse['success'] == true) {
+      if (jsonResponse['success'] == true) {
         return jsonResponse;
       } else {
         throw Exception(jsonResponse['error'] ?? 'Analysis failed');
@@ -81,9 +100,12 @@ class BackendService {
         }),
       );
 
+      if (response.statusCode != 200) {
+        throw Exception(_errorMessage(response.statusCode, response.reasonPhrase, response.body, 'Store search failed'));
+      }
       var jsonResponse = json.decode(response.body);
 
-      if (response.statusCode == 200 && jsonResponse['success'] == true) {
+      if (jsonResponse['success'] == true) {
         return jsonResponse;
       } else {
         throw Exception(jsonResponse['error'] ?? 'Store search failed');
@@ -93,10 +115,62 @@ class BackendService {
     }
   }
 
+  // Analyzes an image and finds nearby stores in one request. Yields the server-sent
+  // events as they arrive, each as {'event': name, 'data': payload}: 'analysis' (the
+  // /analyze result), then 'stores' and 'route' if media was detected, then 'done'.
+  // On web the browser client only delivers the body once complete, so all events
+  // arrive together there.
+  static Stream<Map<String, dynamic>> snapToStore(String imagePath, double lat, double lng) async* {
+    var request = http.MultipartRequest('POST', Uri.parse('$baseUrl/snap-to-store'));
+    request.fields['lat'] = lat.toString();
+    request.fields['lng'] = lng.toString();
+    request.files.add(await _imageFile(imagePath));
+
+    var response = await request.send();
+    if (response.statusCode != 200) {
+      var body = await response.stream.bytesToString();
+      throw Exception(_errorMessage(response.statusCode, response.reasonPhrase, body, 'Analysis failed'));
+    }
+
+    String? event;
+    var data = StringBuffer();
+    var lines = response.stream.transform(utf8.decoder).transform(const LineSplitter());
+    await for (var line in lines) {
+      if (line.isEmpty) {
+        // A blank line ends the event
+        if (event != null) {
+          var payload = json.decode(data.toString());
+          if (event == 'error') {
+            throw Exception(payload['error'] ?? 'Store search failed');
+          }
+          yield {'event': event, 'data': payload};
+        }
+        event = null;
+        data.clear();
+      } else if (line.startsWith('event:')) {
+        event = line.substring(6).trim();
+      } else if (line.startsWith('data:')) {
+        data.write(line.substring(5).trim());
+      }
+    }
+  }
+
   static Future<Map<String, dynamic>> analyzeAndFindStores(String imagePath, double lat, double lng) async {
     try {
-      // First, analyze the image
-      var analysisResult = await analyzeImage(imagePath);
+      Map<String, dynamic>? analysisResult;
+      Map<String, dynamic>? storesResult;
+      await for (var event in snapToStore(imagePath, lat, lng)) {
+        if (event['event'] == 'analysis') {
+          analysisResult = event['data'];
+        } else if (event['event'] == 'stores') {
+          storesResult = Map<String, dynamic>.from(event['data']);
+        } else if (event['event'] == 'route') {
+          storesResult?['route_info'] = event['data']['route_info'];
+        }
+      }
+      if (analysisResult == null) {
+        throw Exception('No analysis result received');
+      }
 
       // Check if media was detected
       if (analysisResult['media_type'] == null) {
@@ -108,22 +182,16 @@ class BackendService {
         };
       }
 
-      // Extract the search query from analysis
-      String searchQuery = analysisResult['search_query'] ?? 'media store';
-
-      // Then find stores using the identified media type
-      var storesResult = await findNearbyStores(lat, lng, query: searchQuery);
-
       // Combine results
       return {
         'success': true,
         'analysis': analysisResult,
         'stores': storesResult,
         'media_type': analysisResult['media_type'],
-        'search_query': searchQuery,
+        'search_query': analysisResult['search_query'] ?? 'media store',
       };
     } catch (e) {
       throw Exception('Failed to analyze and find stores: $e');
     }
   }
-}
\ No newline at end of file
+}
@@ -39,24 +39,33 @@ class _DiscoverPageState extends State<DiscoverPage> {
         throw Exception('Unable to get location. Please enable location services.');
       }
 
-      // Analyze image and find stores in one call
-      final result = await BackendService.analyzeAndFindStores(
+      // Analyze image and find stores in one call; show each part as it arrives
+      await for (final event in BackendService.snapToStore(
         image.path,
         position.latitude,
         position.longitude,
-      );
+      )) {
+        if (!mounted) return;
+        setState(() {
+          if (event['event'] == 'analysis') {
+            _analysisResult = event['data'];
+          } else if (event['event'] == 'stores') {
+            _storesResult = Map<String, dynamic>.from(event['data']);
+          } else if (event['event'] == 'route') {
+            _storesResult?['route_info'] = event['data']['route_info'];
+          }
+        });
+      }
 
       setState(() {
-        _analysisResult = result['analysis'];
-        _storesResult = result['stores'];
         _isAnalyzing = false;
       });
 
       // Show message if no media detected
-      if (result['analysis']['media_type'] == null) {
+      if (_analysisResult != null && _analysisResult!['media_type'] == null) {
         ScaffoldMessenger.of(context).showSnackBar(
           SnackBar(
-            content: Text(result['analysis']['message'] ?? 'No media detected in this image'),
+            content: Text(_analysisResult!['message'] ?? 'No media detected in this image'),
             backgroundColor: Colors.orange,
             duration: const Duration(seconds: 4),
           ),
@@ -1,44 +1,119 @@
 import logging
-from flask import Flask, request, jsonify
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+_startup_started = time.perf_counter()
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from werkzeug.utils import secure_filename
-import tempfile
 import os
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_cors import CORS
-from PIL import Image
-import torch
-from torchvision import models, transforms
-import os
+from PIL import UnidentifiedImageError
 from google.cloud import vision
 from googlemaps import Client as GoogleMaps
-import requests
 from dotenv import load_dotenv
-
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+from batching import MicroBatcher
+from result_cache import AnalysisCache, dhash
+import hashlib
+import hmac
+from ingest import InMemoryRequest, ingest_upload, preprocess_stats
+from local_model import LocalModel, load_class_names
+from media_matcher import MediaMatcher, STORE_TYPES
+from worker_pool import InferenceWorkerPool
+from http_client import PooledHTTPClient
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from profiler import ProfilerBusy, SamplingProfiler, TorchCapture
+from places_cache import PlacesCache, geohash_encode, normalize_query
+from routes import RoutePlanner, RouteRankingError
+from single_flight import SingleFlight
+import shm_storage  # noqa: F401 - registers the shm:// rate limit storage
+import log_pipeline
+import metrics
+from store_catalog import StoreCatalog
+from store_db import StoreDatabase
+
+# Configure logging: records are queued and formatted and written by a background thread
+load_dotenv()
+log_handlers = log_pipeline.configure(
+    level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+    fmt=os.getenv('LOG_FORMAT', 'json'),
+    asynchronous=os.getenv('LOG_ASYNC', 'True').lower() == 'true',
+    queue_size=int(os.getenv('LOG_QUEUE_SIZE', 10000)),
+    debug_sample_rate=float(os.getenv('LOG_DEBUG_SAMPLE_RATE', 0.01))
+)
 logger = logging.getLogger(__name__)
 
-load_dotenv()
+_imports_done = time.perf_counter()
 
 app = Flask(__name__)
+# Keep uploads in memory so /analyze can decode them without a temp file
+app.request_class = InMemoryRequest
 
 # Enable CORS for all routes
 CORS(app)
 
+# Request IDs, latency and in-flight counts per endpoint. Registered before the rate
+# limiter's hooks so rejected requests are counted too; streamed responses are
+# timed until the stream ends.
+@app.before_request
+def start_request_metrics():
+    g.request_id, g.log_tokens = log_pipeline.start_request(request.headers.get(log_pipeline.REQUEST_ID_HEADER))
+    g.metrics_endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.metrics_started = time.perf_counter()
+    metrics.requests_in_flight.inc(g.metrics_endpoint)
+
+@app.after_request
+def record_response_status(response):
+    g.metrics_status = response.status_code
+    response.headers[log_pipeline.REQUEST_ID_HEADER] = g.request_id
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    if 'metrics_started' not in g:
+        return
+    log_pipeline.end_request(g.log_tokens)
+    metrics.requests_in_flight.dec(g.metrics_endpoint)
+    metrics.request_seconds.observe(time.perf_counter() - g.metrics_started, g.metrics_endpoint,
+                                    str(g.get('metrics_status', 500)))
+
 # Security configurations
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
+# Byte budget and longest edge for images sent to Google Vision; larger uploads are
+# downscaled and re-encoded before the call
+VISION_MAX_BYTES = int(os.getenv('VISION_MAX_BYTES', 1024 * 1024))
+VISION_MAX_EDGE = int(os.getenv('VISION_MAX_EDGE', 1024))
+# Smallest decode that still feeds the local model's Resize(256)
+LOCAL_DECODE_EDGE = 256
+
+# Batch analysis: images per request, request body limit and threads decoding uploads in parallel
+ANALYZE_BATCH_MAX_IMAGES = int(os.getenv('ANALYZE_BATCH_MAX_IMAGES', 32))
+ANALYZE_BATCH_MAX_BYTES = int(os.getenv('ANALYZE_BATCH_MAX_BYTES', 64 * 1024 * 1024))
+InMemoryRequest.endpoint_max_content_length['analyze_batch'] = ANALYZE_BATCH_MAX_BYTES
+decode_executor = ThreadPoolExecutor(max_workers=int(os.getenv('ANALYZE_BATCH_DECODE_WORKERS', 4)), thread_name_prefix='decode')
+# Images per Vision images:annotate call; the API accepts at most 16
+VISION_BATCH_SIZE = min(16, max(1, int(os.getenv('VISION_BATCH_SIZE', 16))))
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# Rate limiting
+# Rate limiting, shared with the ASGI app (asgi_app.py)
+DEFAULT_RATE_LIMITS = ["200 per day", "50 per hour"]
+ANALYZE_RATE_LIMIT = "10 per minute"
+MAP_AI_RATE_LIMIT = "20 per minute"
+SNAP_TO_STORE_RATE_LIMIT = "10 per minute"
+ANALYZE_BATCH_RATE_LIMIT = "5 per minute"
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'True').lower() == 'true'
+# memory:// counts per process; shm:// (shm_storage.py) shares the counts between the processes on a host
+RATE_LIMIT_STORAGE_URI = os.getenv('RATE_LIMIT_STORAGE_URI', 'memory://')
 limiter = Limiter(
     get_remote_address,
     app=app,
-    default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://"
+    default_limits=DEFAULT_RATE_LIMITS,
+    storage_uri=RATE_LIMIT_STORAGE_URI,
+    enabled=RATE_LIMIT_ENABLED
 )
 
 # Initialize Google APIs (you'll need to set environment variables for API keys)
@@ -49,434 +124,1399 @@ except Exception as e:
     logger.warning(f"Google Vision API not configured: {e}")
     vision_client = None
 
+# Shared keep-alive HTTP client with timeouts and retries for the Vision REST and Maps APIs;
+# the ASGI app builds its async client from the same options
+http_client_options = dict(
+    pool_connections=int(os.getenv('HTTP_POOL_CONNECTIONS', 10)),
+    pool_maxsize=int(os.getenv('HTTP_POOL_MAXSIZE', 20)),
+    connect_timeout=float(os.getenv('HTTP_CONNECT_TIMEOUT', 3.05)),
+    read_timeout=float(os.getenv('HTTP_READ_TIMEOUT', 10)),
+    retries=int(os.getenv('HTTP_RETRIES', 2)),
+    backoff_factor=float(os.getenv('HTTP_BACKOFF_FACTOR', 0.25)),
+    gzip_requests=os.getenv('HTTP_GZIP_REQUESTS', 'False').lower() == 'true'
+)
+http_client = PooledHTTPClient(**http_client_options)
+
+# Circuit breakers: while a backend keeps failing, requests skip straight to the next fallback
+def make_breaker(name, slow_call_ms):
+    return CircuitBreaker(
+        name,
+        window_size=int(os.getenv('BREAKER_WINDOW_SIZE', 20)),
+        min_calls=int(os.getenv('BREAKER_MIN_CALLS', 5)),
+        failure_rate=float(os.getenv('BREAKER_FAILURE_RATE', 0.5)),
+        slow_call_ms=slow_call_ms,
+        open_seconds=float(os.getenv('BREAKER_OPEN_SECONDS', 30)),
+        half_open_probes=int(os.getenv('BREAKER_HALF_OPEN_PROBES', 1)),
+        on_call=lambda latency_ms, outcome: metrics.backend_seconds.observe(latency_ms / 1000.0, name, outcome)
+    )
+
+slow_call_ms = float(os.getenv('BREAKER_SLOW_CALL_MS', 8000))
+breakers = {
+    'vision_client': make_breaker('vision_client', slow_call_ms),
+    'vision_rest': make_breaker('vision_rest', slow_call_ms),
+    'maps_places': make_breaker('maps_places', slow_call_ms),
+    'maps_directions': make_breaker('maps_directions', slow_call_ms),
+    'maps_distance_matrix': make_breaker('maps_distance_matrix', slow_call_ms),
+}
+
 # Alternative: Use Vision API with REST calls (more reliable with API key)
 vision_api_key = os.getenv('GOOGLE_VISION_API_KEY')
-vision_rest_url = "https://vision.googleapis.com/v1/images:annotate"
+vision_rest_url = os.getenv('VISION_REST_URL', "https://vision.googleapis.com/v1/images:annotate")
+# Maps web service root; pointed at a local stand-in by the benchmarks (bench/fake_google.py)
+MAPS_BASE_URL = os.getenv('MAPS_BASE_URL', 'https://maps.googleapis.com')
 
 gmaps_key = os.getenv('GOOGLE_MAPS_API_KEY')
 if not gmaps_key:
     logger.warning("Google Maps API key not found in environment variables")
     gmaps = None
 else:
-    gmaps = GoogleMaps(key=gmaps_key)
+    gmaps = GoogleMaps(
+        key=gmaps_key,
+        requests_session=http_client.session,
+        connect_timeout=http_client.timeout[0],
+        read_timeout=http_client.timeout[1],
+        retry_timeout=float(os.getenv('MAPS_RETRY_TIMEOUT', 10)),
+        base_url=MAPS_BASE_URL
+    )
     logger.info("Google Maps API client initialized successfully")
 
-# Fallback to local model if Google Vision fails
-model = models.resnet50(pretrained=True)
-model.eval()
-
-# Load ImageNet class names for better fallback results
-try:
-    import urllib.request
-    url = "https://raw.githubusercontent.com/pytorch/hub/master/imagenet_classes.txt"
-    with urllib.request.urlopen(url) as f:
-        classes = [line.decode('utf-8').strip() for line in f.readlines()]
-    logger.info("ImageNet classes loaded successfully")
-except Exception as e:
-    logger.warning(f"Could not load ImageNet classes: {e}")
-    classes = None
-
-def classify_media_type(labels):
-    """Classify the type of media from image labels - strictly media only"""
-    media_keywords = {
-        'book': ['book', 'novel', 'magazine', 'comic', 'textbook', 'paperback', 'hardcover', 'literature', 'library', 'reading'],
-        'movie': ['movie', 'film', 'cinema', 'dvd', 'bluray', 'video', 'poster', 'screen', 'hollywood', 'cinematic'],
-        'game': ['video game', 'gaming', 'console', 'controller', 'joystick', 'arcade', 'playstation', 'xbox', 'nintendo', 'gaming console'],
-        'music': ['cd', 'vinyl', 'album', 'record', 'cassette', 'audio', 'music', 'instrument', 'spotify', 'itunes'],
-        'software': ['software', 'program', 'application', 'computer program', 'digital media', 'app store']
-    }
+# Media keyword matcher, compiled once; also maps every ImageNet class to a media type
+media_matcher = MediaMatcher()
+imagenet_classes = load_class_names()
+# Total probability the local model must put on a media type's classes to report it
+LOCAL_MEDIA_MIN_SCORE = float(os.getenv('LOCAL_MEDIA_MIN_SCORE', 0.05))
+
+# Optional pool of inference worker processes; 0 runs the model in this process
+inference_workers = int(os.getenv('INFERENCE_WORKERS', 0))
+
+# Fallback to local model if Google Vision fails. torch is imported and the weights are
+# loaded off the import path: in a background thread by default, or on first use.
+# With inference workers this process only preprocesses, single-threaded, and each
+# worker warms up its own copy after forking (see InferenceWorkerPool)
+local_model = LocalModel(
+    class_names=imagenet_classes,
+    class_groups=media_matcher.imagenet_table(imagenet_classes) if imagenet_classes else None,
+    weights_path=os.getenv('RESNET50_WEIGHTS', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models', 'resnet50.pth')),
+    allow_download=os.getenv('MODEL_ALLOW_DOWNLOAD', 'True').lower() == 'true',
+    backend=os.getenv('INFERENCE_BACKEND', 'eager'),
+    channels_last=os.getenv('INFERENCE_CHANNELS_LAST', 'False').lower() == 'true',
+    quantized_path=os.getenv('QUANTIZED_MODEL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models', 'resnet50_int8.pt')),
+    threads=1 if inference_workers > 0 else None,
+    warmup=inference_workers == 0
+)
+if os.getenv('MODEL_PRELOAD', 'True').lower() == 'true':
+    local_model.start()
+
+if inference_workers > 0:
+    inference_pool = InferenceWorkerPool(
+        local_model,
+        workers=inference_workers,
+        threads_per_worker=int(os.getenv('INFERENCE_THREADS_PER_WORKER', 0)) or None,
+        affinity=os.getenv('INFERENCE_CPU_AFFINITY', 'auto')
+    )
+    if os.getenv('MODEL_PRELOAD', 'True').lower() == 'true':
+        threading.Thread(target=inference_pool.start, name='inference-pool-start', daemon=True).start()
+else:
+    inference_pool = None
+
+def run_inference_batch(tensors):
+    started = time.perf_counter()
+    predictions = inference_pool.run_batch(tensors) if inference_pool else local_model.run_batch(tensors)
+    metrics.stage_seconds.observe(time.perf_counter() - started, 'local_inference')
+    return predictions
+
+# Micro-batching for local inference: concurrent requests share one forward pass
+inference_batcher = MicroBatcher(
+    run_inference_batch,
+    max_batch_size=int(os.getenv('INFERENCE_MAX_BATCH_SIZE', 8)),
+    max_wait_ms=float(os.getenv('INFERENCE_MAX_WAIT_MS', 5)),
+    name='inference',
+    concurrency=inference_workers or 1
+)
 
-    labels_lower = [label.lower() for label in labels]
-    labels_text = ' '.join(labels_lower)
+# Cache of analysis results so re-snapping the same cover skips Vision and the local model
+analysis_cache = AnalysisCache(
+    max_entries=int(os.getenv('ANALYSIS_CACHE_MAX_ENTRIES', 1024)),
+    max_bytes=int(os.getenv('ANALYSIS_CACHE_MAX_BYTES', 8 * 1024 * 1024)),
+    ttl_seconds=float(os.getenv('ANALYSIS_CACHE_TTL_SECONDS', 3600)),
+    max_distance=int(os.getenv('ANALYSIS_CACHE_MAX_DISTANCE', 4))
+)
 
-    # Check for media-specific keywords first
-    for media_type, keywords in media_keywords.items():
-        if any(keyword in labels_text for keyword in keywords):
-            return media_type
+# Places results shared by everyone searching from the same geohash cell
+places_cache = PlacesCache(
+    precision=int(os.getenv('PLACES_CACHE_PRECISION', 6)),
+    max_entries=int(os.getenv('PLACES_CACHE_MAX_ENTRIES', 2048)),
+    ttl_seconds=float(os.getenv('PLACES_CACHE_TTL_SECONDS', 900)),
+    stale_seconds=float(os.getenv('PLACES_CACHE_STALE_SECONDS', 3600))
+)
+# Extra Places result pages are fetched in the background while the current request ranks routes
+PLACES_MAX_PAGES = int(os.getenv('PLACES_MAX_PAGES', 1))
+maps_executor = ThreadPoolExecutor(max_workers=int(os.getenv('MAPS_BACKGROUND_WORKERS', 2)), thread_name_prefix='maps')
+
+# Optionally search Places for every store keyword of the media type at once; searches that
+# miss the deadline are left to finish in the background and fill the cache
+PLACES_FAN_OUT = os.getenv('PLACES_FAN_OUT', 'False').lower() == 'true'
+PLACES_FAN_OUT_DEADLINE = float(os.getenv('PLACES_FAN_OUT_DEADLINE_MS', 2500)) / 1000.0
+# How much closer a 5-star store counts when ranking fanned-out results (0.3 = 30% closer)
+PLACES_RATING_WEIGHT = float(os.getenv('PLACES_RATING_WEIGHT', 0.3))
+places_executor = ThreadPoolExecutor(max_workers=int(os.getenv('PLACES_FAN_OUT_WORKERS', 8)), thread_name_prefix='places')
+
+# Every store Places has returned, indexed for nearest-store queries; also serves searches while Places is down
+store_catalog = StoreCatalog(
+    cell_degrees=float(os.getenv('STORE_CATALOG_CELL_DEGREES', 0.05)),
+    max_stores=int(os.getenv('STORE_CATALOG_MAX_STORES', 100000))
+)
+STORE_SEARCH_RADIUS_KM = float(os.getenv('STORE_SEARCH_RADIUS_KM', 10))
+
+# Local store database built with ingest_stores.py. STORE_SOURCE=auto uses it when Maps isn't
+# configured or Places finds nothing, local uses only it, places never uses it
+STORE_SOURCE = os.getenv('STORE_SOURCE', 'auto').lower()
+STORE_DB_PATH = os.getenv('STORE_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'stores.db'))
+store_db = None
+if STORE_SOURCE != 'places' and os.path.exists(STORE_DB_PATH):
+    try:
+        store_db = StoreDatabase(STORE_DB_PATH, pool_size=int(os.getenv('STORE_DB_POOL_SIZE', 4)))
+        logger.info(f"Store database loaded from {STORE_DB_PATH} ({store_db.store_count} stores)")
+    except Exception as e:
+        logger.error(f"Could not open store database {STORE_DB_PATH}: {e}")
+
+# Travel-time ranking and directions, cached per origin area
+ROUTE_CANDIDATES = int(os.getenv('ROUTE_CANDIDATES', 10))
+route_planner = RoutePlanner(
+    gmaps,
+    matrix_breaker=breakers['maps_distance_matrix'],
+    directions_breaker=breakers['maps_directions'],
+    origin_precision=int(os.getenv('ROUTE_ORIGIN_PRECISION', 7)),
+    mode=os.getenv('ROUTE_MODE', 'driving'),
+    max_entries=int(os.getenv('ROUTE_CACHE_MAX_ENTRIES', 4096)),
+    ttl_seconds=float(os.getenv('ROUTE_CACHE_TTL_SECONDS', 600))
+)
 
-    # Additional checks for media-related terms
-    media_indicators = ['media', 'entertainment', 'digital', 'content', 'multimedia']
-    if any(indicator in labels_text for indicator in media_indicators):
-        return 'media'
+# Concurrent identical /analyze uploads (same bytes) and /map-ai searches (same
+# origin cell, query and media type) share one computation
+SINGLE_FLIGHT = os.getenv('SINGLE_FLIGHT', 'True').lower() == 'true'
+MAP_COALESCE_PRECISION = int(os.getenv('MAP_COALESCE_PRECISION', route_planner.origin_precision))
+analyze_flight = SingleFlight('analyze', enabled=SINGLE_FLIGHT)
+map_flight = SingleFlight('map', enabled=SINGLE_FLIGHT)
 
-    # If no media detected, return None to indicate non-media
-    return None
+def classify_media_type(labels, confidences=None):
+    """Classify the type of media from image labels - strictly media only"""
+    return media_matcher.classify(labels, confidences)
 
 def generate_store_search_query(media_type, labels):
     """Generate appropriate store search query based on media type"""
-    store_types = {
-        'book': ['bookstore', 'library', 'book shop', 'barnes & noble', 'books'],
-        'movie': ['video store', 'movie rental', 'blockbuster', 'redbox', 'dvd store'],
-        'game': ['game store', 'gaming store', 'gamestop', 'electronic store', 'toy store'],
-        'music': ['music store', 'record store', 'cd store', 'instrument store'],
-        'software': ['electronics store', 'computer store', 'best buy', 'software store'],
-        'media': ['media store', 'electronics', 'department store']
-    }
-
     # Get relevant store types for this media
-    relevant_stores = store_types.get(media_type, store_types['media'])
+    relevant_stores = STORE_TYPES.get(media_type, STORE_TYPES['media'])
 
     # Try to use specific labels if they match store types
-    for label in labels[:2]:  # Check top 2 labels
-        label_lower = label.lower()
-        if any(store in label_lower for store in ['bookstore', 'library', 'video store', 'game store', 'music store']):
-            return label_lower
+    store_label = media_matcher.store_label(labels)
+    if store_label:
+        return store_label
 
     # Return primary store type for this media
     return relevant_stores[0]
 
-@app.route('/analyze', methods=['POST'])
-@limiter.limit("10 per minute")
-def analyze():
-    try:
-        logger.info("Received image analysis request")
-        if 'file' not in request.files:
-            logger.error("No file provided in request")
-            return jsonify({'success': False, 'error': 'No file provided'}), 400
+def media_type_for_query(query):
+    """Media type a store search query is looking for, or None for any media store"""
+    query = normalize_query(query)
+    for media_type, store_types in STORE_TYPES.items():
+        if query in store_types:
+            return None if media_type == 'media' else media_type
+    media_type = media_matcher.classify([query])
+    return None if media_type == 'media' else media_type
+
+class RequestError(Exception):
+    """Ends a request early with an error response"""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+def upload_error(file):
+    """(error payload, status) for a missing or unacceptable upload, None if it is fine"""
+    if file is None:
+        logger.error("No file provided in request")
+        return {'success': False, 'error': 'No file provided'}, 400
+    if file.filename == '':
+        logger.error("Empty filename provided")
+        return {'success': False, 'error': 'No file selected'}, 400
+    if not allowed_file(file.filename):
+        logger.error(f"Invalid file type: {file.filename}")
+        return {'success': False, 'error': 'Invalid file type. Allowed: png, jpg, jpeg, gif, bmp, webp'}, 400
+    return None
 
-        file = request.files['file']
-        if file.filename == '':
-            logger.error("Empty filename provided")
-            return jsonify({'success': False, 'error': 'No file selected'}), 400
+def analysis_response(top_labels, confidence_scores, media_type, fallback, cached=False):
+    """The /analyze JSON payload for an analysis result"""
+    if media_type is None:
+        logger.info(f"Analysis completed - no media detected in image. Labels: {top_labels}")
+        return {
+            'success': True,
+            'labels': top_labels,
+            'confidence': confidence_scores,
+            'media_type': None,
+            'message': 'No media detected in this image. Please try an image of books, movies, games, music, or other media.',
+            'fallback': fallback,
+            'cached': cached
+        }
 
-        if not allowed_file(file.filename):
-            logger.error(f"Invalid file type: {file.filename}")
-            return jsonify({'success': False, 'error': 'Invalid file type. Allowed: png, jpg, jpeg, gif, bmp, webp'}), 400
+    search_query = generate_store_search_query(media_type, top_labels)
+
+    logger.info(f"Analysis completed successfully. Labels: {len(top_labels)}, Media type: {media_type}, Search query: {search_query}, Fallback used: {fallback}, Cached: {cached}")
+    return {
+        'success': True,
+        'labels': top_labels,
+        'confidence': confidence_scores,
+        'media_type': media_type,
+        'search_query': search_query,
+        'fallback': fallback,
+        'cached': cached
+    }
 
-        # Secure the filename and save temporarily
-        filename = secure_filename(file.filename)
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(filename)[1]) as temp_file:
-            file.save(temp_file.name)
-            temp_path = temp_file.name
+def cached_analysis_response(result):
+    return analysis_response(
+        result['top_labels'], result['confidence_scores'], result['media_type'], result['fallback'], cached=True
+    )
+
+def upload_digest(ingested):
+    return hashlib.sha256(ingested.raw).hexdigest()
+
+def prepare_analysis(ingested, filename, digest=None):
+    """Decode an ingested upload, checking the analysis cache along the way.
+
+    Returns (digest, phash, cached payload or None); phash is None on an exact
+    cache hit. Raises RequestError if the image can't be read.
+    """
+    digest = digest or upload_digest(ingested)
+    cached = analysis_cache.get(digest)
+    if cached is not None:
+        log_pipeline.debug(logger, "Analysis cache hit (exact) for %s", filename)
+        metrics.label_sources.inc('cache')
+        return digest, None, cached_analysis_response(cached)
+
+    # Decode only as large as the biggest consumer needs: Vision if it may be
+    # called, otherwise the local model
+    vision_configured = vision_client is not None or bool(vision_api_key)
+    try:
+        ingested.decode(VISION_MAX_EDGE if vision_configured else LOCAL_DECODE_EDGE)
+    except (UnidentifiedImageError, OSError) as e:
+        logger.error(f"Could not decode image {filename}: {e}")
+        raise RequestError('Could not read image file', 400)
+    log_pipeline.debug(logger, "Processing image: %s (%s, %d bytes)", filename, ingested.format, len(ingested.raw))
+
+    # Near-duplicate lookup: the same cover photographed again
+    phash = dhash(ingested.image)
+    cached = analysis_cache.find_similar(phash)
+    if cached is not None:
+        log_pipeline.debug(logger, "Analysis cache hit (perceptual) for %s", filename)
+        metrics.label_sources.inc('cache')
+        analysis_cache.put(digest, phash, cached)
+        return digest, phash, cached_analysis_response(cached)
+    return digest, phash, None
+
+def vision_rest_request(ingested):
+    import base64
+    image_base64 = base64.b64encode(ingested.vision_content()).decode('utf-8')
+
+    return {
+        "image": {"content": image_base64},
+        "features": [{"type": "LABEL_DETECTION", "maxResults": 5}]
+    }
 
+def vision_rest_payload(ingested):
+    return {"requests": [vision_rest_request(ingested)]}
+
+def rest_response_labels(response):
+    """(labels, confidences) from one response of a Vision REST annotate call"""
+    labels = response.get('labelAnnotations', [])
+    if labels:
+        metrics.label_sources.inc('vision_rest')
+    return [label['description'] for label in labels[:5]], [label['score'] for label in labels[:5]]
+
+def client_response_labels(response):
+    """(labels, confidences) from one AnnotateImageResponse of the Vision client"""
+    labels = response.label_annotations
+    if labels:
+        metrics.label_sources.inc('vision_client')
+    return [label.description for label in labels[:5]], [label.score for label in labels[:5]]
+
+def vision_rest_labels(permit, status_code, call_ms, read_json):
+    """Record a Vision REST call with its breaker and extract (labels, confidences) from its JSON"""
+    if status_code != 200:
+        breakers['vision_rest'].record_failure(permit, call_ms, f"HTTP {status_code}")
+        logger.error(f"Vision API REST returned HTTP {status_code}")
+        return [], []
+
+    breakers['vision_rest'].record_success(permit, call_ms)
+    result = read_json()
+    if 'responses' in result and result['responses']:
+        top_labels, confidence_scores = rest_response_labels(result['responses'][0])
+        if top_labels:
+            log_pipeline.debug(logger, "Vision API (REST) detected %d labels", len(result['responses'][0]['labelAnnotations']))
+            return top_labels, confidence_scores
+    return [], []
+
+def vision_client_batch(ingested_images):
+    """Labels for each image from the Vision client, in images:annotate calls of VISION_BATCH_SIZE.
+
+    Returns ([(labels, confidences)] per image, [whether the client answered] per
+    image). Images in chunks that failed or weren't sent get empty labels and False,
+    while earlier chunks keep their labels.
+    """
+    results = [([], [])] * len(ingested_images)
+    answered = [False] * len(ingested_images)
+    if vision_client is None:
+        return results, answered
+    for start in range(0, len(ingested_images), VISION_BATCH_SIZE):
+        chunk = ingested_images[start:start + VISION_BATCH_SIZE]
+        requests_ = [{
+            'image': vision.Image(content=ingested.vision_content()),
+            'features': [{'type_': vision.Feature.Type.LABEL_DETECTION}]
+        } for ingested in chunk]
+        permit = breakers['vision_client'].allow()
+        if permit is None:
+            logger.info("Google Vision client circuit is open, skipping to REST fallback")
+            return results, answered
+        call_started = time.perf_counter()
         try:
-            image = Image.open(temp_path)
-            # Always convert to RGB to ensure compatibility with JPEG format
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            logger.info(f"Processing image: {filename}")
-        finally:
-            # Clean up temporary file
-            try:
-                os.unlink(temp_path)
-            except OSError:
-                pass
-
-        # Convert PIL image to bytes for Google Vision
-        from io import BytesIO
-        img_byte_arr = BytesIO()
-        image.save(img_byte_arr, format='JPEG')
-        content = img_byte_arr.getvalue()
-
-        top_labels = []
-        confidence_scores = []
-        # Initialize vision_client_available to avoid UnboundLocalError
-        vision_client_available = False
-        if 'vision_client' in globals() and vision_client is not None:
-            vision_client_available = True
-
-        # Try Google Vision API first (with service account or API key)
-        if vision_client_available:
-            try:
-                # Create Google Vision image object
-                vision_image = vision.Image(content=content)
+            response = vision_client.batch_annotate_images(requests=requests_)
+        except Exception as e:
+            breakers['vision_client'].record_failure(permit, (time.perf_counter() - call_started) * 1000.0, e)
+            logger.error(f"Google Vision API batch error: {e}")
+            return results, answered
+        breakers['vision_client'].record_success(permit, (time.perf_counter() - call_started) * 1000.0)
+        answered[start:start + len(chunk)] = [True] * len(chunk)
+        for offset, image_response in enumerate(response.responses):
+            if image_response.error.message:
+                logger.warning(f"Google Vision error for batch image {start + offset}: {image_response.error.message}")
+            else:
+                results[start + offset] = client_response_labels(image_response)
+    logger.info(f"Google Vision labelled {sum(1 for labels, _ in results if labels)} of {len(results)} images")
+    return results, answered
+
+def vision_rest_batch(ingested_images):
+    """Labels for each image from Vision REST, in images:annotate calls of VISION_BATCH_SIZE"""
+    results = [([], [])] * len(ingested_images)
+    for start in range(0, len(ingested_images), VISION_BATCH_SIZE):
+        chunk = ingested_images[start:start + VISION_BATCH_SIZE]
+        payload = {"requests": [vision_rest_request(ingested) for ingested in chunk]}
+        permit = breakers['vision_rest'].allow()
+        if permit is None:
+            logger.info("Vision REST circuit is open, skipping to local model")
+            break
+        call_started = time.perf_counter()
+        try:
+            response = http_client.post_json(vision_rest_url, payload, params={'key': vision_api_key})
+        except Exception as e:
+            breakers['vision_rest'].record_failure(permit, (time.perf_counter() - call_started) * 1000.0, e)
+            logger.error(f"Vision API REST batch error: {e}")
+            break
+        call_ms = (time.perf_counter() - call_started) * 1000.0
+        if response.status_code != 200:
+            breakers['vision_rest'].record_failure(permit, call_ms, f"HTTP {response.status_code}")
+            logger.error(f"Vision API REST returned HTTP {response.status_code}")
+            break
+        breakers['vision_rest'].record_success(permit, call_ms)
+        for offset, image_response in enumerate(response.json().get('responses', [])):
+            results[start + offset] = rest_response_labels(image_response)
+    return results
+
+def detect_labels_vision_batch(ingested_images):
+    """detect_labels_vision for many images: [(labels, confidences)] and [whether the client answered] per image"""
+    if vision_client is not None or vision_api_key:
+        # Re-encode oversized images for Vision in parallel before the calls
+        list(decode_executor.map(lambda ingested: ingested.vision_content(), ingested_images))
+    results, client_answered = vision_client_batch(ingested_images)
+    missing = [i for i, (labels, _) in enumerate(results) if not labels]
+    if missing and vision_api_key:
+        for i, labels in zip(missing, vision_rest_batch([ingested_images[i] for i in missing])):
+            results[i] = labels
+    return results, client_answered
+
+def run_vision_batch(ingested_images):
+    """MicroBatcher run_batch: (labels, confidences, vision_client_available) per image"""
+    results, client_answered = detect_labels_vision_batch(ingested_images)
+    return [(top_labels, confidence_scores, available)
+            for (top_labels, confidence_scores), available in zip(results, client_answered)]
+
+# Vision label requests from concurrent requests are aggregated into shared images:annotate
+# calls, waiting at most VISION_AGGREGATE_MAX_WAIT_MS for others to join
+vision_batcher = MicroBatcher(
+    run_vision_batch,
+    max_batch_size=min(16, int(os.getenv('VISION_AGGREGATE_MAX_BATCH_SIZE', 16))),
+    max_wait_ms=float(os.getenv('VISION_AGGREGATE_MAX_WAIT_MS', 5)),
+    name='vision',
+    concurrency=int(os.getenv('VISION_AGGREGATE_CONCURRENCY', 4))
+) if os.getenv('VISION_AGGREGATE', 'True').lower() == 'true' and (vision_client is not None or vision_api_key) else None
+
+def detect_labels_vision(ingested):
+    """Labels from Google Vision: the client library first, then REST with the API key.
+
+    Returns (labels, confidences, vision_client_available); the labels are empty when
+    neither produced any.
+    """
+    if vision_batcher is not None:
+        try:
+            # Re-encode in this request's thread, then share a Vision call with concurrent requests
+            ingested.vision_content()
+            return vision_batcher.process(ingested)
+        except Exception as e:
+            logger.error(f"Aggregated Vision call failed: {e}")
+            return [], [], False
+
+    top_labels = []
+    confidence_scores = []
+    # Initialize vision_client_available to avoid UnboundLocalError
+    vision_client_available = False
+    client_permit = None
+    if 'vision_client' in globals() and vision_client is not None:
+        # Create Google Vision image object before asking the breaker, so a failed
+        # re-encode can't hold on to a half-open probe. The original upload is
+        # reused unless Vision can't take it as-is
+        try:
+            vision_image = vision.Image(content=ingested.vision_content())
+        except Exception as e:
+            logger.error(f"Could not prepare image for Google Vision: {e}")
+        else:
+            client_permit = breakers['vision_client'].allow()
+            vision_client_available = client_permit is not None
+            if not vision_client_available:
+                logger.info("Google Vision client circuit is open, skipping to REST fallback")
 
-                # Perform label detection
+    # Try Google Vision API first (with service account or API key)
+    if vision_client_available:
+        try:
+            # Perform label detection
+            call_started = time.perf_counter()
+            try:
                 response = vision_client.label_detection(image=vision_image)
-                labels = response.label_annotations
-
-                # Extract top labels
-                if labels:
-                    top_labels = [label.description for label in labels[:5]]
-                    confidence_scores = [label.score for label in labels[:5]]
-                    logger.info(f"Google Vision detected {len(labels)} labels")
-                else:
-                    logger.warning("Google Vision returned no labels")
             except Exception as e:
-                logger.error(f"Google Vision API error: {e}")
-                vision_client_available = False  # Disable for this request
-        else:
-            logger.info("Google Vision API not available, skipping to fallback")
-
-        # Fallback: Use Vision API via REST if service account failed
-        if not top_labels and vision_api_key:
+                breakers['vision_client'].record_failure(client_permit, (time.perf_counter() - call_started) * 1000.0, e)
+                raise
+            except BaseException:
+                breakers['vision_client'].release(client_permit)
+                raise
+            breakers['vision_client'].record_success(client_permit, (time.perf_counter() - call_started) * 1000.0)
+
+            # Extract top labels
+            top_labels, confidence_scores = client_response_labels(response)
+            if top_labels:
+                log_pipeline.debug(logger, "Google Vision detected %d labels", len(response.label_annotations))
+            else:
+                logger.warning("Google Vision returned no labels")
+        except Exception as e:
+            logger.error(f"Google Vision API error: {e}")
+            vision_client_available = False  # Disable for this request
+    else:
+        log_pipeline.debug(logger, "Google Vision API not available, skipping to fallback")
+
+    # Fallback: Use Vision API via REST if service account failed
+    payload = None
+    if not top_labels and vision_api_key:
+        try:
+            payload = vision_rest_payload(ingested)
+        except Exception as e:
+            logger.error(f"Could not prepare image for Vision API REST: {e}")
+    rest_permit = breakers['vision_rest'].allow() if payload is not None else None
+    if payload is not None and rest_permit is None:
+        logger.info("Vision REST circuit is open, skipping to local model")
+    elif rest_permit is not None:
+        try:
+            call_started = time.perf_counter()
             try:
-                import base64
-                image_base64 = base64.b64encode(content).decode('utf-8')
-
-                payload = {
-                    "requests": [{
-                        "image": {"content": image_base64},
-                        "features": [{"type": "LABEL_DETECTION", "maxResults": 5}]
-                    }]
-                }
-
-                response = requests.post(
-                    f"{vision_rest_url}?key={vision_api_key}",
-                    json=payload,
-                    headers={'Content-Type': 'application/json'}
-                )
-
-                if response.status_code == 200:
-                    result = response.json()
-                    if 'responses' in result and result['responses']:
-                        labels = result['responses'][0].get('labelAnnotations', [])
-                        if labels:
-                            top_labels = [label['description'] for label in labels[:5]]
-                            confidence_scores = [label['score'] for label in labels[:5]]
-                            logger.info(f"Vision API (REST) detected {len(labels)} labels")
+                response = http_client.post_json(vision_rest_url, payload, params={'key': vision_api_key})
             except Exception as e:
-                logger.error(f"Vision API REST error: {e}")
-
-        # Enhanced fallback to local model if Vision API fails or not configured
+                breakers['vision_rest'].record_failure(rest_permit, (time.perf_counter() - call_started) * 1000.0, e)
+                raise
+            except BaseException:
+                breakers['vision_rest'].release(rest_permit)
+                raise
+            call_ms = (time.perf_counter() - call_started) * 1000.0
+            top_labels, confidence_scores = vision_rest_labels(rest_permit, response.status_code, call_ms, response.json)
+        except Exception as e:
+            logger.error(f"Vision API REST error: {e}")
+
+    return top_labels, confidence_scores, vision_client_available
+
+def local_model_input(ingested):
+    log_pipeline.debug(logger, "No labels from Vision API, attempting local model fallback")
+    started = time.perf_counter()
+    img_t = local_model.preprocess(ingested.rgb)
+    metrics.stage_seconds.observe(time.perf_counter() - started, 'local_preprocess')
+    log_pipeline.debug(logger, "Image tensor shape: %s", img_t.shape)
+    return img_t
+
+def local_model_labels(prediction):
+    """(labels, confidences, media scores) from a local model prediction"""
+    top_probs, top_classes, local_media_scores = prediction
+    log_pipeline.debug(logger, "Top probabilities: %s, classes: %s", top_probs, top_classes)
+
+    # Map to ImageNet classes
+    if local_model.class_names:
+        class_names = [local_model.class_names[i] for i in top_classes]
+        log_pipeline.debug(logger, "Mapped to class names: %s", class_names)
+    else:
+        class_names = [f'Predicted Class {i}' for i in top_classes]
+        logger.warning("ImageNet classes not loaded, using generic names")
+
+    return class_names, list(top_probs), local_media_scores
+
+def local_model_error(e):
+    logger.error(f"Local model fallback failed: {str(e)}", exc_info=True)
+    # Return a generic error response
+    return RequestError(f'Image analysis failed: {str(e)}', 500)
+
+def finish_analysis(filename, ingested, digest, phash, top_labels, confidence_scores, local_media_scores,
+                    vision_client_available):
+    """Classify the media type, cache the result and build the response payload"""
+    # Classify media type from labels - strictly media only
+    if local_media_scores is not None:
+        metrics.label_sources.inc('local_model')
+        # Local model: total softmax probability over each media type's ImageNet classes
+        best = max(range(len(local_media_scores)), key=local_media_scores.__getitem__)
+        media_type = media_matcher.media_types[best] if local_media_scores[best] >= LOCAL_MEDIA_MIN_SCORE else None
+        log_pipeline.debug(logger, "Local media scores for %s: %s", media_matcher.media_types, local_media_scores)
+    else:
+        media_type = classify_media_type(top_labels, confidence_scores)
         if not top_labels:
-            logger.info("No labels from Vision API, attempting local model fallback")
-            try:
-                transform = transforms.Compose([
-                    transforms.Resize(256),
-                    transforms.CenterCrop(224),
-                    transforms.ToTensor(),
-                    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-                ])
-                logger.info("Applying image transformations")
-                img_t = transform(image).unsqueeze(0)
-                logger.info(f"Image tensor shape: {img_t.shape}")
-
-                with torch.no_grad():
-                    logger.info("Running model inference")
-                    outputs = model(img_t)
-                    probabilities = torch.nn.functional.softmax(outputs[0], dim=0)
-                    top_probs, top_classes = torch.topk(probabilities, 5)
-                    logger.info(f"Top probabilities: {top_probs}")
-                    logger.info(f"Top classes: {top_classes}")
-
-                # Map to ImageNet classes
-                if classes:
-                    class_names = [classes[i.item()] for i in top_classes]
-                    logger.info(f"Mapped to class names: {class_names}")
-                else:
-                    class_names = [f'Predicted Class {i.item()}' for i in top_classes]
-                    logger.warning("ImageNet classes not loaded, using generic names")
-
-                top_labels = class_names
-                confidence_scores = [prob.item() for prob in top_probs]
-                logger.info("Fallback to local ResNet model completed successfully")
+            metrics.label_sources.inc('none')
 
-            except Exception as e:
-                logger.error(f"Local model fallback failed: {str(e)}", exc_info=True)
-                # Return a generic error response
-                return jsonify({'success': False, 'error': f'Image analysis failed: {str(e)}'}), 500
-
-        # Classify media type from labels - strictly media only
-        media_type = classify_media_type(top_labels)
-
-        if media_type is None:
-            logger.info(f"Analysis completed - no media detected in image. Labels: {top_labels}")
-            return jsonify({
-                'success': True,
-                'labels': top_labels,
-                'confidence': confidence_scores,
-                'media_type': None,
-                'message': 'No media detected in this image. Please try an image of books, movies, games, music, or other media.',
-                'fallback': not vision_client_available or not top_labels
-            })
-
-        search_query = generate_store_search_query(media_type, top_labels)
-
-        logger.info(f"Analysis completed successfully. Labels: {len(top_labels)}, Media type: {media_type}, Search query: {search_query}, Fallback used: {not vision_client_available or not top_labels}")
-        return jsonify({
-            'success': True,
-            'labels': top_labels,
-            'confidence': confidence_scores,
-            'media_type': media_type,
-            'search_query': search_query,
-            'fallback': not vision_client_available or not top_labels
-        })
+    fallback = not vision_client_available or not top_labels
+
+    log_pipeline.debug(logger, "Preprocessed %s: decoded %s at %s in %.1f ms, Vision payload saved %d bytes",
+                       filename, ingested.original_size, ingested.image.size, ingested.decode_ms, ingested.bytes_saved)
+
+    analysis_cache.put(digest, phash, {
+        'top_labels': top_labels,
+        'confidence_scores': confidence_scores,
+        'media_type': media_type,
+        'fallback': fallback
+    })
+
+    return analysis_response(top_labels, confidence_scores, media_type, fallback)
+
+def run_analysis(file):
+    """Analyze an uploaded image; returns the /analyze payload or raises RequestError"""
+    error = upload_error(file)
+    if error:
+        raise RequestError(error[0]['error'], error[1])
+
+    # Decode straight from the in-memory upload, no temporary file
+    filename = secure_filename(file.filename)
+    ingested = ingest_upload(file, VISION_MAX_BYTES, VISION_MAX_EDGE)
+    digest = upload_digest(ingested)
+    return analyze_flight.do(digest, analyze_ingested, ingested, filename, digest)
+
+def analyze_ingested(ingested, filename, digest):
+    """The /analyze payload for an ingested upload; raises RequestError"""
+    digest, phash, cached = prepare_analysis(ingested, filename, digest)
+    if cached is not None:
+        return cached
+
+    top_labels, confidence_scores, vision_client_available = detect_labels_vision(ingested)
+
+    # Enhanced fallback to local model if Vision API fails or not configured
+    local_media_scores = None
+    if not top_labels:
+        try:
+            prediction = inference_batcher.process(local_model_input(ingested))
+            top_labels, confidence_scores, local_media_scores = local_model_labels(prediction)
+        except Exception as e:
+            raise local_model_error(e)
+
+    return finish_analysis(filename, ingested, digest, phash, top_labels, confidence_scores,
+                           local_media_scores, vision_client_available)
+
+@app.route('/analyze', methods=['POST'])
+@limiter.limit(ANALYZE_RATE_LIMIT)
+def analyze():
+    try:
+        logger.info("Received image analysis request")
+        return jsonify(run_analysis(request.files.get('file')))
 
+    except RequestError as e:
+        return jsonify({'success': False, 'error': e.message}), e.status
     except Exception as e:
         logger.error(f"Error in analyze endpoint: {str(e)}", exc_info=True)
         return jsonify({'success': False, 'error': 'Internal server error'}), 500
 
-@app.route('/map-ai', methods=['POST'])
-@limiter.limit("20 per minute")
-def map_ai():
-    try:
-        logger.info("Received map AI request")
-        data = request.get_json()
-        if not data:
-            logger.error("No JSON data provided")
-            return jsonify({'success': False, 'error': 'No data provided'}), 400
-
-        user_lat = data.get('lat')
-        user_lng = data.get('lng')
-        if user_lat is None or user_lng is None:
-            logger.error("Missing latitude or longitude")
-            return jsonify({'success': False, 'error': 'Latitude and longitude are required'}), 400
-
-        # Validate coordinate ranges
+def ingest_for_batch(file, ingest):
+    """(filename, ingested, digest, phash, cached payload) for one batch upload; raises RequestError"""
+    error = upload_error(file)
+    if error:
+        raise RequestError(error[0]['error'], error[1])
+    filename = secure_filename(file.filename)
+    ingested = ingest(file)
+    return (filename, ingested) + prepare_analysis(ingested, filename)
+
+def run_analysis_batch(files, ingest):
+    """Analyze many uploads at once; returns the /analyze/batch payload.
+
+    Uploads are decoded in parallel on decode_executor, images without a cached
+    result go to Vision in batched calls, and those Vision didn't label through the
+    local model, queued together so the micro-batcher runs them as full batches.
+    ingest(file) turns an upload into an IngestedImage. Results keep the upload
+    order; a bad upload gets an error entry instead of failing the batch.
+    """
+    started = time.perf_counter()
+    results = [None] * len(files)
+    prepared = {}
+    futures = [decode_executor.submit(ingest_for_batch, file, ingest) for file in files]
+    for i, future in enumerate(futures):
         try:
-            user_lat = float(user_lat)
-            user_lng = float(user_lng)
-            if not (-90 <= user_lat <= 90) or not (-180 <= user_lng <= 180):
-                raise ValueError("Invalid coordinates")
-        except (ValueError, TypeError):
-            logger.error("Invalid coordinate format")
-            return jsonify({'success': False, 'error': 'Invalid latitude or longitude format'}), 400
+            prepared[i] = future.result()
+        except RequestError as e:
+            results[i] = {'success': False, 'error': e.message}
+        except Exception as e:
+            logger.error(f"Could not prepare batch image {i}: {e}", exc_info=True)
+            results[i] = {'success': False, 'error': 'Internal server error'}
+    for i, (_, _, _, _, cached) in prepared.items():
+        if cached is not None:
+            results[i] = cached
+    pending = [i for i in prepared if results[i] is None]
+    decoded = time.perf_counter()
+
+    labels, answered = detect_labels_vision_batch([prepared[i][1] for i in pending]) if pending else ([], [])
+    labelled = dict(zip(pending, labels))
+    client_answered = dict(zip(pending, answered))
+    vision_done = time.perf_counter()
+
+    local = {}
+    unlabelled = [i for i in pending if not labelled[i][0]]
+    if unlabelled:
+        logger.info(f"No labels from Vision API for {len(unlabelled)} images, running the local model")
+        tensors = list(decode_executor.map(lambda i: local_model.preprocess(prepared[i][1].rgb), unlabelled))
+        predictions = [inference_batcher.submit(tensor) for tensor in tensors]
+        for i, prediction in zip(unlabelled, predictions):
+            try:
+                local[i] = local_model_labels(prediction.result())
+            except Exception as e:
+                results[i] = {'success': False, 'error': local_model_error(e).message}
+    local_done = time.perf_counter()
+
+    for i in pending:
+        if results[i] is not None:
+            continue
+        filename, ingested, digest, phash, _ = prepared[i]
+        top_labels, confidence_scores, local_media_scores = local[i] if i in local else labelled[i] + (None,)
+        results[i] = finish_analysis(filename, ingested, digest, phash, top_labels, confidence_scores,
+                                     local_media_scores, client_answered[i])
+    finished = time.perf_counter()
+
+    summary = {
+        'images': len(files),
+        'cached': sum(1 for i in prepared if i not in pending),
+        'vision': sum(1 for i in pending if labelled[i][0]),
+        'local_model': len(unlabelled),
+        'errors': sum(1 for result in results if not result['success']),
+    }
+    timings = {
+        'decode_ms': (decoded - started) * 1000.0,
+        'vision_ms': (vision_done - decoded) * 1000.0,
+        'local_model_ms': (local_done - vision_done) * 1000.0,
+        'classify_ms': (finished - local_done) * 1000.0,
+        'total_ms': (finished - started) * 1000.0,
+    }
+    timings = {stage: round(ms, 1) for stage, ms in timings.items()}
+    logger.info(f"Batch analysis completed: {summary}, timings {timings}")
+    return {'success': True, 'results': results, 'summary': summary, 'timings': timings}
+
+def batch_upload_error(files):
+    if not files:
+        logger.error("No files provided in batch request")
+        return 'No file provided'
+    if len(files) > ANALYZE_BATCH_MAX_IMAGES:
+        logger.error(f"Batch request with {len(files)} images")
+        return f'Too many images. At most {ANALYZE_BATCH_MAX_IMAGES} per request'
+    return None
 
-        query = data.get('query', 'media store')  # Default search query for media
-        logger.info(f"Searching for '{query}' near ({user_lat}, {user_lng})")
+@app.route('/analyze/batch', methods=['POST'])
+@limiter.limit(ANALYZE_BATCH_RATE_LIMIT)
+def analyze_batch():
+    try:
+        files = request.files.getlist('file')
+        logger.info(f"Received batch image analysis request with {len(files)} images")
+        error = batch_upload_error(files)
+        if error:
+            return jsonify({'success': False, 'error': error}), 400
+        return jsonify(run_analysis_batch(files, lambda file: ingest_upload(file, VISION_MAX_BYTES, VISION_MAX_EDGE)))
 
-        if gmaps is None:
-            # Enhanced fallback to mock data if API not configured - media-focused stores
-            media_stores = {
-                'bookstore': [
-                    {"name": "Mock Bookstore", "lat": user_lat + 0.01, "lng": user_lng + 0.01, "vicinity": "Mock Address 1", "rating": 4.5, "place_id": "mock1"},
-                    {"name": "Local Library", "lat": user_lat - 0.01, "lng": user_lng - 0.01, "vicinity": "Mock Address 2", "rating": 4.0, "place_id": "mock2"},
-                    {"name": "Book Haven", "lat": user_lat + 0.02, "lng": user_lng + 0.02, "vicinity": "Mock Address 3", "rating": 4.2, "place_id": "mock3"}
-                ],
-                'video store': [
-                    {"name": "Mock Video Store", "lat": user_lat + 0.01, "lng": user_lng + 0.01, "vicinity": "Mock Address 1", "rating": 4.5, "place_id": "mock1"},
-                    {"name": "DVD Rental Shop", "lat": user_lat - 0.01, "lng": user_lng - 0.01, "vicinity": "Mock Address 2", "rating": 4.0, "place_id": "mock2"},
-                    {"name": "Movie Mart", "lat": user_lat + 0.02, "lng": user_lng + 0.02, "vicinity": "Mock Address 3", "rating": 4.2, "place_id": "mock3"}
-                ],
-                'game store': [
-                    {"name": "Mock Game Store", "lat": user_lat + 0.01, "lng": user_lng + 0.01, "vicinity": "Mock Address 1", "rating": 4.5, "place_id": "mock1"},
-                    {"name": "Gaming Hub", "lat": user_lat - 0.01, "lng": user_lng - 0.01, "vicinity": "Mock Address 2", "rating": 4.0, "place_id": "mock2"},
-                    {"name": "Game World", "lat": user_lat + 0.02, "lng": user_lng + 0.02, "vicinity": "Mock Address 3", "rating": 4.2, "place_id": "mock3"}
-                ]
-            }
-
-            # Use query-appropriate mock stores
-            stores = media_stores.get(query, media_stores['bookstore'])  # Default to bookstore
-            nearest = stores[0]  # First one as nearest
-            route_info = {
-                "distance": "1.2 km",
-                "duration": "5 mins",
-                "steps": ["Head north on Main St", "Turn left onto Store Ave", "Arrive at destination"]
-            }
-            return jsonify({
-                "success": True,
-                "nearest_store": nearest,
-                "all_stores": stores,
-                "route_info": route_info,
-                "fallback": True
-            })
+    except Exception as e:
+        logger.error(f"Error in analyze batch endpoint: {str(e)}", exc_info=True)
+        return jsonify({'success': False, 'error': 'Internal server error'}), 500
 
-        # Use Google Places API to find nearby places - media-focused search
+def places_search_type(query):
+    """Places type to restrict a search for query to"""
+    # Adjust search parameters based on media type
+    search_type = 'store'
+    if 'book' in query.lower():
+        search_type = 'book_store'
+    elif 'movie' in query.lower() or 'video' in query.lower():
+        search_type = 'movie_rental'
+    elif 'game' in query.lower():
+        search_type = 'electronics_store'
+    return search_type
+
+def catalog_category(query):
+    """Store catalog category holding the results of a Places search for query.
+
+    Categories are the few Places types searched, never the free-text query, so
+    the catalog keeps a fixed, small set of them.
+    """
+    return places_search_type(query)
+
+def find_places(lat, lng, queries):
+    """Cached Places searches for each query, run concurrently when there are several.
+
+    Returns {query: (places, cache status)} for the searches that succeeded; with
+    several queries only those finished within PLACES_FAN_OUT_DEADLINE are included.
+    """
+    if len(queries) == 1:
         try:
-            # Adjust search parameters based on media type
-            search_type = 'store'
-            if 'book' in query.lower():
-                search_type = 'book_store'
-            elif 'movie' in query.lower() or 'video' in query.lower():
-                search_type = 'movie_rental'
-            elif 'game' in query.lower():
-                search_type = 'electronics_store'
-
-            places_result = gmaps.places_nearby(
-                location=(user_lat, user_lng),
-                radius=5000,  # 5km radius
-                keyword=query,
-                type=search_type
-            )
-            places = places_result.get('results', [])
-            logger.info(f"Found {len(places)} places via Google Maps API")
+            return {queries[0]: places_cache.get(lat, lng, queries[0], places_search_type(queries[0]), search_places)}
+        except CircuitOpenError:
+            logger.warning("Google Places circuit is open, searching the store catalog")
         except Exception as e:
             logger.error(f"Google Maps API error: {e}")
-            places = []  # Trigger fallback
-
-        if not places:
-            # Fallback to enhanced mock data if API returns no results - media-focused
-            fallback_stores = {
-                'bookstore': [
-                    {"name": "Fallback Bookstore", "lat": user_lat + 0.01, "lng": user_lng + 0.01, "vicinity": "Fallback Address 1", "rating": 4.5, "place_id": "fallback1"},
-                    {"name": "Community Library", "lat": user_lat - 0.01, "lng": user_lng - 0.01, "vicinity": "Fallback Address 2", "rating": 4.0, "place_id": "fallback2"}
-                ],
-                'video store': [
-                    {"name": "Fallback Video Store", "lat": user_lat + 0.01, "lng": user_lng + 0.01, "vicinity": "Fallback Address 1", "rating": 4.5, "place_id": "fallback1"},
-                    {"name": "Movie Rental", "lat": user_lat - 0.01, "lng": user_lng - 0.01, "vicinity": "Fallback Address 2", "rating": 4.0, "place_id": "fallback2"}
-                ],
-                'game store': [
-                    {"name": "Fallback Game Store", "lat": user_lat + 0.01, "lng": user_lng + 0.01, "vicinity": "Fallback Address 1", "rating": 4.5, "place_id": "fallback1"},
-                    {"name": "Gaming Store", "lat": user_lat - 0.01, "lng": user_lng - 0.01, "vicinity": "Fallback Address 2", "rating": 4.0, "place_id": "fallback2"}
-                ]
-            }
-
-            stores = fallback_stores.get(query, fallback_stores['bookstore'])
-            nearest = stores[0]
-            route_info = {
-                "distance": "0.8 km",
-                "duration": "3 mins",
-                "steps": ["Walk straight ahead", "Cross the street", "Enter the store"]
-            }
-            return jsonify({
-                "success": True,
-                "nearest_store": nearest,
-                "all_stores": stores,
-                "route_info": route_info,
-                "fallback": True
-            })
-
-        # Format Google Places results
-        stores = [{
+        return {}
+
+    futures = {
+        places_executor.submit(places_cache.get, lat, lng, query, places_search_type(query), search_places): query
+        for query in queries
+    }
+    done, not_done = wait(futures, timeout=PLACES_FAN_OUT_DEADLINE)
+    if not_done:
+        logger.warning(f"{len(not_done)} of {len(futures)} Places searches missed the deadline")
+    results = {}
+    for future in done:
+        try:
+            results[futures[future]] = future.result()
+        except CircuitOpenError:
+            logger.warning("Google Places circuit is open, searching the store catalog")
+        except Exception as e:
+            logger.error(f"Google Maps API error for '{futures[future]}': {e}")
+    return results
+
+def search_places(lat, lng, query, search_type):
+    """Places Nearby search around (lat, lng), guarded by the maps_places breaker"""
+    places_breaker = breakers['maps_places']
+    permit = places_breaker.allow()
+    if permit is None:
+        raise CircuitOpenError('maps_places')
+    call_started = time.perf_counter()
+    try:
+        places_result = gmaps.places_nearby(
+            location=(lat, lng),
+            radius=5000,  # 5km radius
+            keyword=query,
+            type=search_type
+        )
+    except Exception as e:
+        places_breaker.record_failure(permit, (time.perf_counter() - call_started) * 1000.0, e)
+        raise
+    places_breaker.record_success(permit, (time.perf_counter() - call_started) * 1000.0)
+    places = places_result.get('results', [])
+    if PLACES_MAX_PAGES > 1 and places_result.get('next_page_token'):
+        maps_executor.submit(fetch_more_places, lat, lng, query, search_type, places_result['next_page_token'])
+    return places
+
+def fetch_more_places(lat, lng, query, search_type, page_token):
+    """Fetch further Places pages and add them to the cached search"""
+    places_breaker = breakers['maps_places']
+    for _ in range(PLACES_MAX_PAGES - 1):
+        # A next_page_token only becomes valid a short while after it is issued
+        time.sleep(2)
+        permit = places_breaker.allow()
+        if permit is None:
+            return
+        call_started = time.perf_counter()
+        try:
+            places_result = gmaps.places_nearby(page_token=page_token)
+        except Exception as e:
+            places_breaker.record_failure(permit, (time.perf_counter() - call_started) * 1000.0, e)
+            logger.warning(f"Google Places pagination error: {e}")
+            return
+        places_breaker.record_success(permit, (time.perf_counter() - call_started) * 1000.0)
+        places_cache.extend(lat, lng, query, search_type, places_result.get('results', []))
+        page_token = places_result.get('next_page_token')
+        if not page_token:
+            return
+
+def parse_location(data):
+    """Validated (lat, lng) from a request's fields; raises RequestError"""
+    user_lat = data.get('lat')
+    user_lng = data.get('lng')
+    if user_lat is None or user_lng is None:
+        logger.error("Missing latitude or longitude")
+        raise RequestError('Latitude and longitude are required', 400)
+
+    # Validate coordinate ranges
+    try:
+        user_lat = float(user_lat)
+        user_lng = float(user_lng)
+        if not (-90 <= user_lat <= 90) or not (-180 <= user_lng <= 180):
+            raise ValueError("Invalid coordinates")
+    except (ValueError, TypeError):
+        logger.error("Invalid coordinate format")
+        raise RequestError('Invalid latitude or longitude format', 400)
+    return user_lat, user_lng
+
+def parse_map_request(data):
+    """(lat, lng, query, media_type, fan_out) from a /map-ai JSON body; raises RequestError"""
+    if not data:
+        logger.error("No JSON data provided")
+        raise RequestError('No data provided', 400)
+
+    user_lat, user_lng = parse_location(data)
+    query = data.get('query', 'media store')  # Default search query for media
+    log_pipeline.debug(logger, "Searching for '%s' near (%s, %s)", query, user_lat, user_lng)
+
+    media_type = data.get('media_type')
+    if media_type not in STORE_TYPES:
+        media_type = media_type_for_query(query)
+    return user_lat, user_lng, query, media_type, data.get('fan_out', PLACES_FAN_OUT)
+
+def use_places():
+    return gmaps is not None and STORE_SOURCE != 'local'
+
+def places_queries(query, media_type, fan_out):
+    if not fan_out:
+        return [query]
+    # Every store keyword of the media type, the requested query first
+    keywords = STORE_TYPES[media_type or 'media']
+    return [query] + [keyword for keyword in keywords if normalize_query(keyword) != normalize_query(query)]
+
+def catalog_candidates(user_lat, user_lng, queries, results, fan_out):
+    """Add Places results to the store catalog and pick the nearest candidates from it.
+
+    Returns (candidates, places cache status).
+    """
+    if not results:
+        places_status = 'unavailable'
+    else:
+        places_status = 'miss' if any(status == 'miss' for _, status in results.values()) else 'hit'
+    logger.info(f"Found {sum(len(places) for places, _ in results.values())} places via Google Maps API "
+                f"for {len(results)}/{len(queries)} searches (cache {places_status})")
+
+    # Format Google Places results; the catalog merges them by place_id
+    for search_query, (places, _) in results.items():
+        store_catalog.upsert([{
             "name": place['name'],
             "lat": place['geometry']['location']['lat'],
             "lng": place['geometry']['location']['lng'],
             "vicinity": place.get('vicinity', 'Address not available'),
             "rating": place.get('rating', 0),
             "place_id": place.get('place_id', '')
-        } for place in places[:5]]  # Limit to top 5 results
+        } for place in places], category=catalog_category(search_query))
+
+    # Pick the nearest candidates from the catalog: only the stores these searches returned,
+    # or, while Places is unavailable, any store earlier searches of the same Places type found
+    if results:
+        categories = None
+        place_ids = {place.get('place_id') for places, _ in results.values() for place in places}
+    else:
+        categories = [catalog_category(search_query) for search_query in queries]
+        place_ids = None
+    if fan_out:
+        candidates = store_catalog.within(user_lat, user_lng, STORE_SEARCH_RADIUS_KM,
+                                          category=categories, place_ids=place_ids)
+        candidates.sort(key=lambda store: store['distance_km'] * (1 - PLACES_RATING_WEIGHT * min(store['rating'] or 0, 5) / 5))
+        return candidates[:ROUTE_CANDIDATES], places_status
+    return store_catalog.nearest(user_lat, user_lng, k=ROUTE_CANDIDATES, max_radius_km=STORE_SEARCH_RADIUS_KM,
+                                 category=categories, place_ids=place_ids), places_status
+
+def store_db_candidates(user_lat, user_lng, media_type):
+    candidates = store_db.nearest(user_lat, user_lng, k=ROUTE_CANDIDATES,
+                                  max_radius_km=STORE_SEARCH_RADIUS_KM, media_type=media_type)
+    logger.info(f"Found {len(candidates)} stores in the local store database")
+    return candidates
+
+def mock_stores_response(query, user_lat, user_lng):
+    """Payload with mock stores, used when Maps isn't configured and nothing else found stores"""
+    # Enhanced fallback to mock data if API not configured - media-focused stores
+    media_stores = {
+        'bookstore': [
+            {"name": "Mock Bookstore", "lat": user_lat + 0.01, "lng": user_lng + 0.01, "vicinity": "Mock Address 1", "rating": 4.5, "place_id": "mock1"},
+            {"name": "Local Library", "lat": user_lat - 0.01, "lng": user_lng - 0.01, "vicinity": "Mock Address 2", "rating": 4.0, "place_id": "mock2"},
+            {"name": "Book Haven", "lat": user_lat + 0.02, "lng": user_lng + 0.02, "vicinity": "Mock Address 3", "rating": 4.2, "place_id": "mock3"}
+        ],
+        'video store': [
+            {"name": "Mock Video Store", "lat": user_lat + 0.01, "lng": user_lng + 0.01, "vicinity": "Mock Address 1", "rating": 4.5, "place_id": "mock1"},
+            {"name": "DVD Rental Shop", "lat": user_lat - 0.01, "lng": user_lng - 0.01, "vicinity": "Mock Address 2", "rating": 4.0, "place_id": "mock2"},
+            {"name": "Movie Mart", "lat": user_lat + 0.02, "lng": user_lng + 0.02, "vicinity": "Mock Address 3", "rating": 4.2, "place_id": "mock3"}
+        ],
+        'game store': [
+            {"name": "Mock Game Store", "lat": user_lat + 0.01, "lng": user_lng + 0.01, "vicinity": "Mock Address 1", "rating": 4.5, "place_id": "mock1"},
+            {"name": "Gaming Hub", "lat": user_lat - 0.01, "lng": user_lng - 0.01, "vicinity": "Mock Address 2", "rating": 4.0, "place_id": "mock2"},
+            {"name": "Game World", "lat": user_lat + 0.02, "lng": user_lng + 0.02, "vicinity": "Mock Address 3", "rating": 4.2, "place_id": "mock3"}
+        ]
+    }
 
-        # Calculate distances and find nearest
-        def distance(lat1, lon1, lat2, lon2):
-            return ((lat1 - lat2)**2 + (lon1 - lon2)**2)**0.5
+    # Use query-appropriate mock stores
+    stores = media_stores.get(query, media_stores['bookstore'])  # Default to bookstore
+    nearest = stores[0]  # First one as nearest
+    route_info = {
+        "distance": "1.2 km",
+        "duration": "5 mins",
+        "steps": ["Head north on Main St", "Turn left onto Store Ave", "Arrive at destination"]
+    }
+    return {
+        "success": True,
+        "nearest_store": nearest,
+        "all_stores": stores,
+        "route_info": route_info,
+        "fallback": True
+    }
 
-        nearest = min(stores, key=lambda s: distance(user_lat, user_lng, s['lat'], s['lng']))
+def fallback_stores_response(query, user_lat, user_lng):
+    """Payload with placeholder stores, used when Places and the store database found nothing"""
+    # Fallback to enhanced mock data if API returns no results - media-focused
+    fallback_stores = {
+        'bookstore': [
+            {"name": "Fallback Bookstore", "lat": user_lat + 0.01, "lng": user_lng + 0.01, "vicinity": "Fallback Address 1", "rating": 4.5, "place_id": "fallback1"},
+            {"name": "Community Library", "lat": user_lat - 0.01, "lng": user_lng - 0.01, "vicinity": "Fallback Address 2", "rating": 4.0, "place_id": "fallback2"}
+        ],
+        'video store': [
+            {"name": "Fallback Video Store", "lat": user_lat + 0.01, "lng": user_lng + 0.01, "vicinity": "Fallback Address 1", "rating": 4.5, "place_id": "fallback1"},
+            {"name": "Movie Rental", "lat": user_lat - 0.01, "lng": user_lng - 0.01, "vicinity": "Fallback Address 2", "rating": 4.0, "place_id": "fallback2"}
+        ],
+        'game store': [
+            {"name": "Fallback Game Store", "lat": user_lat + 0.01, "lng": user_lng + 0.01, "vicinity": "Fallback Address 1", "rating": 4.5, "place_id": "fallback1"},
+            {"name": "Gaming Store", "lat": user_lat - 0.01, "lng": user_lng - 0.01, "vicinity": "Fallback Address 2", "rating": 4.0, "place_id": "fallback2"}
+        ]
+    }
 
-        # Get directions to nearest store
-        route_info = {}
-        try:
-            directions_result = gmaps.directions(
-                origin=(user_lat, user_lng),
-                destination=(nearest['lat'], nearest['lng']),
-                mode="driving"
-            )
-
-            if directions_result:
-                route = directions_result[0]['legs'][0]
-                route_info = {
-                    "distance": route['distance']['text'],
-                    "duration": route['duration']['text'],
-                    "steps": [step['html_instructions'] for step in route['steps'][:3]]  # First 3 steps
-                }
-                logger.info("Directions calculated successfully")
-            else:
-                logger.warning("No directions found")
-        except Exception as e:
-            logger.error(f"Directions API error: {e}")
+    stores = fallback_stores.get(query, fallback_stores['bookstore'])
+    nearest = stores[0]
+    route_info = {
+        "distance": "0.8 km",
+        "duration": "3 mins",
+        "steps": ["Walk straight ahead", "Cross the street", "Enter the store"]
+    }
+    return {
+        "success": True,
+        "nearest_store": nearest,
+        "all_stores": stores,
+        "route_info": route_info,
+        "fallback": True
+    }
+
+def local_stores_response(candidates):
+    """Payload for stores from the local store database when Maps isn't configured"""
+    # Without Maps the candidates are already nearest first by straight-line distance
+    stores = candidates[:5]
+    nearest = stores[0]
+    route_info = {"distance": f"{nearest['distance_km']:.1f} km"}
+    logger.info(f"Map AI request completed from the local store database. Found {len(stores)} stores")
+    return {
+        "success": True,
+        "nearest_store": nearest,
+        "all_stores": stores,
+        "route_info": route_info,
+        "cached": False
+    }
+
+def ranking_fallback(e):
+    logger.warning(f"Distance Matrix unavailable, ranking by straight-line distance: {e.error}")
+    metrics.map_fallbacks.inc('straight_line_ranking')
+    return e.ranked
+
+def log_directions(route_info):
+    if route_info:
+        log_pipeline.debug(logger, "Directions calculated successfully")
+    else:
+        logger.warning("No directions found")
+
+def directions_error(e):
+    metrics.map_fallbacks.inc('no_directions')
+    if isinstance(e, CircuitOpenError):
+        logger.warning("Google Directions circuit is open, skipping directions")
+    else:
+        logger.error(f"Directions API error: {e}")
+    return {}
+
+# Where map_response's stores came from, by Places cache status
+STORE_SOURCES = {'local': 'store_db', 'unavailable': 'catalog'}
+
+def map_response(stores, route_info, places_status):
+    logger.info(f"Map AI request completed successfully. Found {len(stores)} stores")
+    metrics.store_sources.inc(STORE_SOURCES.get(places_status, 'places'))
+    return {
+        "success": True,
+        "nearest_store": stores[0],
+        "all_stores": stores,
+        "route_info": route_info,
+        "cached": places_status != 'miss'
+    }
+
+def find_candidates(user_lat, user_lng, query, media_type, fan_out):
+    """(candidate stores nearest first, places status) from Places and the local store database"""
+    candidates = []
+    places_status = None
+    if use_places():
+        # Use Google Places API to find nearby places - media-focused search
+        queries = places_queries(query, media_type, fan_out)
+        results = find_places(user_lat, user_lng, queries)
+        candidates, places_status = catalog_candidates(user_lat, user_lng, queries, results, fan_out)
+
+    if not candidates and store_db is not None:
+        candidates = store_db_candidates(user_lat, user_lng, media_type)
+        places_status = 'local'
+    return candidates, places_status
+
+def placeholder_response(query, user_lat, user_lng, candidates):
+    """Payload when there is nothing to rank with Maps (no candidates or no Maps), else None"""
+    if not candidates:
+        if gmaps is None:
+            metrics.store_sources.inc('mock')
+            return mock_stores_response(query, user_lat, user_lng)
+        metrics.store_sources.inc('placeholder')
+        return fallback_stores_response(query, user_lat, user_lng)
+    if gmaps is None:
+        metrics.store_sources.inc('store_db')
+        return local_stores_response(candidates)
+    return None
 
-        logger.info(f"Map AI request completed successfully. Found {len(stores)} stores")
-        return jsonify({
-            "success": True,
-            "nearest_store": nearest,
-            "all_stores": stores,
-            "route_info": route_info
-        })
+def rank_stores(origin, candidates):
+    """Top 5 candidates by travel time, or by straight-line distance without Distance Matrix"""
+    # Rank the closest candidates by travel time with one Distance Matrix call
+    try:
+        ranked = route_planner.rank(origin, candidates)
+    except RouteRankingError as e:
+        ranked = ranking_fallback(e)
+    return ranked[:5]  # Limit to top 5 results
 
+def route_to(origin, store):
+    # Get directions to nearest store
+    try:
+        route_info = route_planner.directions(origin, store)
+        log_directions(route_info)
+    except Exception as e:
+        route_info = directions_error(e)
+    return route_info
+
+def map_flight_key(user_lat, user_lng, query, media_type, fan_out):
+    # Requests from the same origin cell share a result, as they share cached routes
+    return (geohash_encode(user_lat, user_lng, MAP_COALESCE_PRECISION), normalize_query(query),
+            media_type, bool(fan_out))
+
+def map_payload(user_lat, user_lng, query, media_type, fan_out):
+    """The /map-ai payload for a parsed request"""
+    candidates, places_status = find_candidates(user_lat, user_lng, query, media_type, fan_out)
+    placeholder = placeholder_response(query, user_lat, user_lng, candidates)
+    if placeholder is not None:
+        return placeholder
+
+    origin = (user_lat, user_lng)
+    stores = rank_stores(origin, candidates)
+    route_info = route_to(origin, stores[0])
+    return map_response(stores, route_info, places_status)
+
+@app.route('/map-ai', methods=['POST'])
+@limiter.limit(MAP_AI_RATE_LIMIT)
+def map_ai():
+    try:
+        logger.info("Received map AI request")
+        user_lat, user_lng, query, media_type, fan_out = parse_map_request(request.get_json())
+        key = map_flight_key(user_lat, user_lng, query, media_type, fan_out)
+        return jsonify(map_flight.do(key, map_payload, user_lat, user_lng, query, media_type, fan_out))
+
+    except RequestError as e:
+        return jsonify({'success': False, 'error': e.message}), e.status
     except Exception as e:
         logger.error(f"Error in map-ai endpoint: {str(e)}", exc_info=True)
         return jsonify({"success": False, "error": "Internal server error"}), 500
 
-@app.route('/')
-def home():
-    return jsonify({
+def snap_request_location(form):
+    """(lat, lng, fan_out) from /snap-to-store form fields; raises RequestError"""
+    user_lat, user_lng = parse_location(form)
+    fan_out = form.get('fan_out')
+    return user_lat, user_lng, fan_out.lower() == 'true' if fan_out is not None else PLACES_FAN_OUT
+
+def sse_event(event, payload):
+    return f"event: {event}\ndata: {app.json.dumps(payload, separators=(',', ':'))}\n\n"
+
+def split_map_payload(payload):
+    """(stores event, route event) payloads from a full /map-ai payload"""
+    stores = {key: value for key, value in payload.items() if key != 'route_info'}
+    return stores, {'route_info': payload['route_info']}
+
+def snap_done(timings, started):
+    timings['total_ms'] = (time.perf_counter() - started) * 1000.0
+    timings = {stage: round(ms, 1) for stage, ms in timings.items()}
+    logger.info(f"Snap-to-store completed: {timings}")
+    return {'success': True, 'timings': timings}
+
+def snap_error(e):
+    logger.error(f"Error in snap-to-store stream: {str(e)}", exc_info=True)
+    return {'success': False, 'error': 'Internal server error'}
+
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+@app.route('/snap-to-store', methods=['POST'])
+@limiter.limit(SNAP_TO_STORE_RATE_LIMIT)
+def snap_to_store():
+    """Analysis and store search in one request, streamed as server-sent events.
+
+    Events: analysis (the /analyze payload), then, if media was detected, stores
+    (the /map-ai payload without route_info) and route ({route_info}), and finally
+    done ({success, timings}) or error.
+    """
+    started = time.perf_counter()
+    try:
+        logger.info("Received snap-to-store request")
+        user_lat, user_lng, fan_out = snap_request_location(request.form)
+        analysis = run_analysis(request.files.get('file'))
+    except RequestError as e:
+        return jsonify({'success': False, 'error': e.message}), e.status
+    except Exception as e:
+        logger.error(f"Error in snap-to-store endpoint: {str(e)}", exc_info=True)
+        return jsonify({'success': False, 'error': 'Internal server error'}), 500
+
+    def events():
+        timings = {'analysis_ms': (time.perf_counter() - started) * 1000.0}
+        yield sse_event('analysis', analysis)
+        if analysis['media_type'] is None:
+            yield sse_event('done', snap_done(timings, started))
+            return
+        try:
+            # The store search starts as soon as the media type is known
+            query = analysis['search_query']
+            candidates, places_status = find_candidates(user_lat, user_lng, query, analysis['media_type'], fan_out)
+            placeholder = placeholder_response(query, user_lat, user_lng, candidates)
+            if placeholder is not None:
+                stores_payload, route_payload = split_map_payload(placeholder)
+                timings['stores_ms'] = (time.perf_counter() - started) * 1000.0
+                yield sse_event('stores', stores_payload)
+            else:
+                origin = (user_lat, user_lng)
+                stores = rank_stores(origin, candidates)
+                timings['stores_ms'] = (time.perf_counter() - started) * 1000.0
+                yield sse_event('stores', split_map_payload(map_response(stores, {}, places_status))[0])
+                route_payload = {'route_info': route_to(origin, stores[0])}
+            timings['route_ms'] = (time.perf_counter() - started) * 1000.0
+            yield sse_event('route', route_payload)
+            yield sse_event('done', snap_done(timings, started))
+        except Exception as e:
+            yield sse_event('error', snap_error(e))
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+# Upstream HTTP clients whose in-flight calls are exported; the ASGI app adds its own
+upstream_clients = {'http_pool': http_client}
+
+# Scrape-time metrics read from the stats the components already keep
+BREAKER_STATES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+def cache_metrics():
+    """({cache: entries}, {cache: hit ratio}) keyed by metric label values"""
+    analysis, places, routes = analysis_cache.stats(), places_cache.stats(), route_planner.stats()
+    entries = {('analysis',): analysis['entries'], ('places',): places['entries'],
+               ('route_legs',): routes['cached_legs'], ('routes',): routes['cached_routes'],
+               ('store_catalog',): store_catalog.stats()['stores']}
+    hit_ratios = {('analysis',): analysis['hit_ratio'], ('places',): places['hit_ratio'],
+                  ('route_legs',): routes['leg_hit_ratio'], ('routes',): routes['route_hit_ratio']}
+    return entries, hit_ratios
+
+metrics.registry.gauge(
+    'snap2store_breaker_state', 'Circuit breaker state by backend (0 closed, 1 half-open, 2 open)', ['backend'],
+    fn=lambda: {(name,): BREAKER_STATES[breaker.state] for name, breaker in breakers.items()})
+metrics.registry.counter(
+    'snap2store_breaker_rejected_calls_total', 'Calls skipped because the backend circuit was open', ['backend'],
+    fn=lambda: {(name,): breaker.status()['rejected_calls'] for name, breaker in breakers.items()})
+metrics.registry.gauge('snap2store_cache_entries', 'Entries held per cache', ['cache'],
+                       fn=lambda: cache_metrics()[0])
+metrics.registry.gauge('snap2store_cache_hit_ratio', 'Lifetime hit ratio per cache', ['cache'],
+                       fn=lambda: cache_metrics()[1])
+metrics.registry.gauge(
+    'snap2store_batch_queue_depth', 'Items waiting for a micro-batch', ['batcher'],
+    fn=lambda: {(batcher.name,): batcher.stats()['queue_depth']
+                for batcher in (inference_batcher, vision_batcher) if batcher is not None})
+metrics.registry.gauge(
+    'snap2store_upstream_in_flight', 'Upstream HTTP calls in flight by client', ['client'],
+    fn=lambda: {(name,): client.stats()['in_flight'] for name, client in upstream_clients.items()})
+metrics.registry.gauge(
+    'snap2store_single_flight_in_flight', 'Distinct coalesced computations in flight', ['flight'],
+    fn=lambda: {(flight.name,): flight.stats()['in_flight'] for flight in (analyze_flight, map_flight)})
+metrics.registry.counter('snap2store_log_records_dropped_total', 'Log records dropped because the log queue was full',
+                         fn=lambda: {(): log_handlers.dropped})
+metrics.registry.gauge('snap2store_local_model_ready', 'Whether the local model is loaded (1) or not (0)',
+                       fn=lambda: {(): 1 if local_model.ready else 0})
+
+# On-demand profiling for the /debug routes, which answer 404 unless DEBUG_TOKEN is set
+DEBUG_TOKEN = os.getenv('DEBUG_TOKEN', '')
+DEBUG_PROFILE_MAX_SECONDS = float(os.getenv('DEBUG_PROFILE_MAX_SECONDS', 30))
+DEBUG_PROFILE_MAX_BATCHES = 10
+sampling_profiler = SamplingProfiler(max_seconds=DEBUG_PROFILE_MAX_SECONDS)
+
+def check_debug_token(authorization):
+    """Raises RequestError unless the Authorization header is Bearer DEBUG_TOKEN"""
+    if not DEBUG_TOKEN:
+        raise RequestError('Not found', 404)
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(token.strip().encode(), DEBUG_TOKEN.encode()):
+        raise RequestError('Unauthorized', 401)
+
+def debug_number(args, name, default, cast=float, minimum=0):
+    value = args.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        number = cast(value)
+    except ValueError:
+        raise RequestError(f'Invalid {name}', 400)
+    if number < minimum:
+        raise RequestError(f'{name} must be at least {minimum}', 400)
+    return number
+
+def sampling_profile(args):
+    """(body, content type) of a stack sampling profile for GET /debug/profile"""
+    profile_format = args.get('format', 'collapsed')
+    if profile_format not in ('collapsed', 'speedscope'):
+        raise RequestError('format must be collapsed or speedscope', 400)
+    seconds = min(debug_number(args, 'seconds', 5.0), DEBUG_PROFILE_MAX_SECONDS)
+    interval_ms = debug_number(args, 'interval_ms', 5.0)
+    try:
+        profile = sampling_profiler.run(seconds, interval_ms, args.get('idle', 'false').lower() == 'true')
+    except ProfilerBusy as e:
+        raise RequestError(str(e), 409)
+    logger.info(f"Sampling profile: {profile.samples} samples, {len(profile.stacks)} stacks in {profile.elapsed:.1f} s")
+    if profile_format == 'speedscope':
+        return app.json.dumps(profile.speedscope()), 'application/json'
+    return profile.collapsed(), 'text/plain; charset=utf-8'
+
+def torch_profile(args):
+    """GET /debug/profile/torch payload: torch.profiler results for the next local model batches"""
+    if inference_pool:
+        raise RequestError('Torch profiling needs INFERENCE_WORKERS=0: the model runs in worker processes', 409)
+    profile_format = args.get('format', 'summary')
+    if profile_format not in ('summary', 'chrome'):
+        raise RequestError('format must be summary or chrome', 400)
+    capture = TorchCapture(
+        batches=min(debug_number(args, 'batches', 1, int, minimum=1), DEBUG_PROFILE_MAX_BATCHES),
+        record_shapes=args.get('shapes', 'false').lower() == 'true',
+        trace=profile_format == 'chrome'
+    )
+    seconds = min(debug_number(args, 'seconds', DEBUG_PROFILE_MAX_SECONDS), DEBUG_PROFILE_MAX_SECONDS)
+    synthetic = min(debug_number(args, 'synthetic', 0, int), inference_batcher.max_batch_size)
+    try:
+        results = local_model.capture_profile(capture, seconds, synthetic_batch=synthetic)
+    except ProfilerBusy as e:
+        raise RequestError(str(e), 409)
+    except Exception as e:
+        raise RequestError(f'Local model unavailable: {e}', 503)
+    logger.info(f"Torch profile: {len(results)} of {capture.batches} batches captured")
+    if profile_format == 'chrome':
+        return {'traceEvents': [event for result in results for event in result['trace']['traceEvents']]}
+    return {'success': True, 'requested': capture.batches, 'batches': results}
+
+def rate_limit_storage_stats(storage):
+    """Counter table usage and evictions of a shm:// rate limit storage; None for others"""
+    return storage.stats() if isinstance(storage, shm_storage.SharedMemoryStorage) else None
+
+def stats_payload():
+    return {
+        'inference_batching': inference_batcher.stats(),
+        'vision_batching': vision_batcher.stats() if vision_batcher else None,
+        'analysis_cache': analysis_cache.stats(),
+        'preprocessing': preprocess_stats.stats(),
+        'inference_workers': inference_pool.stats() if inference_pool else None,
+        'http_pool': http_client.stats(),
+        'places_cache': places_cache.stats(),
+        'routes': route_planner.stats(),
+        'store_catalog': store_catalog.stats(),
+        'store_db': store_db.stats() if store_db else None,
+        'single_flight': {'analyze': analyze_flight.stats(), 'map': map_flight.stats()},
+        'logging': log_handlers.stats(),
+        'rate_limit_storage': rate_limit_storage_stats(limiter.storage)
+    }
+
+def status_payload():
+    return {
+        'backends': {name: breaker.status() for name, breaker in breakers.items()},
+        'configured': {
+            'vision_client': vision_client is not None,
+            'vision_rest': bool(vision_api_key),
+            'maps': gmaps is not None
+        }
+    }
+
+def ready_payload():
+    """(payload, status code) for the readiness check"""
+    status = local_model.status()
+    return {
+        'status': 'ready' if local_model.ready else status['state'],
+        'model': status
+    }, 200 if local_model.ready else 503
+
+def home_payload():
+    return {
         'status': 'running',
         'message': 'AI Backend Service is running',
         'endpoints': {
             'analyze': 'POST /analyze - Analyze images for media types',
-            'map_ai': 'POST /map-ai - Find nearby stores'
+            'analyze_batch': 'POST /analyze/batch - Analyze many images in one request',
+            'map_ai': 'POST /map-ai - Find nearby stores',
+            'snap_to_store': 'POST /snap-to-store - Analyze an image and stream nearby stores (SSE)',
+            'stats': 'GET /stats - Runtime statistics',
+            'metrics': 'GET /metrics - Prometheus metrics',
+            'debug_profile': 'GET /debug/profile - Sampling profile (needs DEBUG_TOKEN)',
+            'ready': 'GET /ready - Readiness (local model loaded)',
+            'status': 'GET /status - Upstream backend health'
         }
-    })
+    }
+
+@app.route('/stats')
+def stats():
+    return jsonify(stats_payload())
+
+@app.route('/metrics')
+@limiter.exempt
+def prometheus_metrics():
+    """Stage and backend latencies, fallback counters and gauges in the Prometheus text format"""
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/debug/profile')
+def debug_profile():
+    """Sample every thread's stack for ?seconds= and return the collapsed stacks or a speedscope profile"""
+    try:
+        check_debug_token(request.headers.get('Authorization'))
+        body, content_type = sampling_profile(request.args)
+        return Response(body, content_type=content_type)
+    except RequestError as e:
+        return jsonify({'success': False, 'error': e.message}), e.status
+
+@app.route('/debug/profile/torch')
+def debug_profile_torch():
+    """torch.profiler capture of the next local model forward passes"""
+    try:
+        check_debug_token(request.headers.get('Authorization'))
+        return jsonify(torch_profile(request.args))
+    except RequestError as e:
+        return jsonify({'success': False, 'error': e.message}), e.status
+
+@app.route('/status')
+def status():
+    """Health of each upstream backend as seen by its circuit breaker"""
+    return jsonify(status_payload())
+
+# Health checks poll these, so they stay out of the default rate limits
+@app.route('/ready')
+@limiter.exempt
+def ready():
+    """Readiness: the local model is loaded and warmed up. GET / only reports liveness."""
+    payload, status_code = ready_payload()
+    return jsonify(payload), status_code
+
+@app.route('/')
+@limiter.exempt
+def home():
+    return jsonify(home_payload())
+
+logger.info(
+    f"App initialized in {(time.perf_counter() - _startup_started) * 1000:.0f} ms "
+    f"(imports {(_imports_done - _startup_started) * 1000:.0f} ms); local model: {local_model.status()['state']}"
+)
 
 if __name__ == '__main__':
     # Production-ready configuration
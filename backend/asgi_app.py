@@ -0,0 +1,597 @@
+"""Async (ASGI) serving mode for the AI backend.
+
+Serves the same endpoints, validation, rate limits and response bodies as the
+Flask app in app.py, and reuses its caches, circuit breakers, store catalog and
+local model. Upstream I/O does not block a worker thread:
+
+- Vision runs through the async gRPC client, or REST over httpx; with
+  VISION_AGGREGATE the shared Vision aggregator's threads make the calls
+- Places, Distance Matrix and Directions are called with httpx, and fanned-out
+  Places searches run concurrently on the event loop
+- decoding, catalog updates and store database lookups run in the threadpool,
+  and local inference goes through the inference micro-batcher's threads
+
+Usage:
+    python asgi_app.py
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+from google.cloud import vision
+from limits import parse, parse_many
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders, UploadFile
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.exceptions import RequestEntityTooLarge, TooManyRequests, UnsupportedMediaType
+from werkzeug.utils import secure_filename
+
+import app as service
+import log_pipeline
+import metrics
+from async_upstream import AsyncMapsClient, AsyncUpstream
+from circuit_breaker import CircuitOpenError
+from ingest import ingest_bytes
+from routes import RouteRankingError
+
+logger = logging.getLogger(__name__)
+
+# Rate limit counters for RateLimitMiddleware, kept where RATE_LIMIT_STORAGE_URI says
+rate_limit_storage = storage_from_string(service.RATE_LIMIT_STORAGE_URI)
+
+# Async upstream clients, created on startup inside the event loop
+upstream = None
+maps_client = None
+vision_client = None
+# Tasks left running past a request (fan-out stragglers, extra Places pages)
+background_tasks = set()
+
+
+class FlaskJSONResponse(JSONResponse):
+    """JSON rendered byte-for-byte like Flask's jsonify"""
+
+    def render(self, content):
+        return (service.app.json.dumps(content, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+def error_response(message, status):
+    return FlaskJSONResponse({'success': False, 'error': message}, status_code=status)
+
+
+class RateLimitMiddleware:
+    """Per-client fixed-window rate limits with Flask-Limiter's semantics.
+
+    Routes with their own limits use only those, other known routes share the
+    default limits (counted per route), exempt routes aren't limited. Exceeding a
+    limit returns the same 429 page Flask-Limiter serves.
+    """
+
+    def __init__(self, app, paths, route_limits, default_limits, exempt=(), enabled=True, storage=None):
+        self.app = app
+        self.limits = {
+            path: parse_many(route_limits[path]) if path in route_limits else [parse(limit) for limit in default_limits]
+            for path in paths if path not in exempt
+        }
+        self.enabled = enabled
+        self.limiter = FixedWindowRateLimiter(storage if storage is not None else storage_from_string('memory://'))
+
+    async def __call__(self, scope, receive, send):
+        if self.enabled and scope['type'] == 'http' and scope['method'] != 'OPTIONS' and scope['path'] in self.limits:
+            client = scope['client'][0] if scope.get('client') else '127.0.0.1'
+            for item in self.limits[scope['path']]:
+                if not self.limiter.hit(item, scope['path'], client):
+                    response = HTMLResponse(TooManyRequests(description=str(item)).get_body(), status_code=429)
+                    await response(scope, receive, send)
+                    return
+        await self.app(scope, receive, send)
+
+
+class MetricsMiddleware:
+    """Request IDs, latency and in-flight counts per route, as the Flask app's request hooks record them"""
+
+    def __init__(self, app, paths):
+        self.app = app
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        endpoint = scope['path'] if scope['path'] in self.paths else 'unmatched'
+        status = 500
+        incoming_id = Headers(scope=scope).get(log_pipeline.REQUEST_ID_HEADER)
+        request_id, log_tokens = log_pipeline.start_request(incoming_id)
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                MutableHeaders(scope=message)[log_pipeline.REQUEST_ID_HEADER] = request_id
+            await send(message)
+
+        started = time.perf_counter()
+        metrics.requests_in_flight.inc(endpoint)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.requests_in_flight.dec(endpoint)
+            metrics.request_seconds.observe(time.perf_counter() - started, endpoint, str(status))
+            log_pipeline.end_request(log_tokens)
+
+
+def check_content_length(request, limit=None):
+    # Flask rejects oversized bodies when the handler first reads them
+    content_length = request.headers.get('content-length')
+    if content_length and int(content_length) > (limit or service.app.config['MAX_CONTENT_LENGTH']):
+        raise RequestEntityTooLarge()
+
+
+async def read_form(request):
+    started = time.perf_counter()
+    form = await request.form()
+    metrics.stage_seconds.observe(time.perf_counter() - started, 'upload')
+    return form
+
+
+def keep_running(task):
+    """Hold a reference to a task outliving its request and consume its outcome"""
+    background_tasks.add(task)
+    task.add_done_callback(lambda t: background_tasks.discard(t) or t.cancelled() or t.exception())
+    return task
+
+
+async def detect_labels_vision(ingested):
+    """service.detect_labels_vision with async Vision calls"""
+    if service.vision_batcher is not None:
+        try:
+            await run_in_threadpool(ingested.vision_content)
+            return await asyncio.wrap_future(service.vision_batcher.submit(ingested))
+        except Exception as e:
+            logger.error(f"Aggregated Vision call failed: {e}")
+            return [], [], False
+
+    top_labels = []
+    confidence_scores = []
+    vision_client_available = False
+    client_permit = None
+    if vision_client is not None:
+        # Built before asking the breaker, so a failed re-encode can't hold a half-open probe
+        try:
+            vision_image = vision.Image(content=await run_in_threadpool(ingested.vision_content))
+        except Exception as e:
+            logger.error(f"Could not prepare image for Google Vision: {e}")
+        else:
+            client_permit = service.breakers['vision_client'].allow()
+            vision_client_available = client_permit is not None
+            if not vision_client_available:
+                logger.info("Google Vision client circuit is open, skipping to REST fallback")
+
+    if vision_client_available:
+        try:
+            call_started = time.perf_counter()
+            try:
+                response = await vision_client.batch_annotate_images(requests=[{
+                    'image': vision_image,
+                    'features': [{'type_': vision.Feature.Type.LABEL_DETECTION}]
+                }])
+            except Exception as e:
+                service.breakers['vision_client'].record_failure(client_permit, (time.perf_counter() - call_started) * 1000.0, e)
+                raise
+            except BaseException:
+                # Cancelled (the client went away): free the probe without counting the call
+                service.breakers['vision_client'].release(client_permit)
+                raise
+            service.breakers['vision_client'].record_success(client_permit, (time.perf_counter() - call_started) * 1000.0)
+
+            top_labels, confidence_scores = service.client_response_labels(response.responses[0])
+            if top_labels:
+                log_pipeline.debug(logger, "Google Vision detected %d labels", len(response.responses[0].label_annotations))
+            else:
+                logger.warning("Google Vision returned no labels")
+        except Exception as e:
+            logger.error(f"Google Vision API error: {e}")
+            vision_client_available = False
+    else:
+        log_pipeline.debug(logger, "Google Vision API not available, skipping to fallback")
+
+    payload = None
+    if not top_labels and service.vision_api_key:
+        try:
+            payload = await run_in_threadpool(service.vision_rest_payload, ingested)
+        except Exception as e:
+            logger.error(f"Could not prepare image for Vision API REST: {e}")
+    rest_permit = service.breakers['vision_rest'].allow() if payload is not None else None
+    if payload is not None and rest_permit is None:
+        logger.info("Vision REST circuit is open, skipping to local model")
+    elif rest_permit is not None:
+        try:
+            call_started = time.perf_counter()
+            try:
+                response = await upstream.post_json(service.vision_rest_url, payload, params={'key': service.vision_api_key})
+            except Exception as e:
+                service.breakers['vision_rest'].record_failure(rest_permit, (time.perf_counter() - call_started) * 1000.0, e)
+                raise
+            except BaseException:
+                service.breakers['vision_rest'].release(rest_permit)
+                raise
+            call_ms = (time.perf_counter() - call_started) * 1000.0
+            top_labels, confidence_scores = service.vision_rest_labels(rest_permit, response.status_code, call_ms, response.json)
+        except Exception as e:
+            logger.error(f"Vision API REST error: {e}")
+
+    return top_labels, confidence_scores, vision_client_available
+
+
+async def run_analysis(file):
+    """service.run_analysis for an upload parsed by Starlette"""
+    error = service.upload_error(file if isinstance(file, UploadFile) else None)
+    if error:
+        raise service.RequestError(error[0]['error'], error[1])
+
+    filename = secure_filename(file.filename)
+    ingested = ingest_bytes(await file.read(), service.VISION_MAX_BYTES, service.VISION_MAX_EDGE)
+    digest = service.upload_digest(ingested)
+    return await service.analyze_flight.ado(digest, analyze_ingested, ingested, filename, digest)
+
+
+async def analyze_ingested(ingested, filename, digest):
+    digest, phash, cached = await run_in_threadpool(service.prepare_analysis, ingested, filename, digest)
+    if cached is not None:
+        return cached
+
+    top_labels, confidence_scores, vision_client_available = await detect_labels_vision(ingested)
+
+    local_media_scores = None
+    if not top_labels:
+        try:
+            tensor = await run_in_threadpool(service.local_model_input, ingested)
+            prediction = await asyncio.wrap_future(service.inference_batcher.submit(tensor))
+            top_labels, confidence_scores, local_media_scores = service.local_model_labels(prediction)
+        except Exception as e:
+            raise service.local_model_error(e)
+
+    return service.finish_analysis(filename, ingested, digest, phash, top_labels, confidence_scores,
+                                   local_media_scores, vision_client_available)
+
+
+async def analyze(request):
+    try:
+        logger.info("Received image analysis request")
+        check_content_length(request)
+        form = await read_form(request)
+        return FlaskJSONResponse(await run_analysis(form.get('file')))
+
+    except service.RequestError as e:
+        return error_response(e.message, e.status)
+    except Exception as e:
+        logger.error(f"Error in analyze endpoint: {str(e)}", exc_info=True)
+        return error_response('Internal server error', 500)
+
+
+def ingest_upload_file(file):
+    return ingest_bytes(file.file.read(), service.VISION_MAX_BYTES, service.VISION_MAX_EDGE)
+
+
+async def analyze_batch(request):
+    try:
+        check_content_length(request, service.ANALYZE_BATCH_MAX_BYTES)
+        form = await read_form(request)
+        files = [file if isinstance(file, UploadFile) else None for file in form.getlist('file')]
+        logger.info(f"Received batch image analysis request with {len(files)} images")
+        error = service.batch_upload_error(files)
+        if error:
+            return error_response(error, 400)
+        # Bulk analysis makes blocking Vision calls, so the whole batch runs in a worker thread
+        return FlaskJSONResponse(await run_in_threadpool(service.run_analysis_batch, files, ingest_upload_file))
+
+    except Exception as e:
+        logger.error(f"Error in analyze batch endpoint: {str(e)}", exc_info=True)
+        return error_response('Internal server error', 500)
+
+
+async def search_places(lat, lng, query, search_type):
+    """service.search_places over the async Maps client"""
+    places_breaker = service.breakers['maps_places']
+    permit = places_breaker.allow()
+    if permit is None:
+        raise CircuitOpenError('maps_places')
+    call_started = time.perf_counter()
+    try:
+        places_result = await maps_client.places_nearby(location=(lat, lng), radius=5000, keyword=query, type=search_type)
+    except Exception as e:
+        places_breaker.record_failure(permit, (time.perf_counter() - call_started) * 1000.0, e)
+        raise
+    except BaseException:
+        # Cancelled by the fan-out deadline or a client disconnect
+        places_breaker.release(permit)
+        raise
+    places_breaker.record_success(permit, (time.perf_counter() - call_started) * 1000.0)
+    places = places_result.get('results', [])
+    if service.PLACES_MAX_PAGES > 1 and places_result.get('next_page_token'):
+        keep_running(asyncio.ensure_future(
+            fetch_more_places(lat, lng, query, search_type, places_result['next_page_token'])
+        ))
+    return places
+
+
+async def fetch_more_places(lat, lng, query, search_type, page_token):
+    """service.fetch_more_places over the async Maps client"""
+    places_breaker = service.breakers['maps_places']
+    for _ in range(service.PLACES_MAX_PAGES - 1):
+        # A next_page_token only becomes valid a short while after it is issued
+        await asyncio.sleep(2)
+        permit = places_breaker.allow()
+        if permit is None:
+            return
+        call_started = time.perf_counter()
+        try:
+            places_result = await maps_client.places_nearby(page_token=page_token)
+        except Exception as e:
+            places_breaker.record_failure(permit, (time.perf_counter() - call_started) * 1000.0, e)
+            logger.warning(f"Google Places pagination error: {e}")
+            return
+        except BaseException:
+            places_breaker.release(permit)
+            raise
+        places_breaker.record_success(permit, (time.perf_counter() - call_started) * 1000.0)
+        service.places_cache.extend(lat, lng, query, search_type, places_result.get('results', []))
+        page_token = places_result.get('next_page_token')
+        if not page_token:
+            return
+
+
+async def find_places(lat, lng, queries):
+    """service.find_places with the searches running concurrently on the event loop"""
+    tasks = {
+        asyncio.ensure_future(service.places_cache.aget(lat, lng, query, service.places_search_type(query), search_places)): query
+        for query in queries
+    }
+    if len(queries) == 1:
+        done, not_done = await asyncio.wait(tasks)
+    else:
+        done, not_done = await asyncio.wait(tasks, timeout=service.PLACES_FAN_OUT_DEADLINE)
+    if not_done:
+        logger.warning(f"{len(not_done)} of {len(tasks)} Places searches missed the deadline")
+        for task in not_done:
+            keep_running(task)
+    results = {}
+    for task in done:
+        try:
+            results[tasks[task]] = task.result()
+        except CircuitOpenError:
+            logger.warning("Google Places circuit is open, searching the store catalog")
+        except Exception as e:
+            logger.error(f"Google Maps API error for '{tasks[task]}': {e}")
+    return results
+
+
+async def json_body(request):
+    """The request's JSON body, failing where Flask's request.get_json() would"""
+    check_content_length(request)
+    content_type = request.headers.get('content-type', '').split(';')[0].strip().lower()
+    if not (content_type == 'application/json' or (content_type.startswith('application/') and content_type.endswith('+json'))):
+        raise UnsupportedMediaType("Did not attempt to load JSON data because the request Content-Type was not 'application/json'.")
+    return await request.json()
+
+
+async def find_candidates(user_lat, user_lng, query, media_type, fan_out):
+    """service.find_candidates with async Places searches"""
+    candidates = []
+    places_status = None
+    if service.use_places():
+        queries = service.places_queries(query, media_type, fan_out)
+        results = await find_places(user_lat, user_lng, queries)
+        candidates, places_status = await run_in_threadpool(
+            service.catalog_candidates, user_lat, user_lng, queries, results, fan_out
+        )
+
+    if not candidates and service.store_db is not None:
+        candidates = await run_in_threadpool(service.store_db_candidates, user_lat, user_lng, media_type)
+        places_status = 'local'
+    return candidates, places_status
+
+
+async def rank_stores(origin, candidates):
+    try:
+        ranked = await service.route_planner.arank(maps_client, origin, candidates)
+    except RouteRankingError as e:
+        ranked = service.ranking_fallback(e)
+    return ranked[:5]
+
+
+async def route_to(origin, store):
+    try:
+        route_info = await service.route_planner.adirections(maps_client, origin, store)
+        service.log_directions(route_info)
+    except Exception as e:
+        route_info = service.directions_error(e)
+    return route_info
+
+
+async def map_payload(user_lat, user_lng, query, media_type, fan_out):
+    candidates, places_status = await find_candidates(user_lat, user_lng, query, media_type, fan_out)
+    placeholder = service.placeholder_response(query, user_lat, user_lng, candidates)
+    if placeholder is not None:
+        return placeholder
+
+    origin = (user_lat, user_lng)
+    stores = await rank_stores(origin, candidates)
+    route_info = await route_to(origin, stores[0])
+    return service.map_response(stores, route_info, places_status)
+
+
+async def map_ai(request):
+    try:
+        logger.info("Received map AI request")
+        user_lat, user_lng, query, media_type, fan_out = service.parse_map_request(await json_body(request))
+        key = service.map_flight_key(user_lat, user_lng, query, media_type, fan_out)
+        return FlaskJSONResponse(await service.map_flight.ado(key, map_payload, user_lat, user_lng, query,
+                                                              media_type, fan_out))
+
+    except service.RequestError as e:
+        return error_response(e.message, e.status)
+    except Exception as e:
+        logger.error(f"Error in map-ai endpoint: {str(e)}", exc_info=True)
+        return error_response('Internal server error', 500)
+
+
+async def snap_events(analysis, user_lat, user_lng, fan_out, started):
+    """The /snap-to-store event stream after the analysis, as in app.snap_to_store"""
+    timings = {'analysis_ms': (time.perf_counter() - started) * 1000.0}
+    yield service.sse_event('analysis', analysis)
+    if analysis['media_type'] is None:
+        yield service.sse_event('done', service.snap_done(timings, started))
+        return
+    try:
+        query = analysis['search_query']
+        candidates, places_status = await find_candidates(user_lat, user_lng, query, analysis['media_type'], fan_out)
+        placeholder = service.placeholder_response(query, user_lat, user_lng, candidates)
+        if placeholder is not None:
+            stores_payload, route_payload = service.split_map_payload(placeholder)
+            timings['stores_ms'] = (time.perf_counter() - started) * 1000.0
+            yield service.sse_event('stores', stores_payload)
+        else:
+            origin = (user_lat, user_lng)
+            stores = await rank_stores(origin, candidates)
+            timings['stores_ms'] = (time.perf_counter() - started) * 1000.0
+            yield service.sse_event('stores', service.split_map_payload(service.map_response(stores, {}, places_status))[0])
+            route_payload = {'route_info': await route_to(origin, stores[0])}
+        timings['route_ms'] = (time.perf_counter() - started) * 1000.0
+        yield service.sse_event('route', route_payload)
+        yield service.sse_event('done', service.snap_done(timings, started))
+    except Exception as e:
+        yield service.sse_event('error', service.snap_error(e))
+
+
+async def snap_to_store(request):
+    started = time.perf_counter()
+    try:
+        logger.info("Received snap-to-store request")
+        check_content_length(request)
+        form = await read_form(request)
+        user_lat, user_lng, fan_out = service.snap_request_location(form)
+        analysis = await run_analysis(form.get('file'))
+    except service.RequestError as e:
+        return error_response(e.message, e.status)
+    except Exception as e:
+        logger.error(f"Error in snap-to-store endpoint: {str(e)}", exc_info=True)
+        return error_response('Internal server error', 500)
+
+    return StreamingResponse(snap_events(analysis, user_lat, user_lng, fan_out, started),
+                             media_type='text/event-stream', headers=service.SSE_HEADERS)
+
+
+async def stats(request):
+    payload = service.stats_payload()
+    payload['rate_limit_storage'] = service.rate_limit_storage_stats(rate_limit_storage)
+    payload['async_upstream'] = upstream.stats() if upstream else None
+    return FlaskJSONResponse(payload)
+
+
+async def prometheus_metrics(request):
+    return Response(metrics.registry.render(), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+
+async def debug_profile(request):
+    try:
+        service.check_debug_token(request.headers.get('Authorization'))
+        body, content_type = await run_in_threadpool(service.sampling_profile, request.query_params)
+        return Response(body, headers={'Content-Type': content_type})
+    except service.RequestError as e:
+        return error_response(e.message, e.status)
+
+
+async def debug_profile_torch(request):
+    try:
+        service.check_debug_token(request.headers.get('Authorization'))
+        return FlaskJSONResponse(await run_in_threadpool(service.torch_profile, request.query_params))
+    except service.RequestError as e:
+        return error_response(e.message, e.status)
+
+
+async def status(request):
+    return FlaskJSONResponse(service.status_payload())
+
+
+async def ready(request):
+    payload, status_code = service.ready_payload()
+    return FlaskJSONResponse(payload, status_code=status_code)
+
+
+async def home(request):
+    return FlaskJSONResponse(service.home_payload())
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global upstream, maps_client, vision_client
+    upstream = AsyncUpstream(**service.http_client_options)
+    service.upstream_clients['async_upstream'] = upstream
+    if service.gmaps is not None:
+        maps_client = AsyncMapsClient(upstream, service.gmaps_key, base_url=service.MAPS_BASE_URL)
+    if service.vision_client is not None:
+        try:
+            vision_client = vision.ImageAnnotatorAsyncClient()
+        except Exception as e:
+            logger.warning(f"Google Vision async client not available: {e}")
+    try:
+        yield
+    finally:
+        for task in list(background_tasks):
+            task.cancel()
+        service.upstream_clients.pop('async_upstream', None)
+        await upstream.aclose()
+        if vision_client is not None:
+            await vision_client.transport.close()
+
+
+routes = [
+    Route('/analyze', analyze, methods=['POST']),
+    Route('/analyze/batch', analyze_batch, methods=['POST']),
+    Route('/map-ai', map_ai, methods=['POST']),
+    Route('/snap-to-store', snap_to_store, methods=['POST']),
+    Route('/stats', stats),
+    Route('/metrics', prometheus_metrics),
+    Route('/debug/profile', debug_profile),
+    Route('/debug/profile/torch', debug_profile_torch),
+    Route('/status', status),
+    Route('/ready', ready),
+    Route('/', home),
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(MetricsMiddleware, paths=[route.path for route in routes]),
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*']),
+        Middleware(
+            RateLimitMiddleware,
+            paths=[route.path for route in routes],
+            route_limits={
+                '/analyze': service.ANALYZE_RATE_LIMIT,
+                '/analyze/batch': service.ANALYZE_BATCH_RATE_LIMIT,
+                '/map-ai': service.MAP_AI_RATE_LIMIT,
+                '/snap-to-store': service.SNAP_TO_STORE_RATE_LIMIT,
+            },
+            default_limits=service.DEFAULT_RATE_LIMITS,
+            exempt={'/', '/ready', '/metrics'},
+            enabled=service.RATE_LIMIT_ENABLED,
+            storage=rate_limit_storage
+        ),
+    ],
+    lifespan=lifespan
+)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, host='0.0.0.0', port=int(os.getenv('PORT', 5000)), log_level='info')
@@ -0,0 +1,138 @@
+import asyncio
+import gzip
+import json
+import random
+
+import httpx
+
+from http_client import RETRY_STATUSES
+
+
+class AsyncUpstream:
+    """Shared httpx.AsyncClient for upstream Google APIs in the ASGI app.
+
+    The async counterpart of PooledHTTPClient: one keep-alive connection pool,
+    (connect, read) timeouts on every request, and connection errors and 429/5xx
+    responses retried a bounded number of times with jittered exponential backoff.
+    Waiting on a response or a backoff yields the event loop instead of a thread.
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=20, connect_timeout=3.05, read_timeout=10.0,
+                 retries=2, backoff_factor=0.25, backoff_jitter=0.25, gzip_requests=False, gzip_min_bytes=1024):
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.backoff_jitter = backoff_jitter
+        self.gzip_requests = gzip_requests
+        self.gzip_min_bytes = gzip_min_bytes
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=pool_maxsize, max_keepalive_connections=pool_connections),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+        )
+        self.in_flight = 0
+        self.requests = 0
+        self.retried = 0
+        self.failures = 0
+
+    async def _send(self, method, url, **kwargs):
+        self.in_flight += 1
+        try:
+            for attempt in range(self.retries + 1):
+                self.requests += 1
+                if attempt:
+                    self.retried += 1
+                    await asyncio.sleep(self.backoff_factor * (2 ** (attempt - 1)) + random.uniform(0, self.backoff_jitter))
+                try:
+                    response = await self.client.request(method, url, **kwargs)
+                except httpx.TransportError:
+                    if attempt == self.retries:
+                        self.failures += 1
+                        raise
+                    continue
+                if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    return response
+        finally:
+            self.in_flight -= 1
+
+    async def post_json(self, url, payload, params=None):
+        """POST a JSON payload, gzip-compressing the body when enabled and worthwhile"""
+        body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        if self.gzip_requests and len(body) >= self.gzip_min_bytes:
+            body = gzip.compress(body, compresslevel=5)
+            headers['Content-Encoding'] = 'gzip'
+        return await self._send('POST', url, params=params, content=body, headers=headers)
+
+    async def get(self, url, params=None):
+        return await self._send('GET', url, params=params)
+
+    def stats(self):
+        return {
+            'in_flight': self.in_flight,
+            'requests': self.requests,
+            'retried': self.retried,
+            'failures': self.failures,
+            'timeout': list(self.timeout),
+        }
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+class MapsApiError(Exception):
+    """A Maps web service answered with a status other than OK or ZERO_RESULTS"""
+
+    def __init__(self, status, message=None):
+        super().__init__(f"{status}: {message}" if message else status)
+        self.status = status
+
+
+def _latlng(point):
+    return f"{point[0]},{point[1]}"
+
+
+class AsyncMapsClient:
+    """The few Google Maps web service calls /map-ai makes, over AsyncUpstream.
+
+    Methods take the same arguments and return the same shapes as the googlemaps
+    client's places_nearby, distance_matrix and directions.
+    """
+
+    def __init__(self, upstream, key, base_url='https://maps.googleapis.com'):
+        self.upstream = upstream
+        self.key = key
+        self.base_url = base_url.rstrip('/')
+
+    async def _get(self, path, params):
+        response = await self.upstream.get(f"{self.base_url}{path}", params=dict(params, key=self.key))
+        response.raise_for_status()
+        body = response.json()
+        if body.get('status') not in ('OK', 'ZERO_RESULTS'):
+            raise MapsApiError(body.get('status'), body.get('error_message'))
+        return body
+
+    async def places_nearby(self, location=None, radius=None, keyword=None, type=None, page_token=None):
+        if page_token:
+            params = {'pagetoken': page_token}
+        else:
+            params = {'location': _latlng(location), 'radius': radius}
+            if keyword:
+                params['keyword'] = keyword
+            if type:
+                params['type'] = type
+        return await self._get('/maps/api/place/nearbysearch/json', params)
+
+    async def distance_matrix(self, origins, destinations, mode='driving'):
+        return await self._get('/maps/api/distancematrix/json', {
+            'origins': '|'.join(_latlng(origin) for origin in origins),
+            'destinations': '|'.join(_latlng(destination) for destination in destinations),
+            'mode': mode,
+        })
+
+    async def directions(self, origin, destination, mode='driving'):
+        body = await self._get('/maps/api/directions/json', {
+            'origin': _latlng(origin),
+            'destination': _latlng(destination),
+            'mode': mode,
+        })
+        return body.get('routes', [])
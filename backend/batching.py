@@ -0,0 +1,121 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Collect items submitted from concurrent request threads and process them together.
+
+    A background thread waits for the first queued item, then keeps collecting until
+    either max_batch_size items are queued or max_wait_ms has passed since that first
+    item arrived. The whole batch goes through run_batch(items) in one call, which must
+    return one result per item in the same order. With concurrency > 1, that many
+    batches can be collected and run at the same time, for a run_batch that hands
+    work to a pool.
+    """
+
+    def __init__(self, run_batch, max_batch_size=8, max_wait_ms=5.0, name='batcher', concurrency=1):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+
+        self._queue = queue.Queue()
+        self._collect_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._max_batch_seen = 0
+        self._batch_size_counts = {}
+        self._total_wait = 0.0
+        self._max_wait_seen = 0.0
+        self._total_run = 0.0
+
+        self._threads = [
+            threading.Thread(target=self._worker, name=f'{name}-worker-{i}', daemon=True)
+            for i in range(max(1, int(concurrency)))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, item):
+        """Queue an item and return a Future resolving to its result."""
+        future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    def process(self, item, timeout=None):
+        """Queue an item and block until its result is ready."""
+        return self.submit(item).result(timeout=timeout)
+
+    def _collect(self):
+        # Only one thread fills a batch at a time so concurrent collectors don't
+        # split the queue into many small batches
+        with self._collect_lock:
+            return self._fill([self._queue.get()])
+
+    def _fill(self, batch):
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    # Still drain anything that is already waiting
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            waits = [started - queued_at for _, _, queued_at in batch]
+
+            try:
+                results = self.run_batch([item for item, _, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"{self.name}: run_batch returned {len(results)} results for {len(batch)} items")
+            except Exception as e:
+                logger.error(f"{self.name}: batch of {len(batch)} failed: {e}", exc_info=True)
+                for _, future, _ in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
+
+            self._record(len(batch), waits, time.perf_counter() - started)
+
+    def _record(self, size, waits, run_time):
+        with self._stats_lock:
+            self._batches += 1
+            self._items += size
+            self._max_batch_seen = max(self._max_batch_seen, size)
+            self._batch_size_counts[size] = self._batch_size_counts.get(size, 0) + 1
+            self._total_wait += sum(waits)
+            self._max_wait_seen = max(self._max_wait_seen, max(waits))
+            self._total_run += run_time
+
+    def stats(self):
+        with self._stats_lock:
+            batches = self._batches or 1
+            items = self._items or 1
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'queue_depth': self._queue.qsize(),
+                'batches': self._batches,
+                'items': self._items,
+                'avg_batch_size': self._items / batches,
+                'max_batch_size_seen': self._max_batch_seen,
+                'batch_size_counts': dict(sorted(self._batch_size_counts.items())),
+                'avg_queue_wait_ms': self._total_wait / items * 1000.0,
+                'max_queue_wait_ms': self._max_wait_seen * 1000.0,
+                'avg_batch_run_ms': self._total_run / batches * 1000.0,
+            }
@@ -0,0 +1,61 @@
+"""Regression check: /map-ai only ranks stores its own Places searches returned.
+
+Runs bench.fake_google in this process, points app.py at it, and asks /map-ai
+for different queries at the same spot, with and without fan-out. Every store
+in a response must be named after one of that request's search keywords (the
+fake names places after the keyword), so it came from this request's results,
+never from an earlier search that left stores in the store catalog. Exits 1 and
+lists the strays on failure.
+
+Usage (from the backend directory):
+    python -m bench.check_candidates
+"""
+import argparse
+import os
+import sys
+
+from bench.fake_google import FakeGoogle
+from bench.fixtures import random_weights
+from bench.suite import FAKE_MAPS_KEY
+
+QUERIES = ['software store', 'music store', 'bookstore', 'video store']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lat', type=float, default=59.33)
+    parser.add_argument('--lng', type=float, default=18.07)
+    args = parser.parse_args()
+
+    fake = FakeGoogle(port=0, profiles={'all': {'latency_ms': 0}}).start()
+    os.environ.update({
+        'MAPS_BASE_URL': fake.url,
+        'GOOGLE_MAPS_API_KEY': FAKE_MAPS_KEY,
+        'GOOGLE_APPLICATION_CREDENTIALS': os.path.join(os.sep, 'nonexistent', 'credentials.json'),
+        'RESNET50_WEIGHTS': os.getenv('RESNET50_WEIGHTS') or random_weights(),
+        'MODEL_ALLOW_DOWNLOAD': 'False',
+        'RATE_LIMIT_ENABLED': 'False',
+        'STORE_SOURCE': 'places',
+    })
+    import app as service
+
+    client = service.app.test_client()
+    failures = 0
+    for fan_out in (False, True):
+        for query in QUERIES:
+            response = client.post('/map-ai', json={'lat': args.lat, 'lng': args.lng, 'query': query, 'fan_out': fan_out})
+            payload = response.get_json()
+            media_type = service.media_type_for_query(query)
+            # The fake names every place after the keyword it was searched with
+            keywords = tuple(f' {search_query.title()}' for search_query in service.places_queries(query, media_type, fan_out))
+            strays = [store['name'] for store in payload.get('all_stores', []) if not store['name'].endswith(keywords)]
+            status = 'ok' if response.status_code == 200 and payload.get('all_stores') and not strays else 'FAIL'
+            failures += status == 'FAIL'
+            print(f"{status:>4}  {query!r:18} fan_out={fan_out!s:5}  {len(payload.get('all_stores', []))} stores"
+                  + (f"  from other searches: {strays}" if strays else ''))
+    fake.stop()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Compare local inference backends against eager FP32.
+
+For each backend this reports top-1 and top-5 agreement with the FP32 model on the
+same images, plus p50/p99 forward-pass latency, so INFERENCE_BACKEND can be set to
+the fastest backend that still agrees closely enough.
+
+Usage (from the backend directory):
+    python -m bench.compare_backends --images calibration_images/ --backends eager torchscript static_int8
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+import torch
+from PIL import Image
+
+from bench.stats import percentile
+from calibrate_quantized import BASE_DIR, find_images
+from inference_backends import BACKENDS
+from local_model import LocalModel
+
+
+def load_inputs(paths, transform, count):
+    if paths:
+        tensors = []
+        for path in paths:
+            with Image.open(path) as image:
+                tensors.append(transform(image.convert('RGB')))
+        return tensors
+    # No images given: random inputs still exercise latency, agreement is less meaningful
+    generator = torch.Generator().manual_seed(0)
+    return [torch.randn(3, 224, 224, generator=generator) for _ in range(count)]
+
+
+def top5(local_model, inputs, batch_size):
+    results = []
+    for start in range(0, len(inputs), batch_size):
+        for _, classes, _ in local_model.run_batch(inputs[start:start + batch_size]):
+            results.append(classes)
+    return results
+
+
+def time_forward(local_model, inputs, batch_size, iterations):
+    batch = torch.stack(inputs[:batch_size])
+    latencies = []
+    with torch.no_grad():
+        for _ in range(iterations):
+            started = time.perf_counter()
+            local_model.forward(batch)
+            latencies.append((time.perf_counter() - started) * 1000.0)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', help='Directory of evaluation images (random inputs if omitted)')
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument('--channels-last', action='store_true')
+    parser.add_argument('--batch-size', type=int, default=1, help='Batch size for latency measurement')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--weights', default=os.getenv('RESNET50_WEIGHTS', os.path.join(BASE_DIR, 'models', 'resnet50.pth')))
+    parser.add_argument('--quantized', default=os.getenv('QUANTIZED_MODEL_PATH', os.path.join(BASE_DIR, 'models', 'resnet50_int8.pt')))
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    paths = find_images(args.images, args.limit) if args.images else []
+    reference = LocalModel(weights_path=args.weights, backend='eager')
+    reference.ensure_loaded()
+    inputs = load_inputs(paths, reference.transform, max(args.limit, args.batch_size))
+    reference_top5 = top5(reference, inputs, 16)
+
+    results = {}
+    for name in args.backends:
+        local_model = LocalModel(weights_path=args.weights, backend=name, channels_last=args.channels_last,
+                                 quantized_path=args.quantized)
+        try:
+            local_model.ensure_loaded()
+        except Exception as e:
+            print(f"{name:>14}: failed to load ({e})")
+            results[name] = {'error': str(e)}
+            continue
+
+        predicted = top5(local_model, inputs, 16)
+        top1_agreement = statistics.mean(p[0] == r[0] for p, r in zip(predicted, reference_top5))
+        top5_agreement = statistics.mean(len(set(p) & set(r)) / 5.0 for p, r in zip(predicted, reference_top5))
+        latencies = time_forward(local_model, inputs, args.batch_size, args.iterations)
+
+        results[name] = {
+            'top1_agreement': top1_agreement,
+            'top5_agreement': top5_agreement,
+            'p50_ms': percentile(latencies, 50),
+            'p99_ms': percentile(latencies, 99),
+            'build_ms': local_model.timings.get('build_backend_ms'),
+        }
+        print(f"{name:>14}: top1 {top1_agreement:6.1%}  top5 {top5_agreement:6.1%}  "
+              f"p50 {results[name]['p50_ms']:8.2f} ms  p99 {results[name]['p99_ms']:8.2f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'images': len(paths) or None,
+                'batch_size': args.batch_size,
+                'channels_last': args.channels_last,
+                'torch_threads': torch.get_num_threads(),
+                'results': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Compare two saved benchmark results and flag regressions.
+
+Works on the JSON written by bench.suite, bench.load_test, bench.micro and the
+other benchmarks with --output. Every latency (keys ending in _ms) and throughput
+(rps, ok_rps, items_per_s) present in both files is compared; a latency that grew,
+or a throughput that shrank, by more than --threshold is a regression. Exits with
+status 1 if there is any, so it can gate CI.
+
+Usage (from the backend directory):
+    python -m bench.compare_results baseline.json current.json --threshold 0.1
+"""
+import argparse
+import json
+import sys
+
+THROUGHPUT_KEYS = {'rps', 'ok_rps', 'items_per_s'}
+
+
+def direction(key):
+    """+1 if higher is better, -1 if lower is better, None if not compared"""
+    if key in THROUGHPUT_KEYS:
+        return 1
+    if key.endswith('_ms'):
+        return -1
+    return None
+
+
+def metrics(tree, path=()):
+    """{path: (value, direction)} for the comparable numbers in a result tree"""
+    found = {}
+    if isinstance(tree, dict):
+        for key, value in tree.items():
+            if isinstance(value, (dict, list)):
+                found.update(metrics(value, path + (str(key),)))
+            elif isinstance(value, (int, float)) and not isinstance(value, bool) and direction(key):
+                found[path + (key,)] = (float(value), direction(key))
+    elif isinstance(tree, list):
+        for index, value in enumerate(tree):
+            found.update(metrics(value, path + (str(index),)))
+    return found
+
+
+def compare(baseline, current, threshold):
+    """[(path, baseline value, current value, relative change, regressed)] for shared metrics"""
+    rows = []
+    current_metrics = metrics(current)
+    for path, (before, better) in sorted(metrics(baseline).items()):
+        if path not in current_metrics or before == 0:
+            continue
+        after = current_metrics[path][0]
+        change = (after - before) / abs(before)
+        rows.append((path, before, after, change, change * better < -threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Relative change that counts as a regression')
+    parser.add_argument('--all', action='store_true', help='Print every metric, not just the regressions')
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    rows = compare(baseline, current, args.threshold)
+    regressions = [row for row in rows if row[4]]
+    for path, before, after, change, regressed in rows:
+        if regressed or args.all:
+            marker = 'REGRESSION' if regressed else ''
+            print(f"{'.'.join(path):<70} {before:12.3f} -> {after:12.3f}  {change:+7.1%}  {marker}")
+    print(f'{len(rows)} metrics compared, {len(regressions)} regressed by more than {args.threshold:.0%}')
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
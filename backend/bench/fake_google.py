@@ -0,0 +1,291 @@
+"""Local stand-ins for the Google Vision REST and Maps web service APIs.
+
+Serves images:annotate, Places Nearby Search, Distance Matrix and Directions with
+the response shapes the backend reads, so /analyze and /map-ai can be benchmarked
+offline. Point the backend at it with VISION_REST_URL and MAPS_BASE_URL (any
+GOOGLE_*_API_KEY value works; Maps keys must still start with "AIza").
+
+Responses are deterministic: Vision labels are picked from a few media and
+non-media label sets by a hash of the image, and Places results are generated
+around the search location, seeded by location and keyword, so repeated searches
+return the same place_ids. Every service has its own latency (a base plus an
+exponentially distributed tail) and error rate. Failed Vision calls answer HTTP
+503; failed Maps calls answer status UNKNOWN_ERROR, which the clients raise
+without retrying. GET /_stats returns request counts, and POST /_config with
+{"service": {"latency_ms": ..., "jitter_ms": ..., "error_rate": ...}} changes
+the profiles while running ("all" applies to every service).
+
+Usage (from the backend directory):
+    python -m bench.fake_google --port 5200 --latency-ms 80 --jitter-ms 40
+    VISION_REST_URL=http://127.0.0.1:5200/v1/images:annotate MAPS_BASE_URL=http://127.0.0.1:5200 \\
+        GOOGLE_VISION_API_KEY=fake GOOGLE_MAPS_API_KEY=AIzaFake python app.py
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+SERVICES = ('vision', 'places', 'distance_matrix', 'directions')
+VISION_PATH = '/v1/images:annotate'
+MAPS_PATHS = {
+    '/maps/api/place/nearbysearch/json': 'places',
+    '/maps/api/distancematrix/json': 'distance_matrix',
+    '/maps/api/directions/json': 'directions',
+}
+
+# Label sets with descending scores; the last one classifies as no media type
+LABEL_SETS = [
+    [('Book', 0.96), ('Publication', 0.91), ('Book cover', 0.88), ('Font', 0.82), ('Paper', 0.71)],
+    [('Poster', 0.94), ('Film', 0.9), ('Movie', 0.86), ('Entertainment', 0.8), ('Darkness', 0.66)],
+    [('Video game', 0.93), ('Games', 0.89), ('Pc game', 0.84), ('Technology', 0.75), ('Font', 0.7)],
+    [('Vinyl record', 0.95), ('Music', 0.9), ('Album', 0.85), ('Circle', 0.78), ('Gramophone record', 0.74)],
+    [('Cat', 0.97), ('Mammal', 0.93), ('Whiskers', 0.9), ('Carnivore', 0.86), ('Fur', 0.8)],
+]
+STORE_NAMES = ['Corner', 'Central', 'Harbor', 'Market', 'Oak', 'Union', 'Station', 'Park', 'River', 'Hill']
+PLACES_PER_SEARCH = 20
+TRAVEL_SPEED_KMH = 30.0
+
+
+class Profile:
+    """Latency and error injection for one service"""
+
+    def __init__(self, latency_ms=50.0, jitter_ms=0.0, error_rate=0.0):
+        self.latency_ms = float(latency_ms)
+        self.jitter_ms = float(jitter_ms)
+        self.error_rate = float(error_rate)
+
+    def update(self, settings):
+        for name in ('latency_ms', 'jitter_ms', 'error_rate'):
+            if name in settings:
+                setattr(self, name, float(settings[name]))
+
+    def delay(self, rng):
+        tail = rng.expovariate(1.0 / self.jitter_ms) if self.jitter_ms > 0 else 0.0
+        return (self.latency_ms + tail) / 1000.0
+
+    def as_dict(self):
+        return {'latency_ms': self.latency_ms, 'jitter_ms': self.jitter_ms, 'error_rate': self.error_rate}
+
+
+def _haversine_km(lat1, lng1, lat2, lng2):
+    dlat = math.radians(lat2 - lat1)
+    dlng = math.radians(lng2 - lng1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlng / 2) ** 2
+    return 6371.0 * 2 * math.asin(math.sqrt(a))
+
+
+def _point(value):
+    lat, lng = value.split(',')
+    return float(lat), float(lng)
+
+
+def vision_labels(content):
+    """Label annotations for one base64 image, stable for the same image"""
+    digest = hashlib.sha256(content.encode('ascii') if isinstance(content, str) else content).digest()
+    return [{'description': description, 'score': score, 'topicality': score}
+            for description, score in LABEL_SETS[digest[0] % len(LABEL_SETS)]]
+
+
+def nearby_places(lat, lng, radius, keyword):
+    # Seeded by a ~100 m cell and the keyword so nearby repeated searches agree
+    cell = f'{lat:.3f},{lng:.3f}'
+    rng = random.Random(f'{cell}|{keyword}')
+    radius_deg = min(float(radius), 5000.0) / 111_000.0
+    places = []
+    for i in range(PLACES_PER_SEARCH):
+        place_lat = lat + rng.uniform(-radius_deg, radius_deg)
+        place_lng = lng + rng.uniform(-radius_deg, radius_deg) / max(0.1, math.cos(math.radians(lat)))
+        name = f"{rng.choice(STORE_NAMES)} {(keyword or 'store').title()}"
+        places.append({
+            'name': name,
+            'place_id': hashlib.sha1(f'{cell}|{keyword}|{i}'.encode()).hexdigest()[:20],
+            'geometry': {'location': {'lat': place_lat, 'lng': place_lng}},
+            'vicinity': f'{rng.randint(1, 200)} {rng.choice(STORE_NAMES)} St',
+            'rating': round(rng.uniform(3.0, 5.0), 1),
+        })
+    return places
+
+
+def _travel(origin, destination):
+    km = _haversine_km(origin[0], origin[1], destination[0], destination[1])
+    meters = int(km * 1300)  # Roads are longer than the straight line
+    seconds = int(meters / 1000.0 / TRAVEL_SPEED_KMH * 3600) + 60
+    return meters, seconds
+
+
+def distance_matrix(origins, destinations):
+    return [{'elements': [
+        {'status': 'OK', 'distance': {'value': meters, 'text': f'{meters / 1000:.1f} km'},
+         'duration': {'value': seconds, 'text': f'{max(1, seconds // 60)} mins'}}
+        for meters, seconds in (_travel(origin, destination) for destination in destinations)
+    ]} for origin in origins]
+
+
+def directions(origin, destination):
+    meters, seconds = _travel(origin, destination)
+    steps = ['Head <b>north</b>', 'Turn <b>right</b> onto Main St', 'Turn <b>left</b>', 'Arrive at destination']
+    return [{'legs': [{
+        'distance': {'value': meters, 'text': f'{meters / 1000:.1f} km'},
+        'duration': {'value': seconds, 'text': f'{max(1, seconds // 60)} mins'},
+        'steps': [{'html_instructions': step} for step in steps],
+    }]}]
+
+
+class FakeGoogle:
+    """The fake APIs on a ThreadingHTTPServer, run in a background thread or in the foreground"""
+
+    def __init__(self, host='127.0.0.1', port=5200, profiles=None, seed=0):
+        self.profiles = {service: Profile() for service in SERVICES}
+        for service, settings in (profiles or {}).items():
+            self.configure(service, settings)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = {service: 0 for service in SERVICES}
+        self.errors = {service: 0 for service in SERVICES}
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def configure(self, service, settings):
+        for name in (SERVICES if service == 'all' else [service]):
+            self.profiles[name].update(settings)
+
+    def _inject(self, service):
+        """Sleep for the service's latency; True if this call should fail"""
+        profile = self.profiles[service]
+        with self._lock:
+            self.requests[service] += 1
+            delay = profile.delay(self._rng)
+            failed = self._rng.random() < profile.error_rate
+            if failed:
+                self.errors[service] += 1
+        time.sleep(delay)
+        return failed
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': dict(self.requests),
+                'errors': dict(self.errors),
+                'profiles': {service: profile.as_dict() for service, profile in self.profiles.items()},
+            }
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep-alive, like the real APIs
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, payload):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _body(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                if self.headers.get('Content-Encoding') == 'gzip':
+                    body = gzip.decompress(body)
+                return json.loads(body or b'{}')
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                if url.path == '/_stats':
+                    return self._send(200, fake.stats())
+                service = MAPS_PATHS.get(url.path)
+                if service is None:
+                    return self._send(404, {'error': {'code': 404, 'message': 'Not found'}})
+                params = {name: values[0] for name, values in parse_qs(url.query).items()}
+                if fake._inject(service):
+                    return self._send(200, {'status': 'UNKNOWN_ERROR', 'error_message': 'Injected error'})
+
+                if service == 'places':
+                    if 'pagetoken' in params:
+                        return self._send(200, {'status': 'ZERO_RESULTS', 'results': []})
+                    lat, lng = _point(params['location'])
+                    results = nearby_places(lat, lng, params.get('radius', 5000), params.get('keyword', ''))
+                    return self._send(200, {'status': 'OK', 'results': results})
+                if service == 'distance_matrix':
+                    origins = [_point(value) for value in params['origins'].split('|')]
+                    destinations = [_point(value) for value in params['destinations'].split('|')]
+                    return self._send(200, {'status': 'OK', 'rows': distance_matrix(origins, destinations)})
+                routes = directions(_point(params['origin']), _point(params['destination']))
+                return self._send(200, {'status': 'OK', 'routes': routes})
+
+            def do_POST(self):
+                path = urlsplit(self.path).path
+                if path == '/_config':
+                    for service, settings in self._body().items():
+                        fake.configure(service, settings)
+                    return self._send(200, fake.stats())
+                if path != VISION_PATH:
+                    return self._send(404, {'error': {'code': 404, 'message': 'Not found'}})
+                payload = self._body()
+                if fake._inject('vision'):
+                    return self._send(503, {'error': {'code': 503, 'message': 'Injected error', 'status': 'UNAVAILABLE'}})
+                return self._send(200, {'responses': [
+                    {'labelAnnotations': vision_labels(request['image']['content'])}
+                    for request in payload.get('requests', [])
+                ]})
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-google', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5200)
+    parser.add_argument('--latency-ms', type=float, default=50.0, help='Base latency of every service')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='Mean of the exponential latency tail')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of calls that fail')
+    for service in SERVICES:
+        option = service.replace('_', '-')
+        parser.add_argument(f'--{option}-latency-ms', type=float)
+        parser.add_argument(f'--{option}-error-rate', type=float)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    profiles = {'all': {'latency_ms': args.latency_ms, 'jitter_ms': args.jitter_ms, 'error_rate': args.error_rate}}
+    fake = FakeGoogle(args.host, args.port, profiles, seed=args.seed)
+    for service in SERVICES:
+        overrides = {name: value for name, value in (
+            ('latency_ms', getattr(args, f'{service}_latency_ms')),
+            ('error_rate', getattr(args, f'{service}_error_rate')),
+        ) if value is not None}
+        fake.configure(service, overrides)
+    print(f'Fake Google APIs on {fake.url}: {json.dumps(fake.stats()["profiles"])}')
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Fixture images and model weights for the offline benchmarks.
+
+The image corpus is generated, so nothing has to be downloaded or checked in:
+smooth random textures (upscaled low-resolution noise with a little grain) in
+the sizes and formats phones and browsers upload, from 12 MP camera JPEGs down
+to small PNG screenshots. Each image is distinct enough to miss the perceptual
+analysis cache. Random ResNet50 weights stand in for the pretrained download;
+inference costs the same, the labels are meaningless.
+
+Usage (from the backend directory):
+    python -m bench.fixtures --images bench_images/ --count 32
+"""
+import argparse
+import io
+import os
+
+import numpy as np
+from PIL import Image
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RANDOM_WEIGHTS_PATH = os.path.join(BASE_DIR, 'models', 'resnet50_random.pth')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif')
+
+# (width, height, format, quality) cycled through the corpus
+IMAGE_SPECS = [
+    (4032, 3024, 'JPEG', 90),  # 12 MP phone camera
+    (1600, 1200, 'JPEG', 85),
+    (1024, 768, 'PNG', None),  # Screenshot-like
+    (3000, 4000, 'JPEG', 85),  # Portrait
+    (800, 600, 'JPEG', 80),
+    (1280, 960, 'WEBP', 80),
+]
+CONTENT_TYPES = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'WEBP': 'image/webp'}
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}
+
+
+def make_image(index, seed=0):
+    """(filename, bytes, content type) for corpus image index"""
+    width, height, fmt, quality = IMAGE_SPECS[index % len(IMAGE_SPECS)]
+    rng = np.random.default_rng([seed, index])
+    coarse = rng.integers(0, 256, (12, 16, 3), dtype=np.uint8)
+    if height > width:
+        coarse = coarse.transpose(1, 0, 2)
+    image = Image.fromarray(coarse).resize((width, height), Image.BICUBIC)
+    grain = rng.integers(-6, 7, (height, width, 1), dtype=np.int16)
+    image = Image.fromarray(np.clip(np.asarray(image, dtype=np.int16) + grain, 0, 255).astype(np.uint8))
+
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **({'quality': quality} if quality else {}))
+    return f'fixture_{index:03d}.{EXTENSIONS[fmt]}', buffer.getvalue(), CONTENT_TYPES[fmt]
+
+
+def image_corpus(count=24, seed=0):
+    return [make_image(index, seed) for index in range(count)]
+
+
+def load_images(directory):
+    """(filename, bytes, content type) for every image in directory"""
+    images = []
+    for name in sorted(os.listdir(directory)):
+        extension = os.path.splitext(name)[1].lower()
+        if extension in IMAGE_EXTENSIONS:
+            with open(os.path.join(directory, name), 'rb') as f:
+                content_type = 'image/jpeg' if extension in ('.jpg', '.jpeg') else f'image/{extension[1:]}'
+                images.append((name, f.read(), content_type))
+    if not images:
+        raise ValueError(f'No images in {directory}')
+    return images
+
+
+def random_weights(path=RANDOM_WEIGHTS_PATH, seed=0):
+    """Path of a ResNet50 state dict with random weights, written on first use"""
+    if not os.path.exists(path):
+        import torch
+        from torchvision import models
+
+        torch.manual_seed(seed)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        torch.save(models.resnet50(weights=None).state_dict(), path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', required=True, help='Directory to write the corpus to')
+    parser.add_argument('--count', type=int, default=24)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(args.images, exist_ok=True)
+    total = 0
+    for filename, content, _ in image_corpus(args.count, args.seed):
+        with open(os.path.join(args.images, filename), 'wb') as f:
+            f.write(content)
+        total += len(content)
+    print(f'Wrote {args.count} images ({total / 1e6:.1f} MB) to {args.images}')
+
+
+if __name__ == '__main__':
+    main()
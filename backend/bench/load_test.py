@@ -0,0 +1,182 @@
+"""Load test /analyze and /map-ai on the Flask app and the ASGI app side by side.
+
+Starts each serving mode as a subprocess on its own port (python app.py and
+python asgi_app.py, rate limiting disabled), waits until it is ready, then keeps
+--concurrency requests in flight for --duration seconds and reports requests per
+second, p50/p95/p99 latency and errors. The servers inherit the environment, so
+the same API keys, caches and fallbacks apply to both; --url tests one server that
+is already running instead. /analyze uploads cycle through the fixture corpus
+(bench/fixtures.py) unless --image or --images is given. For the same runs
+against local stand-ins for Google's APIs, per fallback path, see bench.suite.
+
+Usage (from the backend directory):
+    python -m bench.load_test --endpoint map-ai --concurrency 64 --duration 20
+    python -m bench.load_test --endpoint analyze --image cover.jpg --output load.json
+    python -m bench.load_test --endpoint analyze --images bench_images/ --modes asgi
+    python -m bench.load_test --url http://localhost:5000 --endpoint map-ai
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+
+from bench.fixtures import image_corpus, load_images
+from bench.stats import percentile
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = {'flask': 'app.py', 'asgi': 'asgi_app.py'}
+
+
+def make_request(args, image, rng):
+    if args.endpoint == 'analyze':
+        return {'files': {'file': image}}
+    # Spread origins over the area so route and Places caches see several cells
+    return {'json': {
+        'lat': args.lat + rng.uniform(-args.spread, args.spread),
+        'lng': args.lng + rng.uniform(-args.spread, args.spread),
+        'query': args.query,
+    }}
+
+
+async def run_load(url, args, images):
+    """Keep args.concurrency requests in flight for args.duration seconds.
+
+    images are (filename, bytes, content type) uploads for /analyze, sent in turn.
+    """
+    latencies = []
+    statuses = {}
+    errors = 0
+    rng = random.Random(args.seed)
+    uploads = itertools.cycle(images or [None])
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=args.timeout) as client:
+        deadline = time.perf_counter() + args.duration
+
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = await client.post(f'/{args.endpoint}', **make_request(args, next(uploads), rng))
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append((time.perf_counter() - started) * 1000.0)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    ok = statuses.get(200, 0)
+    return {
+        'requests': len(latencies),
+        'rps': len(latencies) / elapsed,
+        'ok_rps': ok / elapsed,
+        'p50_ms': percentile(latencies, 50) if latencies else None,
+        'p95_ms': percentile(latencies, 95) if latencies else None,
+        'p99_ms': percentile(latencies, 99) if latencies else None,
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'errors': errors,
+    }
+
+
+def wait_ready(url, endpoint, timeout):
+    # /analyze needs the local model loaded; /map-ai only needs the server up
+    path = '/ready' if endpoint == 'analyze' else '/'
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f'{url}{path}', timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f'{url} was not ready after {timeout:.0f} s')
+
+
+def start_server(mode, port, extra_env=None):
+    env = dict(os.environ, PORT=str(port), RATE_LIMIT_ENABLED='False', FLASK_DEBUG='False', **(extra_env or {}))
+    return subprocess.Popen([sys.executable, MODES[mode]], cwd=BASE_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def report(name, result):
+    p50, p95, p99 = (f"{result[key]:8.1f}" if result[key] is not None else '       -'
+                     for key in ('p50_ms', 'p95_ms', 'p99_ms'))
+    print(f"{name:>6}: {result['rps']:8.1f} req/s  p50 {p50} ms  p95 {p95} ms  p99 {p99} ms  "
+          f"statuses {result['statuses']}  errors {result['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoint', choices=['analyze', 'map-ai'], default='map-ai')
+    parser.add_argument('--modes', nargs='+', choices=sorted(MODES), default=['flask', 'asgi'])
+    parser.add_argument('--url', help='Load test this running server instead of starting the modes')
+    parser.add_argument('--port', type=int, default=5100, help='First port for the started servers')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=15.0, help='Seconds of load per server')
+    parser.add_argument('--warmup', type=float, default=2.0, help='Seconds of load before measuring')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Per-request timeout in seconds')
+    parser.add_argument('--startup-timeout', type=float, default=120.0)
+    parser.add_argument('--image', help='Image to upload to /analyze (default: the generated fixture corpus)')
+    parser.add_argument('--images', help='Directory of images to upload to /analyze in turn')
+    parser.add_argument('--corpus-size', type=int, default=24, help='Generated fixture images')
+    parser.add_argument('--lat', type=float, default=59.33, help='Center of /map-ai origins (default: Stockholm)')
+    parser.add_argument('--lng', type=float, default=18.07)
+    parser.add_argument('--spread', type=float, default=0.05, help='Half-width of the origin area in degrees')
+    parser.add_argument('--query', default='bookstore')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    images = None
+    if args.endpoint == 'analyze':
+        if args.image:
+            with open(args.image, 'rb') as f:
+                images = [(os.path.basename(args.image), f.read(), 'image/jpeg')]
+        elif args.images:
+            images = load_images(args.images)
+        else:
+            images = image_corpus(args.corpus_size, args.seed)
+
+    def measure(url):
+        if args.warmup > 0:
+            asyncio.run(run_load(url, argparse.Namespace(**dict(vars(args), duration=args.warmup)), images))
+        return asyncio.run(run_load(url, args, images))
+
+    results = {}
+    if args.url:
+        results['url'] = measure(args.url.rstrip('/'))
+        report('url', results['url'])
+    else:
+        for offset, mode in enumerate(args.modes):
+            url = f'http://127.0.0.1:{args.port + offset}'
+            server = start_server(mode, args.port + offset)
+            try:
+                wait_ready(url, args.endpoint, args.startup_timeout)
+                results[mode] = measure(url)
+            finally:
+                server.terminate()
+                server.wait()
+            report(mode, results[mode])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'endpoint': args.endpoint,
+                'concurrency': args.concurrency,
+                'duration': args.duration,
+                'results': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
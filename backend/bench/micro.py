@@ -0,0 +1,183 @@
+"""Microbenchmarks for the CPU-bound parts of /analyze.
+
+- classify: MediaMatcher.classify on Vision-style label sets
+- decode_vision / decode_local: decoding the fixture uploads at the sizes Vision
+  and the local model need (JPEG draft mode, integer reduce)
+- vision_encode: the downscale and JPEG re-encode of uploads Vision can't take as-is
+- local_preprocess: the local model's resize, crop and normalize
+- inference_bN: one local model forward pass over a batch of N images
+
+Each reports p50/p95/p99 and mean time per operation and operations per second,
+on the fixture corpus and random ResNet50 weights from bench.fixtures (pass
+--weights to time the real model or another INFERENCE_BACKEND). Compare saved
+results with bench.compare_results.
+
+Usage (from the backend directory):
+    python -m bench.micro --output micro.json
+    python -m bench.micro --only classify decode_vision --repeat 200
+"""
+import argparse
+import json
+import os
+import time
+
+from bench.fake_google import LABEL_SETS
+from bench.fixtures import image_corpus, load_images, random_weights
+from bench.stats import percentile
+from ingest import ingest_bytes
+from media_matcher import MediaMatcher
+
+# The service's defaults (app.py)
+VISION_MAX_BYTES = 1024 * 1024
+VISION_MAX_EDGE = 1024
+LOCAL_DECODE_EDGE = 256
+BENCHMARKS = ['classify', 'decode_vision', 'decode_local', 'vision_encode', 'local_preprocess', 'inference']
+
+
+def summarize(timings, items_per_op=1):
+    """Stats over per-operation times in seconds"""
+    mean = sum(timings) / len(timings)
+    return {
+        'ops': len(timings),
+        'p50_ms': percentile(timings, 50) * 1000.0,
+        'p95_ms': percentile(timings, 95) * 1000.0,
+        'p99_ms': percentile(timings, 99) * 1000.0,
+        'mean_ms': mean * 1000.0,
+        'items_per_s': items_per_op / mean if mean else None,
+    }
+
+
+def time_calls(fn, inputs, repeat):
+    timings = []
+    for _ in range(repeat):
+        for item in inputs:
+            started = time.perf_counter()
+            fn(item)
+            timings.append(time.perf_counter() - started)
+    return timings
+
+
+def bench_classify(args, images):
+    matcher = MediaMatcher()
+    label_sets = [([label for label, _ in labels], [score for _, score in labels]) for labels in LABEL_SETS]
+    # Many calls per sample: a single classify is close to the timer's resolution
+    calls = 100
+
+    def classify(labels):
+        for _ in range(calls):
+            matcher.classify(*labels)
+
+    timings = [elapsed / calls for elapsed in time_calls(classify, label_sets, args.repeat * 10)]
+    return summarize(timings)
+
+
+def ingested(image):
+    return ingest_bytes(image[1], VISION_MAX_BYTES, VISION_MAX_EDGE)
+
+
+def bench_decode(edge):
+    def run(args, images):
+        return summarize(time_calls(lambda image: ingested(image).decode(edge), images, args.repeat))
+    return run
+
+
+def bench_vision_encode(args, images):
+    decoded = []
+    for image in images:
+        upload = ingested(image)
+        upload.decode(VISION_MAX_EDGE)
+        if upload.transcoded:
+            decoded.append(upload)
+
+    def encode(upload):
+        upload._vision_content = None
+        upload.vision_content()
+
+    if not decoded:
+        return None
+    return summarize(time_calls(encode, decoded, args.repeat))
+
+
+def bench_local_preprocess(args, images, model):
+    decoded = []
+    for image in images:
+        upload = ingested(image)
+        upload.decode(LOCAL_DECODE_EDGE)
+        decoded.append(upload.rgb)
+    return summarize(time_calls(model.preprocess, decoded, args.repeat))
+
+
+def bench_inference(args, images, model, batch_size):
+    tensors = []
+    for image in images[:batch_size]:
+        upload = ingested(image)
+        upload.decode(LOCAL_DECODE_EDGE)
+        tensors.append(model.preprocess(upload.rgb))
+    distinct = len(tensors)
+    while len(tensors) < batch_size:
+        tensors.append(tensors[len(tensors) % distinct])
+    for _ in range(2):
+        model.run_batch(tensors)
+    return summarize(time_calls(model.run_batch, [tensors], args.inference_repeat), items_per_op=batch_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument('--images', help='Directory of images (default: the generated fixture corpus)')
+    parser.add_argument('--corpus-size', type=int, default=12)
+    parser.add_argument('--repeat', type=int, default=5, help='Passes over the images per benchmark')
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 4, 8])
+    parser.add_argument('--inference-repeat', type=int, default=10, help='Forward passes per batch size')
+    parser.add_argument('--weights', help='ResNet50 state dict (default: random weights)')
+    parser.add_argument('--backend', default=os.getenv('INFERENCE_BACKEND', 'eager'), help='Local inference backend')
+    parser.add_argument('--threads', type=int, help='torch threads (default: torch default)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    images = load_images(args.images) if args.images else image_corpus(args.corpus_size, args.seed)
+    runs = {
+        'classify': bench_classify,
+        'decode_vision': bench_decode(VISION_MAX_EDGE),
+        'decode_local': bench_decode(LOCAL_DECODE_EDGE),
+        'vision_encode': bench_vision_encode,
+    }
+    model = None
+    if {'local_preprocess', 'inference'} & set(args.only):
+        import torch
+        from local_model import LocalModel
+
+        if args.threads:
+            torch.set_num_threads(args.threads)
+        model = LocalModel(weights_path=args.weights or random_weights(), allow_download=False, backend=args.backend)
+        model.ensure_loaded()
+
+    results = {}
+    for name in args.only:
+        if name == 'local_preprocess':
+            results[name] = bench_local_preprocess(args, images, model)
+        elif name == 'inference':
+            for batch_size in args.batch_sizes:
+                results[f'inference_b{batch_size}'] = bench_inference(args, images, model, batch_size)
+        else:
+            results[name] = runs[name](args, images)
+
+    for name, result in results.items():
+        if result is None:
+            print(f'{name:>16}: skipped (no uploads need it)')
+            continue
+        print(f"{name:>16}: p50 {result['p50_ms']:9.3f} ms  p95 {result['p95_ms']:9.3f} ms  "
+              f"p99 {result['p99_ms']:9.3f} ms  {result['items_per_s']:10.1f} items/s")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'images': len(images),
+                'backend': args.backend if model else None,
+                'results': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
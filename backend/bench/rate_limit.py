@@ -0,0 +1,163 @@
+"""Rate limit check cost and accuracy: memory:// against the shared shm:// storage.
+
+- check: one FixedWindowRateLimiter.hit, as Flask-Limiter makes per limit and
+  request, with the service's limits spread over --clients client addresses
+- threads: the same from --threads threads at once, per check
+- processes: --processes forked workers hitting one shared limit of --limit
+  per minute for --duration seconds. With shm:// exactly --limit hits are
+  allowed in total; with memory:// every worker allows --limit on its own.
+
+Each storage reports p50/p95/p99 and mean time per check, checks per second and,
+for single-threaded checks, process CPU time per check (which includes
+memory://'s background expiry thread).
+Compare saved results with bench.compare_results.
+
+Usage (from the backend directory):
+    python -m bench.rate_limit --output rate_limit.json
+    python -m bench.rate_limit --storages shm --processes 8 --limit 5000
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+from limits import parse
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter
+
+from bench.stats import percentile
+import shm_storage  # noqa: F401 - registers shm://
+
+# The service's limits (app.py)
+LIMITS = ['200 per day', '50 per hour', '10 per minute', '20 per minute']
+ROUTES = ['/analyze', '/map-ai', '/snap-to-store', '/stats']
+
+
+def summarize(timings):
+    mean = sum(timings) / len(timings)
+    return {
+        'ops': len(timings),
+        'p50_ms': percentile(timings, 50) * 1000.0,
+        'p95_ms': percentile(timings, 95) * 1000.0,
+        'p99_ms': percentile(timings, 99) * 1000.0,
+        'mean_ms': mean * 1000.0,
+        'items_per_s': 1 / mean if mean else None,
+    }
+
+
+def storage_uri(name, path):
+    return 'memory://' if name == 'memory' else f'shm://{path}'
+
+
+def checks(args):
+    """(limit, route, client) for every check, cycling through the service's limits"""
+    items = [parse(limit) for limit in LIMITS]
+    clients = [f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}' for i in range(args.clients)]
+    return [(items[i % len(items)], ROUTES[i % len(ROUTES)], clients[i % len(clients)]) for i in range(args.checks)]
+
+
+def bench_check(limiter, calls):
+    timings = []
+    for item, route, client in calls:
+        started = time.perf_counter()
+        limiter.hit(item, route, client)
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def bench_threads(limiter, calls, threads):
+    timings = []
+    workers = [threading.Thread(target=lambda: timings.extend(bench_check(limiter, calls)))
+               for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return timings
+
+
+def process_worker(uri, limit, duration, results):
+    limiter = FixedWindowRateLimiter(storage_from_string(uri))
+    item = parse(f'{limit} per minute')
+    allowed = calls = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        allowed += limiter.hit(item, '/analyze', '10.0.0.1')
+        calls += 1
+    results.put((allowed, calls))
+
+
+def bench_processes(uri, args):
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    workers = [context.Process(target=process_worker, args=(uri, args.limit, args.duration, results))
+               for _ in range(args.processes)]
+    for worker in workers:
+        worker.start()
+    totals = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    allowed = sum(allowed for allowed, _ in totals)
+    calls = sum(calls for _, calls in totals)
+    return {
+        'processes': args.processes,
+        'limit': args.limit,
+        'allowed': allowed,
+        'allowed_over_limit': allowed - args.limit,
+        'rps': calls / args.duration,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--storages', nargs='+', choices=['memory', 'shm'], default=['memory', 'shm'])
+    parser.add_argument('--checks', type=int, default=20000, help='Checks per timed pass')
+    parser.add_argument('--clients', type=int, default=1000, help='Distinct client addresses')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--limit', type=int, default=1000, help='Per-minute limit the processes share')
+    parser.add_argument('--duration', type=float, default=3.0, help='Seconds the processes run')
+    parser.add_argument('--path', help='Counter file for shm:// (default: a temporary file)')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    calls = checks(args)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name in args.storages:
+            path = args.path or os.path.join(directory, 'limits')
+            storage = storage_from_string(storage_uri(name, path))
+            storage.reset()
+            limiter = FixedWindowRateLimiter(storage)
+            bench_check(limiter, calls[:1000])  # Warm up
+            # Process CPU time also counts background work, like memory://'s expiry thread
+            cpu_started = time.process_time()
+            check = summarize(bench_check(limiter, calls))
+            check['cpu_mean_ms'] = (time.process_time() - cpu_started) / len(calls) * 1000.0
+            results[name] = {
+                'check': check,
+                'threads': summarize(bench_threads(limiter, calls, args.threads)),
+            }
+            storage.reset()
+            results[name]['processes'] = bench_processes(storage_uri(name, path), args)
+
+    for name, result in results.items():
+        for run in ('check', 'threads'):
+            stats = result[run]
+            cpu = f"  cpu {stats['cpu_mean_ms'] * 1000:7.2f} us" if 'cpu_mean_ms' in stats else ''
+            print(f"{name:>6} {run:>8}: p50 {stats['p50_ms'] * 1000:7.2f} us  p99 {stats['p99_ms'] * 1000:7.2f} us  "
+                  f"mean {stats['mean_ms'] * 1000:7.2f} us{cpu}  {stats['items_per_s']:10.0f} checks/s")
+        processes = result['processes']
+        print(f"{name:>6} processes: {processes['allowed']} of {processes['processes']} x "
+              f"{processes['rps'] / processes['processes']:.0f} checks/s allowed against a limit of {processes['limit']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'limits': LIMITS, 'clients': args.clients, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
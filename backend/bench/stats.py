@@ -0,0 +1,8 @@
+"""Summary statistics shared by the benchmarks."""
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of values, pct from 0 to 100"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
@@ -0,0 +1,112 @@
+"""Compare nearest-store selection: StoreCatalog vs the old degree-space min().
+
+The old /map-ai code picked the nearest store with a Python min() over Euclidean
+distance in degrees. This generates a synthetic catalog of stores around a city,
+then for random query points reports the per-query latency of both approaches
+and how often the degree-space pick is not the true (haversine) nearest store.
+
+Usage (from the backend directory):
+    python -m bench.store_catalog --stores 1000 10000 --lat 59.33 --lng 18.07
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+
+from bench.stats import percentile
+from places_cache import haversine_km
+from store_catalog import StoreCatalog
+
+
+def make_stores(count, lat, lng, spread_degrees, rng):
+    return [{
+        'name': f'Store {i}',
+        'lat': lat + rng.uniform(-spread_degrees, spread_degrees),
+        'lng': lng + rng.uniform(-spread_degrees, spread_degrees),
+        'place_id': f'store{i}',
+    } for i in range(count)]
+
+
+def degree_nearest(stores, lat, lng):
+    def distance(lat1, lon1, lat2, lon2):
+        return ((lat1 - lat2)**2 + (lon1 - lon2)**2)**0.5
+
+    return min(stores, key=lambda s: distance(lat, lng, s['lat'], s['lng']))
+
+
+def time_queries(function, queries):
+    latencies = []
+    results = []
+    for lat, lng in queries:
+        started = time.perf_counter()
+        results.append(function(lat, lng))
+        latencies.append((time.perf_counter() - started) * 1e6)
+    return latencies, results
+
+
+def summarize(latencies):
+    return {
+        'mean_us': statistics.mean(latencies),
+        'p50_us': percentile(latencies, 50),
+        'p99_us': percentile(latencies, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stores', type=int, nargs='+', default=[100, 1000, 10000, 100000])
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--lat', type=float, default=59.33, help='City center latitude (default: Stockholm)')
+    parser.add_argument('--lng', type=float, default=18.07)
+    parser.add_argument('--spread', type=float, default=0.5, help='Half-width of the store area in degrees')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    results = {}
+    for count in args.stores:
+        rng = random.Random(args.seed)
+        stores = make_stores(count, args.lat, args.lng, args.spread, rng)
+        queries = [(args.lat + rng.uniform(-args.spread, args.spread), args.lng + rng.uniform(-args.spread, args.spread))
+                   for _ in range(args.queries)]
+
+        catalog = StoreCatalog()
+        build_started = time.perf_counter()
+        catalog.upsert(stores)
+        catalog.merge()
+        build_ms = (time.perf_counter() - build_started) * 1000.0
+
+        baseline_latencies, baseline_picks = time_queries(lambda lat, lng: degree_nearest(stores, lat, lng), queries)
+        catalog_latencies, catalog_picks = time_queries(lambda lat, lng: catalog.nearest(lat, lng, k=args.k), queries)
+
+        wrong = 0
+        for (lat, lng), baseline, picks in zip(queries, baseline_picks, catalog_picks):
+            truth = min(stores, key=lambda s: haversine_km(lat, lng, s['lat'], s['lng']))
+            assert picks[0]['place_id'] == truth['place_id']
+            wrong += baseline['place_id'] != truth['place_id']
+
+        results[count] = {
+            'build_ms': build_ms,
+            'degree_min': summarize(baseline_latencies),
+            'catalog_nearest': summarize(catalog_latencies),
+            'degree_min_wrong_rate': wrong / len(queries),
+        }
+        print(f"{count:>7} stores: degree min() p50 {results[count]['degree_min']['p50_us']:9.1f} us  "
+              f"catalog k={args.k} p50 {results[count]['catalog_nearest']['p50_us']:7.1f} us  "
+              f"degree pick wrong {wrong / len(queries):6.1%}  (build {build_ms:.1f} ms)")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'center': [args.lat, args.lng],
+                'spread_degrees': args.spread,
+                'k': args.k,
+                'queries': args.queries,
+                'results': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""Offline load tests of /analyze and /map-ai, per fallback path.
+
+Runs bench.fake_google in this process and the backend (python app.py and/or
+python asgi_app.py) as a subprocess pointed at it through VISION_REST_URL and
+MAPS_BASE_URL, so nothing reaches Google and no pretrained weights are
+downloaded: the local model gets random weights from bench.fixtures. Each
+scenario drives the requests down one path:
+
+    vision         Vision REST and Maps answer normally
+    vision_down    every Vision call fails, so /analyze falls back to the local model
+    maps_down      every Maps call fails: stores come from the catalog or placeholders
+    no_keys        no Google keys: the local model and the mock stores
+    slow_upstream  every upstream call takes --slow-latency-ms
+
+For every mode, scenario and endpoint it reports requests per second and
+p50/p95/p99 latency, and from the server's GET /metrics (scraped before and
+after the measured run) where labels and stores came from and the mean time per
+stage and upstream backend. The analysis cache is off unless --keep-caches, so
+/analyze measures the pipeline rather than cache hits. Compare saved results
+with bench.compare_results.
+
+Usage (from the backend directory):
+    python -m bench.suite --output suite.json
+    python -m bench.suite --modes asgi --scenarios vision no_keys --endpoints analyze --duration 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+
+import httpx
+
+from bench.fake_google import FakeGoogle
+from bench.fixtures import image_corpus, load_images, random_weights
+from bench.load_test import report, run_load, start_server, wait_ready
+
+SCENARIOS = {
+    'vision': ({}, {}),
+    'vision_down': ({}, {'vision': {'error_rate': 1.0}}),
+    'maps_down': ({}, {'places': {'error_rate': 1.0}, 'distance_matrix': {'error_rate': 1.0},
+                       'directions': {'error_rate': 1.0}}),
+    'no_keys': ({'GOOGLE_VISION_API_KEY': '', 'GOOGLE_MAPS_API_KEY': ''}, {}),
+    'slow_upstream': ({}, None),  # Profiles from --slow-latency-ms
+}
+FAKE_MAPS_KEY = 'AIzaFakeBenchmarkKeyFakeBenchmarkKey00'
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})? (\S+)$')
+LABEL = re.compile(r'(\w+)="([^"]*)"')
+
+
+def scrape(url):
+    """{(metric name, ((label, value), ...)): value} from the server's /metrics"""
+    samples = {}
+    for line in httpx.get(f'{url}/metrics', timeout=10).text.splitlines():
+        match = SAMPLE.match(line)
+        if match:
+            name, labels, value = match.groups()
+            samples[(name, tuple(LABEL.findall(labels or '')))] = float(value)
+    return samples
+
+
+def server_breakdown(before, after):
+    """Label and store sources, and mean stage and backend times, over the measured run"""
+    delta = {key: value - before.get(key, 0.0) for key, value in after.items()}
+
+    def counts(name):
+        return {dict(labels)['source']: int(value) for (metric, labels), value in delta.items()
+                if metric == name and value}
+
+    def means(name, label):
+        result = {}
+        for (metric, labels), total in delta.items():
+            if metric == f'{name}_sum':
+                count = delta.get((f'{name}_count', labels), 0.0)
+                if count:
+                    key = '/'.join(value for key, value in labels if key in label)
+                    result[key] = {'count': int(count), 'mean_ms': total / count * 1000.0}
+        return result
+
+    return {
+        'label_sources': counts('snap2store_label_source_total'),
+        'store_sources': counts('snap2store_store_source_total'),
+        'stages': means('snap2store_stage_duration_seconds', ('stage',)),
+        'backends': means('snap2store_backend_duration_seconds', ('backend', 'outcome')),
+    }
+
+
+def scenario_env(name, fake_url, keep_caches):
+    env = {
+        'VISION_REST_URL': f'{fake_url}/v1/images:annotate',
+        'MAPS_BASE_URL': fake_url,
+        'GOOGLE_VISION_API_KEY': 'fake-vision-key',
+        'GOOGLE_MAPS_API_KEY': FAKE_MAPS_KEY,
+        # Keep the Vision client library (and real credentials) out of the run
+        'GOOGLE_APPLICATION_CREDENTIALS': os.path.join(os.sep, 'nonexistent', 'credentials.json'),
+        'RESNET50_WEIGHTS': os.getenv('RESNET50_WEIGHTS') or random_weights(),
+        'MODEL_ALLOW_DOWNLOAD': 'False',
+    }
+    if not keep_caches:
+        env['ANALYSIS_CACHE_MAX_ENTRIES'] = '0'
+    env.update(SCENARIOS[name][0])
+    return env
+
+
+def configure_fake(fake, name, args):
+    fake.configure('all', {'latency_ms': args.latency_ms, 'jitter_ms': args.jitter_ms, 'error_rate': 0.0})
+    profiles = SCENARIOS[name][1]
+    if profiles is None:
+        profiles = {'all': {'latency_ms': args.slow_latency_ms}}
+    for service, settings in profiles.items():
+        fake.configure(service, settings)
+
+
+def measure(url, args, endpoint, images):
+    load_args = argparse.Namespace(**dict(vars(args), endpoint=endpoint))
+    if args.warmup > 0:
+        asyncio.run(run_load(url, argparse.Namespace(**dict(vars(load_args), duration=args.warmup)), images))
+    before = scrape(url)
+    result = asyncio.run(run_load(url, load_args, images))
+    result['server'] = server_breakdown(before, scrape(url))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', nargs='+', choices=['flask', 'asgi'], default=['flask', 'asgi'])
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--endpoints', nargs='+', choices=['analyze', 'map-ai'], default=['analyze', 'map-ai'])
+    parser.add_argument('--port', type=int, default=5100, help='Port for the backend under test')
+    parser.add_argument('--fake-port', type=int, default=0, help='Port for the fake Google APIs (default: any free port)')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds of load per endpoint')
+    parser.add_argument('--warmup', type=float, default=2.0, help='Seconds of load before measuring')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Per-request timeout in seconds')
+    parser.add_argument('--startup-timeout', type=float, default=180.0)
+    parser.add_argument('--latency-ms', type=float, default=60.0, help='Base latency of the fake APIs')
+    parser.add_argument('--jitter-ms', type=float, default=20.0, help='Mean of their exponential latency tail')
+    parser.add_argument('--slow-latency-ms', type=float, default=800.0, help='Latency in the slow_upstream scenario')
+    parser.add_argument('--images', help='Directory of images to upload (default: the generated fixture corpus)')
+    parser.add_argument('--corpus-size', type=int, default=24)
+    parser.add_argument('--keep-caches', action='store_true', help='Leave the analysis cache on')
+    parser.add_argument('--lat', type=float, default=59.33, help='Center of /map-ai origins (default: Stockholm)')
+    parser.add_argument('--lng', type=float, default=18.07)
+    parser.add_argument('--spread', type=float, default=0.05, help='Half-width of the origin area in degrees')
+    parser.add_argument('--query', default='bookstore')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    images = load_images(args.images) if args.images else image_corpus(args.corpus_size, args.seed)
+    fake = FakeGoogle(port=args.fake_port, seed=args.seed).start()
+    url = f'http://127.0.0.1:{args.port}'
+    results = {}
+    try:
+        for mode in args.modes:
+            for name in args.scenarios:
+                configure_fake(fake, name, args)
+                server = start_server(mode, args.port, scenario_env(name, fake.url, args.keep_caches))
+                try:
+                    wait_ready(url, 'analyze' if 'analyze' in args.endpoints else 'map-ai', args.startup_timeout)
+                    for endpoint in args.endpoints:
+                        result = measure(url, args, endpoint, images)
+                        results.setdefault(mode, {}).setdefault(name, {})[endpoint] = result
+                        report(f'{mode} {name} {endpoint}', result)
+                        server_result = result['server']
+                        print(f"        labels {server_result['label_sources']}  stores {server_result['store_sources']}")
+                finally:
+                    server.terminate()
+                    server.wait()
+    finally:
+        fake.stop()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'concurrency': args.concurrency,
+                'duration': args.duration,
+                'fake_latency_ms': args.latency_ms,
+                'fake_jitter_ms': args.jitter_ms,
+                'results': results,
+                'fake_google': fake.stats(),
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
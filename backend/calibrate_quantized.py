@@ -0,0 +1,91 @@
+"""Create the static INT8 ResNet50 artifact used by INFERENCE_BACKEND=static_int8.
+
+The FP32 model is prepared with FX graph mode quantization for the fbgemm engine,
+calibrated on a directory of representative photos (book covers, DVDs, game boxes,
+shelves - the kind of images /analyze sees), converted to INT8 and saved as
+TorchScript so the server can load it without redoing any of this.
+
+Usage:
+    python calibrate_quantized.py --images calibration_images/ --limit 200
+"""
+import argparse
+import copy
+import logging
+import os
+
+import torch
+from PIL import Image
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+from local_model import LocalModel
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('calibrate_quantized')
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')
+
+
+def find_images(directory, limit):
+    paths = []
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(root, name))
+    return sorted(paths)[:limit]
+
+
+def calibration_batches(paths, transform, batch_size):
+    batch = []
+    for path in paths:
+        try:
+            with Image.open(path) as image:
+                batch.append(transform(image.convert('RGB')))
+        except OSError as e:
+            logger.warning(f"Skipping {path}: {e}")
+            continue
+        if len(batch) == batch_size:
+            yield torch.stack(batch)
+            batch = []
+    if batch:
+        yield torch.stack(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', required=True, help='Directory of calibration images')
+    parser.add_argument('--limit', type=int, default=200, help='Max calibration images (default: 200)')
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--weights', default=os.getenv('RESNET50_WEIGHTS', os.path.join(BASE_DIR, 'models', 'resnet50.pth')))
+    parser.add_argument('--output', default=os.getenv('QUANTIZED_MODEL_PATH', os.path.join(BASE_DIR, 'models', 'resnet50_int8.pt')))
+    args = parser.parse_args()
+
+    paths = find_images(args.images, args.limit)
+    if not paths:
+        parser.error(f"No images found in {args.images}")
+
+    torch.backends.quantized.engine = 'fbgemm'
+    local_model = LocalModel(weights_path=args.weights, backend='eager')
+    local_model.ensure_loaded()
+    model = copy.deepcopy(local_model.model).eval()
+
+    example = torch.zeros(1, 3, 224, 224)
+    prepared = prepare_fx(model, get_default_qconfig_mapping('fbgemm'), (example,))
+
+    logger.info(f"Calibrating on {len(paths)} images")
+    with torch.no_grad():
+        for batch in calibration_batches(paths, local_model.transform, args.batch_size):
+            prepared(batch)
+
+    quantized = convert_fx(prepared)
+    with torch.no_grad():
+        scripted = torch.jit.freeze(torch.jit.trace(quantized, example).eval())
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    torch.jit.save(scripted, args.output)
+    logger.info(f"Saved INT8 model to {args.output} ({os.path.getsize(args.output) / 1e6:.1f} MB)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+import threading
+import time
+from collections import deque
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend whose breaker is open"""
+
+    def __init__(self, name):
+        super().__init__(f"{name} circuit is open")
+        self.name = name
+
+
+class Permit:
+    """An allowed call, handed back when recording its outcome.
+
+    epoch is the breaker's state epoch when the call was allowed; probe is set for
+    the calls let through while half-open.
+    """
+
+    __slots__ = ('epoch', 'probe')
+
+    def __init__(self, epoch, probe=False):
+        self.epoch = epoch
+        self.probe = probe
+
+
+class CircuitBreaker:
+    """Per-backend circuit breaker over a rolling window of recent calls.
+
+    While closed, every call is allowed and its outcome and latency are recorded.
+    Once at least min_calls are in the window and the share of bad calls (errors,
+    or calls slower than slow_call_ms) reaches failure_rate, the breaker opens and
+    callers skip the backend for open_seconds. After that it goes half-open and
+    lets up to half_open_probes calls through: a successful probe closes it again,
+    a failed one re-opens it for another open_seconds. allow() returns a Permit
+    (or None) that the caller passes back with the outcome, so a slow call that
+    started before the breaker opened can't settle a later probe.
+
+    on_call, if given, is called with (latency_ms, outcome) for every recorded
+    call, outcome being 'ok', 'slow' or 'error'.
+    """
+
+    def __init__(self, name, window_size=20, min_calls=5, failure_rate=0.5, slow_call_ms=None,
+                 open_seconds=30.0, half_open_probes=1, on_call=None):
+        self.name = name
+        self.min_calls = max(1, int(min_calls))
+        self.failure_rate = float(failure_rate)
+        self.slow_call_ms = slow_call_ms
+        self.open_seconds = float(open_seconds)
+        self.half_open_probes = max(1, int(half_open_probes))
+        self.on_call = on_call
+
+        self._window = deque(maxlen=max(self.min_calls, int(window_size)))  # (bad, latency_ms)
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = None
+        self._probes_in_flight = 0
+        self._epoch = 0  # Bumped on every state change; permits from older epochs are stale
+        self._times_opened = 0
+        self._rejected = 0
+        self._last_error = None
+
+    @property
+    def state(self):
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._epoch += 1
+            self._probes_in_flight = 0
+
+    def allow(self):
+        """A Permit if a call may go to the backend now, else None.
+
+        Every permitted call must be recorded, or released, with its permit.
+        """
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == CLOSED:
+                return Permit(self._epoch)
+            if self._state == HALF_OPEN and self._probes_in_flight < self.half_open_probes:
+                self._probes_in_flight += 1
+                return Permit(self._epoch, probe=True)
+            self._rejected += 1
+            return None
+
+    def _current_probe(self, permit):
+        return self._state == HALF_OPEN and permit.probe and permit.epoch == self._epoch
+
+    def release(self, permit):
+        """Give back a permitted call that ended without an outcome (it was cancelled).
+
+        Frees its half-open probe, if it held one, without counting it either way.
+        """
+        with self._lock:
+            if self._current_probe(permit):
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def record_success(self, permit, latency_ms):
+        slow = self.slow_call_ms is not None and latency_ms > self.slow_call_ms
+        self._record(permit, slow, latency_ms, 'slow call' if slow else None)
+        if self.on_call is not None:
+            self.on_call(latency_ms, 'slow' if slow else 'ok')
+
+    def record_failure(self, permit, latency_ms, error=None):
+        self._record(permit, True, latency_ms, error or 'error')
+        if self.on_call is not None:
+            self.on_call(latency_ms, 'error')
+
+    def _record(self, permit, bad, latency_ms, error):
+        with self._lock:
+            if error:
+                self._last_error = str(error)
+            if self._state == HALF_OPEN:
+                if not self._current_probe(permit):
+                    # A call that started before the breaker went half-open: not the probe's result
+                    return
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if bad:
+                    self._open()
+                else:
+                    self._state = CLOSED
+                    self._epoch += 1
+                    self._window.clear()
+                    self._window.append((False, latency_ms))
+                return
+            if self._state == OPEN:
+                # A call that started before the breaker opened
+                return
+
+            self._window.append((bad, latency_ms))
+            if len(self._window) >= self.min_calls and self._bad_rate() >= self.failure_rate:
+                self._open()
+
+    def _open(self):
+        self._state = OPEN
+        self._epoch += 1
+        self._opened_at = time.monotonic()
+        self._times_opened += 1
+
+    def _bad_rate(self):
+        return sum(bad for bad, _ in self._window) / len(self._window)
+
+    def status(self):
+        with self._lock:
+            self._maybe_half_open()
+            latencies = sorted(latency for _, latency in self._window)
+
+            def percentile(pct):
+                if not latencies:
+                    return None
+                return latencies[min(len(latencies) - 1, int(pct / 100.0 * len(latencies)))]
+
+            return {
+                'state': self._state,
+                'calls_in_window': len(self._window),
+                'error_rate': self._bad_rate() if self._window else 0.0,
+                'p50_latency_ms': percentile(50),
+                'p95_latency_ms': percentile(95),
+                'times_opened': self._times_opened,
+                'rejected_calls': self._rejected,
+                'retry_in_seconds': max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+                if self._state == OPEN else None,
+                'last_error': self._last_error,
+            }
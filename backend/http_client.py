@@ -0,0 +1,103 @@
+import gzip
+import json
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Upstream statuses worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class CountingAdapter(HTTPAdapter):
+    """HTTPAdapter that tracks requests in flight and totals per outcome"""
+
+    def __init__(self, *args, **kwargs):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        with self._lock:
+            self.in_flight += 1
+            self.requests += 1
+        try:
+            return super().send(request, **kwargs)
+        except Exception:
+            with self._lock:
+                self.failures += 1
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def connection_counts(self):
+        """(connections opened, requests sent) over the live urllib3 pools"""
+        opened = sent = 0
+        pools = self.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+                sent += pool.num_requests
+        return opened, sent
+
+
+class PooledHTTPClient:
+    """Shared HTTP session for upstream Google APIs.
+
+    One requests.Session with a keep-alive connection pool, so repeated calls to
+    the same host reuse TCP/TLS connections. Every request gets a (connect, read)
+    timeout, and connection errors and 429/5xx responses are retried a bounded
+    number of times with jittered exponential backoff. The same session is handed
+    to the googlemaps client so Maps calls share the pool.
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=20, connect_timeout=3.05, read_timeout=10.0,
+                 retries=2, backoff_factor=0.25, backoff_jitter=0.25, gzip_requests=False, gzip_min_bytes=1024):
+        self.timeout = (connect_timeout, read_timeout)
+        self.gzip_requests = gzip_requests
+        self.gzip_min_bytes = gzip_min_bytes
+
+        # The Google APIs called here are read-only, so POST is as safe to retry as GET
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset({'GET', 'POST'}),
+            backoff_factor=backoff_factor,
+            backoff_jitter=backoff_jitter,
+            raise_on_status=False
+        )
+        self.adapter = CountingAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+    def post_json(self, url, payload, params=None, timeout=None):
+        """POST a JSON payload, gzip-compressing the body when enabled and worthwhile"""
+        body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        if self.gzip_requests and len(body) >= self.gzip_min_bytes:
+            body = gzip.compress(body, compresslevel=5)
+            headers['Content-Encoding'] = 'gzip'
+        return self.session.post(url, params=params, data=body, headers=headers, timeout=timeout or self.timeout)
+
+    def get(self, url, params=None, timeout=None):
+        return self.session.get(url, params=params, timeout=timeout or self.timeout)
+
+    def stats(self):
+        opened, sent = self.adapter.connection_counts()
+        return {
+            'in_flight': self.adapter.in_flight,
+            'requests': self.adapter.requests,
+            'failures': self.adapter.failures,
+            'connections_opened': opened,
+            'connection_reuse_ratio': 1.0 - opened / sent if sent else 0.0,
+            'timeout': list(self.timeout),
+        }
@@ -0,0 +1,69 @@
+import logging
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('eager', 'torchscript', 'compile', 'dynamic_int8', 'static_int8')
+
+
+def _build_eager(model, example, artifact_path):
+    return model
+
+
+def _build_torchscript(model, example, artifact_path):
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+        return torch.jit.optimize_for_inference(torch.jit.freeze(traced.eval()))
+
+
+def _build_compile(model, example, artifact_path):
+    # dynamic=True so each micro-batch size doesn't trigger a recompile
+    return torch.compile(model, dynamic=True)
+
+
+def _build_dynamic_int8(model, example, artifact_path):
+    # Only the final Linear layer is dynamically quantizable in ResNet50; convolutions
+    # need static quantization with calibration (static_int8)
+    torch.backends.quantized.engine = 'fbgemm'
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _build_static_int8(model, example, artifact_path):
+    if not artifact_path:
+        raise ValueError("static_int8 backend needs QUANTIZED_MODEL_PATH (create it with calibrate_quantized.py)")
+    torch.backends.quantized.engine = 'fbgemm'
+    return torch.jit.load(artifact_path, map_location='cpu').eval()
+
+
+_BUILDERS = {
+    'eager': _build_eager,
+    'torchscript': _build_torchscript,
+    'compile': _build_compile,
+    'dynamic_int8': _build_dynamic_int8,
+    'static_int8': _build_static_int8,
+}
+
+
+def build_backend(name, model, channels_last=False, artifact_path=None):
+    """Wrap an eval-mode FP32 model in the requested inference backend.
+
+    Returns a callable mapping an NCHW float batch to logits. With channels_last the
+    model weights and every input batch use the NHWC memory layout, which oneDNN
+    convolution kernels run faster on CPU.
+    """
+    if name not in _BUILDERS:
+        raise ValueError(f"Unknown inference backend '{name}', expected one of: {', '.join(BACKENDS)}")
+
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+    if channels_last:
+        model = model.to(memory_format=memory_format)
+    example = torch.zeros(1, 3, 224, 224).contiguous(memory_format=memory_format)
+
+    module = _BUILDERS[name](model, example, artifact_path)
+    logger.info(f"Inference backend: {name}{' (channels_last)' if channels_last else ''}")
+
+    def forward(batch):
+        return module(batch.contiguous(memory_format=memory_format))
+
+    return forward
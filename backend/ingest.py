@@ -0,0 +1,229 @@
+import io
+import threading
+import time
+
+from flask import Request
+from PIL import Image
+
+from metrics import stage_seconds
+
+# Formats Google Vision accepts as-is (MPO is the multi-picture JPEG many phones produce)
+VISION_FORMATS = {'JPEG', 'MPO', 'PNG', 'GIF', 'BMP', 'WEBP'}
+
+# JPEG quality range searched when fitting a Vision payload into its byte budget
+MAX_JPEG_QUALITY = 85
+MIN_JPEG_QUALITY = 35
+QUALITY_SEARCH_STEPS = 3
+
+
+class InMemoryRequest(Request):
+    """Request class that keeps multipart file uploads in memory.
+
+    Werkzeug spools uploads larger than 500 KB to a temporary file on disk. Uploads
+    are already capped by MAX_CONTENT_LENGTH, so keeping them in a BytesIO avoids the
+    disk round trip and lets the decoder read straight from the request buffer.
+    """
+
+    # Body size limits for endpoints that accept more than MAX_CONTENT_LENGTH, by endpoint name
+    endpoint_max_content_length = {}
+
+    @property
+    def max_content_length(self):
+        limit = self.endpoint_max_content_length.get(self.endpoint)
+        return limit if limit is not None else super().max_content_length
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
+
+    def _load_form_data(self):
+        # Receiving and parsing a multipart body, once per request, is the upload stage
+        if 'form' in self.__dict__ or self.mimetype != 'multipart/form-data':
+            return super()._load_form_data()
+        started = time.perf_counter()
+        super()._load_form_data()
+        stage_seconds.observe(time.perf_counter() - started, 'upload')
+
+
+class PreprocessStats:
+    """Running totals for decode time and Vision payload savings"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._decodes = 0
+        self._decode_ms = 0.0
+        self._max_decode_ms = 0.0
+        self._vision_payloads = 0
+        self._transcoded = 0
+        self._bytes_in = 0
+        self._bytes_sent = 0
+
+    def record_decode(self, decode_ms):
+        with self._lock:
+            self._decodes += 1
+            self._decode_ms += decode_ms
+            self._max_decode_ms = max(self._max_decode_ms, decode_ms)
+
+    def record_vision_payload(self, bytes_in, bytes_sent, transcoded):
+        with self._lock:
+            self._vision_payloads += 1
+            self._transcoded += int(transcoded)
+            self._bytes_in += bytes_in
+            self._bytes_sent += bytes_sent
+
+    def stats(self):
+        with self._lock:
+            return {
+                'decodes': self._decodes,
+                'avg_decode_ms': self._decode_ms / self._decodes if self._decodes else 0.0,
+                'max_decode_ms': self._max_decode_ms,
+                'vision_payloads': self._vision_payloads,
+                'transcoded': self._transcoded,
+                'bytes_in': self._bytes_in,
+                'bytes_sent': self._bytes_sent,
+                'bytes_saved': self._bytes_in - self._bytes_sent,
+            }
+
+
+preprocess_stats = PreprocessStats()
+
+
+def encode_jpeg(image, max_bytes):
+    """Encode as JPEG at the highest quality that fits in max_bytes.
+
+    Tries MAX_JPEG_QUALITY first, then binary-searches down to MIN_JPEG_QUALITY.
+    Returns (data, quality); if nothing fits, the smallest encoding tried is returned.
+    """
+    def encode(quality):
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=quality)
+        return buffer.getvalue()
+
+    data = encode(MAX_JPEG_QUALITY)
+    if len(data) <= max_bytes:
+        return data, MAX_JPEG_QUALITY
+
+    best = None
+    smallest = (data, MAX_JPEG_QUALITY)
+    low, high = MIN_JPEG_QUALITY, MAX_JPEG_QUALITY - 1
+    for _ in range(QUALITY_SEARCH_STEPS):
+        if low > high:
+            break
+        quality = (low + high) // 2
+        data = encode(quality)
+        if len(data) <= max_bytes:
+            best = (data, quality)
+            low = quality + 1
+        else:
+            smallest = (data, quality)
+            high = quality - 1
+
+    if best is None and smallest[1] != MIN_JPEG_QUALITY:
+        smallest = (encode(MIN_JPEG_QUALITY), MIN_JPEG_QUALITY)
+    return best or smallest
+
+
+class IngestedImage:
+    """An uploaded image held in memory, with the original bytes kept for reuse."""
+
+    def __init__(self, stream, max_vision_bytes, max_vision_edge):
+        self.stream = stream
+        # A view over the request buffer: hashing and base64 read it without copying
+        self.raw = stream.getbuffer()
+        self.max_vision_bytes = max_vision_bytes
+        self.max_vision_edge = max_vision_edge
+        self.image = None
+        self.format = None
+        self.original_size = None
+        self.decode_ms = None
+        self.vision_quality = None
+        self._rgb = None
+        self._vision_content = None
+
+    def decode(self, target_edge=None):
+        """Decode the image from the buffer at close to target_edge.
+
+        Both sides of the result stay at least target_edge pixels (or the original
+        size if smaller): JPEGs are decoded at a reduced DCT scale via draft mode,
+        other formats are box-reduced by an integer factor after loading.
+
+        Raises PIL.UnidentifiedImageError if the bytes are not a readable image.
+        """
+        started = time.perf_counter()
+        self.stream.seek(0)
+        image = Image.open(self.stream)
+        self.format = image.format
+        self.original_size = image.size
+
+        if target_edge and image.format in ('JPEG', 'MPO'):
+            image.draft('RGB', (target_edge, target_edge))
+        image.load()
+
+        if target_edge:
+            factor = min(image.size) // target_edge
+            if factor >= 2:
+                if image.mode not in ('L', 'RGB', 'RGBA'):
+                    image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+                image = image.reduce(factor)
+
+        self.image = image
+        self._rgb = None
+        self.decode_ms = (time.perf_counter() - started) * 1000.0
+        preprocess_stats.record_decode(self.decode_ms)
+        stage_seconds.observe(self.decode_ms / 1000.0, 'decode')
+        return image
+
+    @property
+    def rgb(self):
+        """The image in RGB mode, converted only when something needs pixels"""
+        if self._rgb is None:
+            self._rgb = self.image if self.image.mode == 'RGB' else self.image.convert('RGB')
+        return self._rgb
+
+    @property
+    def transcoded(self):
+        return (
+            self.format not in VISION_FORMATS
+            or len(self.raw) > self.max_vision_bytes
+            or max(self.original_size) > self.max_vision_edge
+        )
+
+    def vision_content(self):
+        """Bytes to send to Google Vision.
+
+        The upload itself is reused when Vision accepts the format and it is within
+        both the byte budget and the edge limit. Otherwise the image is downscaled to
+        max_vision_edge and JPEG-encoded at a quality that fits max_vision_bytes.
+        """
+        if self._vision_content is None:
+            if not self.transcoded:
+                self._vision_content = bytes(self.raw)
+            else:
+                started = time.perf_counter()
+                image = self.rgb
+                if max(image.size) > self.max_vision_edge:
+                    image = image.copy()
+                    image.thumbnail((self.max_vision_edge, self.max_vision_edge), Image.BILINEAR, reducing_gap=2.0)
+                self._vision_content, self.vision_quality = encode_jpeg(image, self.max_vision_bytes)
+                stage_seconds.observe(time.perf_counter() - started, 'vision_encode')
+            preprocess_stats.record_vision_payload(len(self.raw), len(self._vision_content), self.transcoded)
+        return self._vision_content
+
+    @property
+    def bytes_saved(self):
+        if self._vision_content is None:
+            return 0
+        return len(self.raw) - len(self._vision_content)
+
+
+def ingest_upload(file, max_vision_bytes, max_vision_edge):
+    """Wrap an uploaded file's in-memory buffer; call decode() on the result for pixels"""
+    stream = file.stream
+    if not isinstance(stream, io.BytesIO):
+        stream.seek(0)
+        stream = io.BytesIO(stream.read())
+    return IngestedImage(stream, max_vision_bytes, max_vision_edge)
+
+
+def ingest_bytes(data, max_vision_bytes, max_vision_edge):
+    """Same as ingest_upload for an upload already read into bytes"""
+    return IngestedImage(io.BytesIO(data), max_vision_bytes, max_vision_edge)
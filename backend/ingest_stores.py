@@ -0,0 +1,214 @@
+"""Load stores into the local SQLite store database used by /map-ai (STORE_DB_PATH).
+
+Accepts CSV, GeoJSON or OpenStreetMap XML (.osm) extracts; the format is taken
+from the file extension unless --format is given. Each store is tagged with the
+media types it serves (book, movie, game, music, software, media):
+
+- CSV: columns name, lat/latitude, lng/lon/longitude and optionally place_id/id,
+  vicinity/address, rating, media_type (several separated by ';')
+- GeoJSON: Point features (other geometries use the centroid of their coordinates)
+  with the same names as properties
+- OSM: nodes and ways with a shop/amenity tag in OSM_MEDIA_TYPES; ways are placed
+  at the centroid of their nodes
+
+--media-type tags every store in the file, in addition to its own tags. Stores
+without any media type are skipped. Re-running with the same ids updates stores.
+
+Usage:
+    python ingest_stores.py stores.csv --media-type book
+    python ingest_stores.py sweden-shops.osm --db data/stores.db
+"""
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import math
+import os
+import xml.etree.ElementTree as ElementTree
+
+from media_matcher import STORE_TYPES
+from store_db import ingest_stores
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('ingest_stores')
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DB_PATH = os.path.join(BASE_DIR, 'data', 'stores.db')
+MEDIA_TYPES = tuple(STORE_TYPES)
+
+# OSM (key, value) tags and the media types such stores carry
+OSM_MEDIA_TYPES = {
+    ('shop', 'books'): ['book'],
+    ('amenity', 'library'): ['book'],
+    ('shop', 'video'): ['movie'],
+    ('shop', 'video_games'): ['game'],
+    ('shop', 'games'): ['game'],
+    ('shop', 'toys'): ['game'],
+    ('shop', 'music'): ['music'],
+    ('shop', 'musical_instrument'): ['music'],
+    ('shop', 'computer'): ['software'],
+    ('shop', 'electronics'): ['game', 'software', 'media'],
+    ('shop', 'department_store'): ['media'],
+}
+
+
+def parse_media_types(value):
+    media_types = [media_type.strip().lower() for media_type in (value or '').replace(',', ';').split(';')]
+    return [media_type for media_type in media_types if media_type in MEDIA_TYPES]
+
+
+def first(mapping, *keys):
+    for key in keys:
+        if mapping.get(key) not in (None, ''):
+            return mapping[key]
+    return None
+
+
+def make_place_id(source, name, lat, lng):
+    digest = hashlib.sha1(f'{name}|{lat:.6f}|{lng:.6f}'.encode('utf-8')).hexdigest()[:16]
+    return f'{source}:{digest}'
+
+
+def parse_number(value):
+    """A float from a file field, accepting a decimal comma ('4,5'), or None if it isn't one"""
+    try:
+        number = float(str(value).strip().replace(',', '.'))
+    except ValueError:
+        return None
+    return number if math.isfinite(number) else None
+
+
+def make_store(properties, lat, lng, source, media_types):
+    name = first(properties, 'name', 'title')
+    if not name or lat is None or lng is None:
+        return None
+    lat, lng = parse_number(lat), parse_number(lng)
+    if lat is None or lng is None or not (-90 <= lat <= 90) or not (-180 <= lng <= 180):
+        return None
+    rating = first(properties, 'rating')
+    if rating is not None:
+        value, rating = rating, parse_number(rating)
+        if rating is None:
+            logger.warning(f"Ignoring rating {value!r} of {name}: not a number")
+    place_id = first(properties, 'place_id', 'id')
+    return {
+        'name': name,
+        'lat': lat,
+        'lng': lng,
+        'vicinity': first(properties, 'vicinity', 'address', 'addr:full'),
+        'rating': rating,
+        'place_id': f'{source}:{place_id}' if place_id is not None else make_place_id(source, name, lat, lng),
+        'media_types': media_types,
+    }
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            yield make_store(row, first(row, 'lat', 'latitude'), first(row, 'lng', 'lon', 'longitude'), 'csv',
+                             parse_media_types(row.get('media_type')))
+
+
+def centroid(coordinates):
+    points = []
+
+    def collect(value):
+        if value and isinstance(value[0], (int, float)):
+            points.append(value)
+        else:
+            for item in value:
+                collect(item)
+
+    collect(coordinates)
+    if not points:
+        return None, None
+    return sum(p[1] for p in points) / len(points), sum(p[0] for p in points) / len(points)
+
+
+def read_geojson(path):
+    with open(path, encoding='utf-8') as f:
+        collection = json.load(f)
+    for feature in collection.get('features', []):
+        properties = dict(feature.get('properties') or {})
+        if feature.get('id') is not None:
+            properties.setdefault('id', feature['id'])
+        geometry = feature.get('geometry') or {}
+        lat, lng = centroid(geometry.get('coordinates') or [])
+        yield make_store(properties, lat, lng, 'geojson', parse_media_types(properties.get('media_type')))
+
+
+def osm_media_types(tags):
+    media_types = []
+    for key in ('shop', 'amenity'):
+        for media_type in OSM_MEDIA_TYPES.get((key, tags.get(key)), []):
+            if media_type not in media_types:
+                media_types.append(media_type)
+    return media_types
+
+
+def osm_address(tags):
+    street = ' '.join(filter(None, (tags.get('addr:street'), tags.get('addr:housenumber'))))
+    return ', '.join(filter(None, (street, tags.get('addr:city')))) or None
+
+
+def read_osm(path):
+    # Node coordinates are kept for way centroids; OSM extracts list nodes before ways
+    node_coordinates = {}
+    for _, element in ElementTree.iterparse(path, events=('end',)):
+        if element.tag not in ('node', 'way'):
+            continue
+        tags = {tag.get('k'): tag.get('v') for tag in element.iter('tag')}
+        if element.tag == 'node':
+            lat, lng = float(element.get('lat')), float(element.get('lon'))
+            node_coordinates[element.get('id')] = (lat, lng)
+        else:
+            points = [node_coordinates[nd.get('ref')] for nd in element.iter('nd') if nd.get('ref') in node_coordinates]
+            lat = sum(p[0] for p in points) / len(points) if points else None
+            lng = sum(p[1] for p in points) / len(points) if points else None
+
+        media_types = osm_media_types(tags)
+        if media_types:
+            properties = dict(tags, id=f"{element.tag}/{element.get('id')}", vicinity=osm_address(tags))
+            yield make_store(properties, lat, lng, 'osm', media_types)
+        element.clear()
+
+
+READERS = {'csv': read_csv, 'geojson': read_geojson, 'osm': read_osm}
+EXTENSIONS = {'.csv': 'csv', '.geojson': 'geojson', '.json': 'geojson', '.osm': 'osm', '.xml': 'osm'}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='CSV, GeoJSON or OSM XML file')
+    parser.add_argument('--db', default=os.getenv('STORE_DB_PATH', DEFAULT_DB_PATH))
+    parser.add_argument('--format', choices=sorted(READERS))
+    parser.add_argument('--media-type', action='append', default=[], choices=MEDIA_TYPES,
+                        help='Media type to tag every store with (repeatable)')
+    args = parser.parse_args()
+
+    file_format = args.format or EXTENSIONS.get(os.path.splitext(args.path)[1].lower())
+    if file_format is None:
+        parser.error('Could not tell the file format from its extension, use --format')
+
+    skipped = 0
+
+    def stores():
+        nonlocal skipped
+        for store in READERS[file_format](args.path):
+            if store is not None:
+                for media_type in args.media_type:
+                    if media_type not in store['media_types']:
+                        store['media_types'].append(media_type)
+            if store is None or not store['media_types']:
+                skipped += 1
+                continue
+            yield store
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    written = ingest_stores(args.db, stores(), source=file_format)
+    logger.info(f"Ingested {written} stores into {args.db} ({skipped} skipped without a name, location or media type)")
+
+
+if __name__ == '__main__':
+    main()
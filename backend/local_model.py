@@ -0,0 +1,243 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CLASSES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'imagenet_classes.txt')
+
+
+def load_class_names(path=CLASSES_PATH):
+    """Load the ImageNet class names bundled with the service"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            names = [line.strip() for line in f if line.strip()]
+        logger.info(f"Loaded {len(names)} ImageNet classes from {path}")
+        return names
+    except OSError as e:
+        logger.warning(f"Could not load ImageNet classes: {e}")
+        return None
+
+
+class LocalModel:
+    """ResNet50 fallback classifier, loaded off the import path.
+
+    torch and torchvision are only imported when the model is loaded, either in a
+    background thread (start()) or on first use (ensure_loaded()). Weights come from
+    weights_path when it exists; otherwise torchvision's pretrained weights are used
+    if allow_download is set, which may hit the network on a cold cache. The FP32
+    model is then wrapped in the selected inference backend (see
+    inference_backends.py). After loading, warmup forward passes run so the first
+    real request doesn't pay for lazy kernel initialization or compilation.
+
+    threads, when set, is applied with torch.set_num_threads before anything else
+    runs. A process that forks inference workers (worker_pool.py) loads with
+    threads=1 and warmup=False, so it never starts a torch intra-op thread pool for
+    the workers to inherit; each worker calls warm_up() itself.
+
+    class_groups optionally assigns every class index to a group (-1 for none); each
+    result then also carries the total probability per group, computed as one
+    gather and scatter-add over the softmax output.
+    """
+
+    def __init__(self, weights_path=None, allow_download=True, backend='eager', channels_last=False,
+                 quantized_path=None, class_names=None, class_groups=None, threads=None, warmup=True):
+        self.weights_path = weights_path
+        self.allow_download = allow_download
+        self.backend = backend
+        self.channels_last = channels_last
+        self.quantized_path = quantized_path
+        self.class_names = class_names if class_names is not None else load_class_names()
+        self.class_groups = class_groups
+        self.threads = threads
+        self.warmup = warmup
+
+        self.model = None
+        self.forward = None
+        self.transform = None
+        self.error = None
+        self.timings = {}
+        self._torch = None
+        self._grouped_classes = None
+        self._group_ids = None
+        self._group_count = 0
+        self._ready = threading.Event()
+        self._load_lock = threading.Lock()
+        self._thread = None
+        self._profile_capture = None
+        self._profile_lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    @property
+    def loading(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Load the model in a background thread"""
+        if self._thread is None and not self.ready:
+            self._thread = threading.Thread(target=self._load_quietly, name='model-loader', daemon=True)
+            self._thread.start()
+
+    def _load_quietly(self):
+        try:
+            self.ensure_loaded()
+        except Exception:
+            pass  # Already logged and kept in self.error for /ready
+
+    def ensure_loaded(self):
+        """Load the model if it isn't loaded yet; blocks until it is"""
+        if self.ready:
+            return
+        with self._load_lock:
+            if self.ready:
+                return
+            try:
+                self._load()
+            except Exception as e:
+                self.error = str(e)
+                logger.error(f"Local model failed to load: {e}", exc_info=True)
+                raise
+            self.error = None
+            self._ready.set()
+
+    def _load(self):
+        timings = {}
+        started = time.perf_counter()
+
+        step = time.perf_counter()
+        import torch
+        from torchvision import models, transforms
+        self._torch = torch
+        if self.threads:
+            torch.set_num_threads(self.threads)
+        timings['import_torch_ms'] = (time.perf_counter() - step) * 1000.0
+
+        step = time.perf_counter()
+        model = models.resnet50(weights=None)
+        timings['build_model_ms'] = (time.perf_counter() - step) * 1000.0
+
+        step = time.perf_counter()
+        if self.weights_path and os.path.exists(self.weights_path):
+            state_dict = torch.load(self.weights_path, map_location='cpu', weights_only=True)
+            model.load_state_dict(state_dict)
+            logger.info(f"Loaded ResNet50 weights from {self.weights_path}")
+        elif self.allow_download:
+            logger.warning(f"No local weights at {self.weights_path}, using torchvision pretrained weights")
+            weights = models.ResNet50_Weights.IMAGENET1K_V1
+            model.load_state_dict(weights.get_state_dict(progress=False))
+        else:
+            raise FileNotFoundError(f"ResNet50 weights not found at {self.weights_path}")
+        model.eval()
+        timings['load_weights_ms'] = (time.perf_counter() - step) * 1000.0
+
+        step = time.perf_counter()
+        from inference_backends import build_backend
+        forward = build_backend(self.backend, model, self.channels_last, self.quantized_path)
+        timings['build_backend_ms'] = (time.perf_counter() - step) * 1000.0
+
+        if self.class_groups:
+            groups = torch.tensor(self.class_groups)
+            self._grouped_classes = torch.nonzero(groups >= 0).flatten()
+            self._group_ids = groups[self._grouped_classes]
+            self._group_count = int(groups.max()) + 1
+
+        self.transform = transforms.Compose([
+            transforms.Resize(256),
+            transforms.CenterCrop(224),
+            transforms.ToTensor(),
+            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+        ])
+
+        self.model = model
+        self.forward = forward
+        if self.warmup:
+            timings['warmup_ms'] = self.warm_up()
+        timings['total_ms'] = (time.perf_counter() - started) * 1000.0
+        self.timings = timings
+        logger.info("Local model ready: " + ", ".join(f"{name}={value:.0f}" for name, value in timings.items()))
+
+    def warm_up(self):
+        """Run the warmup forward passes on the loaded model; returns their time in ms"""
+        # Two batch sizes so torch.compile specializes for dynamic shapes up front
+        started = time.perf_counter()
+        with self._torch.no_grad():
+            for batch_size in (1, 2):
+                self.forward(self._torch.zeros(batch_size, 3, 224, 224))
+        return (time.perf_counter() - started) * 1000.0
+
+    def preprocess(self, image):
+        """Turn an RGB PIL image into a normalized 3x224x224 tensor"""
+        self.ensure_loaded()
+        return self.transform(image)
+
+    def run_batch(self, tensors):
+        """Run the model on a list of preprocessed image tensors in one forward pass.
+
+        Returns one (top-5 probabilities, top-5 class indices, group scores) tuple of
+        plain lists per input, which are cheap to pass back from a worker process.
+        Group scores are None without class_groups.
+        """
+        self.ensure_loaded()
+        capture = self._profile_capture
+        if capture is not None and capture.claim():
+            return capture.profile(self._torch, self._run_batch, tensors)
+        return self._run_batch(tensors)
+
+    def _run_batch(self, tensors):
+        torch = self._torch
+        batch = torch.stack(tensors)
+        with torch.no_grad():
+            outputs = self.forward(batch)
+            probabilities = torch.nn.functional.softmax(outputs, dim=1)
+            top_probs, top_classes = torch.topk(probabilities, 5, dim=1)
+            if self._group_ids is not None:
+                group_scores = torch.zeros(len(tensors), self._group_count).index_add_(
+                    1, self._group_ids, probabilities[:, self._grouped_classes]
+                ).tolist()
+            else:
+                group_scores = [None] * len(tensors)
+        return list(zip(top_probs.tolist(), top_classes.tolist(), group_scores))
+
+    def capture_profile(self, capture, timeout, synthetic_batch=0):
+        """Profile the next forward passes in this process with capture (a profiler.TorchCapture).
+
+        With synthetic_batch, the passes are run here on that many blank images
+        instead of waiting for requests to fall back to the local model. Waits up to
+        timeout seconds for capture.batches batches and returns their results, which
+        may be fewer. Raises profiler.ProfilerBusy if a capture is already waiting.
+        """
+        from profiler import ProfilerBusy
+
+        if synthetic_batch:
+            self.ensure_loaded()
+        with self._profile_lock:
+            if self._profile_capture is not None:
+                raise ProfilerBusy("A torch profile is already being captured")
+            self._profile_capture = capture
+        try:
+            if synthetic_batch:
+                blank = self._torch.zeros(3, 224, 224)
+                for _ in range(capture.batches):
+                    self.run_batch([blank] * synthetic_batch)
+            return capture.wait(timeout)
+        finally:
+            self._profile_capture = None
+
+    def status(self):
+        if self.ready:
+            state = 'ready'
+        elif self.error:
+            state = 'failed'
+        else:
+            state = 'loading' if self.loading else 'not_loaded'
+        return {
+            'state': state,
+            'error': self.error,
+            'backend': self.backend,
+            'channels_last': self.channels_last,
+            'timings': self.timings
+        }
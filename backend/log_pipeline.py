@@ -0,0 +1,248 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import threading
+
+# Set per request by start_request; RequestIdFilter reads it in the thread that logs
+request_id = contextvars.ContextVar('request_id', default=None)
+_debug_sampled = contextvars.ContextVar('debug_sampled', default=False)
+_debug_sample_rate = 0.0
+_pipeline = None
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+# Client-supplied request IDs are kept if they look like one
+VALID_REQUEST_ID = re.compile(r'^[A-Za-z0-9._:-]{1,64}$')
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'
+
+
+def start_request(incoming_id=None):
+    """Set the request ID (the client's, if valid) and decide whether this request logs debug lines.
+
+    Returns (request ID, reset tokens) for end_request.
+    """
+    rid = incoming_id if incoming_id and VALID_REQUEST_ID.match(incoming_id) else os.urandom(8).hex()
+    sampled = _debug_sample_rate > 0 and random.random() < _debug_sample_rate
+    return rid, (request_id.set(rid), _debug_sampled.set(sampled))
+
+
+def end_request(tokens):
+    try:
+        request_id.reset(tokens[0])
+        _debug_sampled.reset(tokens[1])
+    except ValueError:
+        # Finished in another context (a streamed response): clear them for the next request
+        request_id.set(None)
+        _debug_sampled.set(False)
+
+
+def debug(logger, msg, *args):
+    """Log a verbose per-step line at DEBUG when the level allows it or the request is sampled.
+
+    Otherwise it costs a cached level check and one context variable read: msg is
+    %-formatted with args by the logging thread, and only when the line is kept.
+    Sampled requests log the line whatever the configured level, so their whole
+    path can be followed.
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(msg, *args, stacklevel=2)
+    elif _debug_sampled.get() and not logger.disabled:
+        logger.handle(logger.makeRecord(logger.name, logging.DEBUG, '(sampled)', 0, msg, args, None))
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps records with the current request ID, in the thread that logs them"""
+
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, request ID and any exception"""
+
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+            'thread': record.threadName,
+        }
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc_info'] = record.exc_text
+        if record.stack_info:
+            entry['stack_info'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+    def formatTime(self, record, datefmt=None):
+        return super().formatTime(record, '%Y-%m-%dT%H:%M:%S') + f'.{int(record.msecs):03d}'
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the log writer thread as they are, dropping them when its queue is full.
+
+    QueueHandler formats each record before queueing it so it can cross process
+    boundaries; the writer here is a thread in the same process, so formatting
+    (including exception tracebacks) is left to it. Message arguments are therefore
+    rendered when the record is written, not when it was logged.
+    """
+
+    def __init__(self, log_queue, max_size):
+        super().__init__(log_queue)
+        self.max_size = max_size
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        if self.queue.qsize() >= self.max_size:
+            self.dropped += 1
+            return
+        self.queue.put(record)
+
+
+class LogWriter:
+    """Background thread formatting queued records and writing them out in batches.
+
+    Everything queued since the last write is formatted and written with a single
+    write and flush, so a burst of records costs one system call rather than one each.
+    """
+
+    _stop = object()
+
+    def __init__(self, log_queue, handler, max_batch=512):
+        self.queue = log_queue
+        self.handler = handler
+        self.max_batch = max_batch
+        self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """Write out the queued records and stop the thread"""
+        if self._thread.is_alive():
+            self.queue.put(self._stop)
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            records = [self.queue.get()]
+            while len(records) < self.max_batch and not self.queue.empty():
+                records.append(self.queue.get())
+            stopping = records[-1] is self._stop
+            if stopping:
+                records.pop()
+            self._write(records)
+            if stopping:
+                return
+
+    def _write(self, records):
+        lines = []
+        for record in records:
+            try:
+                if record.levelno >= self.handler.level:
+                    lines.append(self.handler.format(record) + self.handler.terminator)
+            except Exception:
+                self.handler.handleError(record)
+        if lines:
+            try:
+                stream = self.handler.stream
+                stream.write(''.join(lines))
+                stream.flush()
+            except Exception:
+                self.handler.handleError(records[-1])
+
+
+class LogPipeline:
+    """The process's log handlers: a bounded queue drained by a LogWriter thread, or a plain stream"""
+
+    def __init__(self, level, fmt='json', asynchronous=True, queue_size=10000):
+        # Neither format shows the multiprocessing process name; skip looking it up for
+        # every record (one of the logging docs' "Optimization" settings)
+        logging.logMultiprocessing = False
+        self.formatter = JSONFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT)
+        self.stream_handler = logging.StreamHandler()
+        self.stream_handler.setFormatter(self.formatter)
+        self.queue_size = queue_size
+        self.queue_handler = None
+        self.writer = None
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.setLevel(level)
+        if asynchronous:
+            self._start_writer()
+            atexit.register(self.stop)
+            # A forked child (a preloaded gunicorn/uvicorn worker) inherits the queue but
+            # not the writer thread: give it a queue and writer of its own
+            os.register_at_fork(after_in_child=self._start_writer)
+        else:
+            self.direct()
+
+    def _start_writer(self):
+        root = logging.getLogger()
+        if self.queue_handler is not None:
+            root.removeHandler(self.queue_handler)
+        # SimpleQueue: a put is a single C call, with no lock for the writer to contend on
+        self.queue_handler = DroppingQueueHandler(queue.SimpleQueue(), self.queue_size)
+        self.queue_handler.addFilter(RequestIdFilter())
+        self.writer = LogWriter(self.queue_handler.queue, self.stream_handler)
+        self.writer.start()
+        root.addHandler(self.queue_handler)
+
+    def direct(self):
+        """Write records from the logging thread itself, stopping the writer thread if any"""
+        root = logging.getLogger()
+        if self.queue_handler is not None:
+            root.removeHandler(self.queue_handler)
+            self.writer.stop()
+        self.stream_handler.addFilter(RequestIdFilter())
+        root.addHandler(self.stream_handler)
+        self.queue_handler = None
+        self.writer = None
+
+    def stop(self):
+        """Write out the queued records and stop the writer thread"""
+        if self.writer is not None:
+            self.writer.stop()
+
+    @property
+    def dropped(self):
+        return self.queue_handler.dropped if self.queue_handler is not None else 0
+
+    def stats(self):
+        return {
+            'asynchronous': self.queue_handler is not None,
+            'queued': self.queue_handler.queue.qsize() if self.queue_handler is not None else 0,
+            'dropped': self.dropped,
+            'debug_sample_rate': _debug_sample_rate,
+        }
+
+
+def configure(level='INFO', fmt='json', asynchronous=True, queue_size=10000, debug_sample_rate=0.0):
+    """Install the logging pipeline for this process and return it"""
+    global _debug_sample_rate, _pipeline
+    _debug_sample_rate = min(1.0, max(0.0, float(debug_sample_rate)))
+    _pipeline = LogPipeline(level, fmt, asynchronous, queue_size)
+    return _pipeline
+
+
+def direct():
+    """Switch this process's pipeline, if configured, to writing records synchronously.
+
+    For forked processes that exit with os._exit, such as inference workers, where
+    atexit never runs and records still queued for a writer thread would be lost.
+    """
+    if _pipeline is not None:
+        _pipeline.direct()
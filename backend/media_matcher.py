@@ -0,0 +1,120 @@
+import re
+
+# Media types in priority order: on equal scores the earlier type wins
+# Keywords match whole words (plus a plural), so compounds and inflected forms that
+# labels use are listed alongside their stem
+MEDIA_KEYWORDS = {
+    'book': ['book', 'novel', 'magazine', 'comic', 'textbook', 'paperback', 'hardcover', 'literature', 'library', 'reading',
+             'bookcase', 'bookshelf', 'bookshop', 'bookstore', 'booklet', 'ebook', 'audiobook', 'storybook'],
+    'movie': ['movie', 'film', 'cinema', 'dvd', 'bluray', 'video', 'poster', 'screen', 'hollywood', 'cinematic',
+              'filmmaking', 'filmography', 'videotape', 'videocassette', 'screening', 'screenplay'],
+    'game': ['video game', 'videogame', 'gaming', 'console', 'controller', 'joystick', 'arcade', 'playstation', 'xbox',
+             'nintendo', 'gaming console'],
+    'music': ['cd', 'vinyl', 'album', 'record', 'cassette', 'audio', 'music', 'instrument', 'spotify', 'itunes',
+              'musical', 'musician', 'recording', 'recorder', 'instrumental', 'audiophile'],
+    'software': ['software', 'program', 'application', 'computer program', 'digital media', 'app store',
+                 'programming', 'programmer']
+}
+
+# Generic terms that still point at media when no specific type matched
+MEDIA_INDICATORS = ['media', 'entertainment', 'digital', 'content', 'multimedia']
+
+# Store keywords to search for each media type, most relevant first
+STORE_TYPES = {
+    'book': ['bookstore', 'library', 'book shop', 'barnes & noble', 'books'],
+    'movie': ['video store', 'movie rental', 'blockbuster', 'redbox', 'dvd store'],
+    'game': ['game store', 'gaming store', 'gamestop', 'electronic store', 'toy store'],
+    'music': ['music store', 'record store', 'cd store', 'instrument store'],
+    'software': ['electronics store', 'computer store', 'best buy', 'software store'],
+    'media': ['media store', 'electronics', 'department store']
+}
+
+# Labels that already name a kind of store are used as the search query directly
+STORE_LABELS = ['bookstore', 'library', 'video store', 'game store', 'music store']
+
+# ImageNet classes whose names don't contain a media keyword but clearly are media,
+# and ones that contain a keyword by accident (None)
+IMAGENET_OVERRIDES = {
+    'crossword puzzle': 'book',
+    'home theater': 'movie',
+    'projector': 'movie',
+    'television': 'movie',
+    'jigsaw puzzle': 'game',
+    'accordion': 'music', 'acoustic guitar': 'music', 'banjo': 'music', 'bassoon': 'music', 'cassette player': 'music',
+    'CD player': 'music', 'cello': 'music', 'chime': 'music', 'cornet': 'music', 'drum': 'music',
+    'electric guitar': 'music', 'flute': 'music', 'French horn': 'music', 'gong': 'music', 'grand piano': 'music',
+    'harmonica': 'music', 'harp': 'music', 'iPod': 'music', 'maraca': 'music', 'marimba': 'music',
+    'microphone': 'music', 'oboe': 'music', 'ocarina': 'music', 'organ': 'music', 'panpipe': 'music', 'sax': 'music',
+    'steel drum': 'music', 'tape player': 'music', 'trombone': 'music', 'upright': 'music', 'violin': 'music',
+    'web site': 'software',
+    'fire screen': None,
+    'window screen': None,
+    'four-poster': None,
+}
+
+
+def _alternation(words):
+    # Longest first so 'video game' wins over 'video' at the same position
+    return '|'.join(re.escape(word) for word in sorted(set(words), key=len, reverse=True))
+
+
+class MediaMatcher:
+    """Keyword matcher for media types, compiled once.
+
+    All keywords go into a single regex with word boundaries (plus an optional
+    plural 's'/'es'), so 'cd' no longer matches inside 'cdc' nor 'book' inside
+    'notebook'. Each matching label adds its confidence to the media type the
+    keyword belongs to, and the highest-scoring type wins.
+    """
+
+    def __init__(self, media_keywords=MEDIA_KEYWORDS, indicators=MEDIA_INDICATORS, store_labels=STORE_LABELS):
+        self.media_types = list(media_keywords)
+        self._keyword_types = {}
+        for media_type, keywords in media_keywords.items():
+            for keyword in keywords:
+                self._keyword_types.setdefault(keyword, media_type)
+
+        self._keywords = re.compile(r'\b(' + _alternation(self._keyword_types) + r')(?:e?s)?\b')
+        self._indicators = re.compile(r'\b(?:' + _alternation(indicators) + r')s?\b')
+        self._store_labels = re.compile(_alternation(store_labels))
+
+    def scores(self, labels, confidences=None):
+        """Sum of label confidences per media type (1.0 per label when no confidences)"""
+        scores = {}
+        for index, label in enumerate(labels):
+            weight = confidences[index] if confidences is not None and index < len(confidences) else 1.0
+            matched = {self._keyword_types[match.group(1)] for match in self._keywords.finditer(label.lower())}
+            for media_type in matched:
+                scores[media_type] = scores.get(media_type, 0.0) + weight
+        return scores
+
+    def classify(self, labels, confidences=None):
+        """Best media type for the labels, 'media' for generic media terms, or None"""
+        scores = self.scores(labels, confidences)
+        if scores:
+            return max(self.media_types, key=lambda media_type: (scores.get(media_type, -1.0), -self.media_types.index(media_type)))
+
+        if any(self._indicators.search(label.lower()) for label in labels):
+            return 'media'
+        return None
+
+    def store_label(self, labels):
+        """The first of the top 2 labels that already names a store type, lower-cased, or None"""
+        for label in labels[:2]:
+            label_lower = label.lower()
+            if self._store_labels.search(label_lower):
+                return label_lower
+        return None
+
+    def imagenet_table(self, class_names):
+        """Media type index (into media_types) for every ImageNet class, -1 for non-media"""
+        table = []
+        for name in class_names:
+            if name in IMAGENET_OVERRIDES:
+                media_type = IMAGENET_OVERRIDES[name]
+            else:
+                media_type = self.classify([name])
+                if media_type == 'media':
+                    media_type = None
+            table.append(self.media_types.index(media_type) if media_type else -1)
+        return table
@@ -0,0 +1,165 @@
+import bisect
+import math
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; covers a local decode (~1 ms) up to a slow upstream call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _number(value):
+    value = float(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=(), fn=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        self._values = {}  # label values -> value
+        self._lock = threading.Lock()
+
+    def _series(self):
+        if self.fn is not None:
+            return self.fn()
+        with self._lock:
+            return dict(self._values)
+
+    def render(self, lines):
+        lines.append(f'# HELP {self.name} {self.help}')
+        lines.append(f'# TYPE {self.name} {self.kind}')
+        for values, value in sorted(self._series().items()):
+            lines.append(f'{self.name}{_labels(self.labelnames, values)} {_number(value)}')
+
+
+class Counter(_Metric):
+    """Monotonic count per label set; with fn, read at scrape time from fn() -> {label values: value}"""
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+
+class Gauge(_Metric):
+    """Current value per label set; with fn, read at scrape time from fn() -> {label values: value}"""
+    kind = 'gauge'
+
+    def inc(self, *labels, amount=1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels, amount=1.0):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = float(value)
+
+
+class Histogram(_Metric):
+    """Bucketed observations per label set, with their sum and count"""
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        # Counts are kept per bucket and made cumulative when rendered
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self, lines):
+        lines.append(f'# HELP {self.name} {self.help}')
+        lines.append(f'# TYPE {self.name} histogram')
+        with self._lock:
+            series = sorted((values, list(counts), total) for values, (counts, total) in self._values.items())
+        for values, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = _labels(self.labelnames, values, ('le', _number(bound)))
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, values)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, values)} {cumulative}')
+
+
+class Registry:
+    """Metrics rendered together in the Prometheus text exposition format.
+
+    Recording is a dict update under a per-metric lock, cheap enough to leave on;
+    metrics built with fn read existing stats only when scraped.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._names = set()
+
+    def register(self, metric):
+        if metric.name in self._names:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._names.add(metric.name)
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=(), fn=None):
+        return self.register(Counter(name, help, labelnames, fn))
+
+    def gauge(self, name, help, labelnames=(), fn=None):
+        return self.register(Gauge(name, help, labelnames, fn))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            metric.render(lines)
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# Metrics recorded across modules; app.py registers the scrape-time gauges
+request_seconds = registry.histogram(
+    'snap2store_request_duration_seconds', 'Request latency by endpoint and status', ['endpoint', 'status'])
+requests_in_flight = registry.gauge(
+    'snap2store_requests_in_flight', 'Requests being served by endpoint', ['endpoint'])
+stage_seconds = registry.histogram(
+    'snap2store_stage_duration_seconds', 'Time spent in each processing stage', ['stage'])
+backend_seconds = registry.histogram(
+    'snap2store_backend_duration_seconds', 'Upstream call latency by backend and outcome', ['backend', 'outcome'])
+label_sources = registry.counter(
+    'snap2store_label_source_total', 'Analyzed images by where their labels came from', ['source'])
+store_sources = registry.counter(
+    'snap2store_store_source_total', 'Store searches by where their stores came from', ['source'])
+map_fallbacks = registry.counter(
+    'snap2store_map_fallbacks_total', 'Store searches that fell back from travel-time ranking or directions', ['kind'])
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+EARTH_RADIUS_KM = 6371.0088
+
+
+def geohash_encode(lat, lng, precision=6):
+    """Standard base32 geohash of a point"""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        interval, coordinate = (lng_range, lng) if even else (lat_range, lat)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def geohash_center(geohash):
+    """(lat, lng) of the center of a geohash cell"""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = GEOHASH_ALPHABET.index(char)
+        for bit in range(4, -1, -1):
+            interval = lng_range if even else lat_range
+            middle = (interval[0] + interval[1]) / 2
+            if value >> bit & 1:
+                interval[0] = middle
+            else:
+                interval[1] = middle
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lng_range[0] + lng_range[1]) / 2
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def normalize_query(query):
+    return ' '.join((query or '').lower().split())
+
+
+class PlacesCache:
+    """TTL + LRU cache of Places Nearby results per (geohash cell, query, place type).
+
+    Everyone searching from the same cell shares one upstream result, fetched for
+    the cell's center. Entries are fresh for ttl_seconds; for stale_seconds after
+    that they are still served while a background refresh replaces them
+    (stale-while-revalidate), so only a cold cell makes a caller wait on Google.
+    get() serves threaded callers and aget() the ASGI app.
+    """
+
+    def __init__(self, precision=6, max_entries=2048, ttl_seconds=900, stale_seconds=3600, refresh_workers=2):
+        self.precision = int(precision)
+        self.max_entries = max(0, int(max_entries))
+        self.ttl = float(ttl_seconds)
+        self.stale = float(stale_seconds)
+
+        self._entries = OrderedDict()  # key -> (places, fetched_at)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._refresher = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix='places-refresh')
+        self._tasks = set()
+        self._hits = 0
+        self._stale_hits = 0
+        self._misses = 0
+        self._upstream_calls = 0
+        self._refresh_failures = 0
+
+    def key(self, lat, lng, query, search_type):
+        return geohash_encode(lat, lng, self.precision), normalize_query(query), search_type
+
+    def _lookup(self, key):
+        """(places, status, start_refresh) for a cached key, or None on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key) if self.max_entries else None
+            if entry is not None:
+                age = now - entry[1]
+                if age <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return entry[0], 'hit', False
+                if age <= self.ttl + self.stale:
+                    self._entries.move_to_end(key)
+                    self._stale_hits += 1
+                    start_refresh = key not in self._refreshing
+                    self._refreshing.add(key)
+                    return entry[0], 'stale', start_refresh
+                del self._entries[key]
+            self._misses += 1
+            return None
+
+    def get(self, lat, lng, query, search_type, fetch):
+        """Return (places, status) where status is 'hit', 'stale' or 'miss'.
+
+        fetch(lat, lng, query, search_type) performs the upstream search and may raise;
+        on a miss the exception propagates to the caller.
+        """
+        key = self.key(lat, lng, query, search_type)
+        found = self._lookup(key)
+        if found is not None:
+            places, status, start_refresh = found
+            if start_refresh:
+                self._refresher.submit(self._refresh, key, fetch)
+            return places, status
+
+        return self._fetch(key, fetch), 'miss'
+
+    async def aget(self, lat, lng, query, search_type, afetch):
+        """get() for async callers: afetch is a coroutine function, refreshes run as tasks"""
+        key = self.key(lat, lng, query, search_type)
+        found = self._lookup(key)
+        if found is not None:
+            places, status, start_refresh = found
+            if start_refresh:
+                task = asyncio.ensure_future(self._arefresh(key, afetch))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            return places, status
+
+        cell_center = self._start_fetch(key)
+        places = await afetch(*cell_center, key[1], key[2])
+        self._store(key, places)
+        return places, 'miss'
+
+    def _start_fetch(self, key):
+        with self._lock:
+            self._upstream_calls += 1
+        return geohash_center(key[0])
+
+    def _store(self, key, places):
+        # Empty results aren't cached: they send the caller to the fallback stores anyway
+        if places and self.max_entries:
+            with self._lock:
+                self._entries[key] = (places, time.monotonic())
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+    def _fetch(self, key, fetch):
+        center_lat, center_lng = self._start_fetch(key)
+        places = fetch(center_lat, center_lng, key[1], key[2])
+        self._store(key, places)
+        return places
+
+    def extend(self, lat, lng, query, search_type, places):
+        """Append further result pages to a cached search, skipping place_ids already present"""
+        key = self.key(lat, lng, query, search_type)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            seen = {place.get('place_id') for place in entry[0]}
+            merged = entry[0] + [place for place in places if place.get('place_id') not in seen]
+            self._entries[key] = (merged, entry[1])
+
+    def _refresh(self, key, fetch):
+        try:
+            self._fetch(key, fetch)
+        except Exception as e:
+            with self._lock:
+                self._refresh_failures += 1
+            logger.warning(f"Background refresh of places {key} failed: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    async def _arefresh(self, key, afetch):
+        try:
+            cell_center = self._start_fetch(key)
+            self._store(key, await afetch(*cell_center, key[1], key[2]))
+        except Exception as e:
+            with self._lock:
+                self._refresh_failures += 1
+            logger.warning(f"Background refresh of places {key} failed: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._stale_hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'precision': self.precision,
+                'hits': self._hits,
+                'stale_hits': self._stale_hits,
+                'misses': self._misses,
+                'hit_ratio': (self._hits + self._stale_hits) / lookups if lookups else 0.0,
+                'upstream_calls': self._upstream_calls,
+                'upstream_calls_saved': lookups - self._misses,
+                'refresh_failures': self._refresh_failures,
+            }
@@ -0,0 +1,207 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Standard library modules whose frames are passed over to find what a thread is waiting in
+WAIT_MODULES = {'threading.py', 'queue.py', 'selectors.py', 'socket.py'}
+# Functions that park a thread until there is work: waiting in these is idle, not latency
+IDLE_CALLERS = {
+    ('thread.py', '_worker'),  # concurrent.futures pool thread waiting for a task
+    ('socketserver.py', 'serve_forever'),
+    ('base_events.py', '_run_once'),  # asyncio event loop with nothing ready
+    ('batching.py', '_collect'),  # MicroBatcher waiting for a first item
+}
+
+
+class ProfilerBusy(Exception):
+    """Another profile is already being captured"""
+
+
+def _frame_key(code):
+    return code.co_name, code.co_filename, code.co_firstlineno
+
+
+def _idle(frame):
+    """Whether the innermost frame, past any waiting primitives, is a thread parked for work"""
+    while frame is not None:
+        filename = os.path.basename(frame.f_code.co_filename)
+        if filename not in WAIT_MODULES:
+            return (filename, frame.f_code.co_name) in IDLE_CALLERS
+        frame = frame.f_back
+    return False
+
+
+class SampledProfile:
+    """Stack counts from a sampling run: {(thread name, (frame key, ...) root first): samples}"""
+
+    def __init__(self, stacks, samples, elapsed):
+        self.stacks = stacks
+        self.samples = samples
+        self.elapsed = elapsed
+
+    @property
+    def interval(self):
+        """Actual seconds between samples"""
+        return self.elapsed / self.samples if self.samples else 0.0
+
+    def collapsed(self):
+        """Collapsed stacks (thread;frame;...;leaf count per line), for flamegraph.pl, speedscope and others"""
+        lines = []
+        for (thread, stack), count in sorted(self.stacks.items(), key=lambda item: -item[1]):
+            frames = [f'{name} ({os.path.basename(filename)}:{line})' for name, filename, line in stack]
+            lines.append(';'.join([thread] + frames).replace(' ', '_') + f' {count}')
+        return '\n'.join(lines) + '\n'
+
+    def speedscope(self):
+        """The profile in speedscope's file format, one sampled profile per thread"""
+        frames = []
+        frame_index = {}
+        threads = {}
+        for (thread, stack), count in self.stacks.items():
+            indices = []
+            for key in stack:
+                if key not in frame_index:
+                    frame_index[key] = len(frames)
+                    frames.append({'name': key[0], 'file': key[1], 'line': key[2]})
+                indices.append(frame_index[key])
+            samples, weights = threads.setdefault(thread, ([], []))
+            samples.append(indices)
+            weights.append(count * self.interval)
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': thread,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(weights),
+                'samples': samples,
+                'weights': weights,
+            } for thread, (samples, weights) in sorted(threads.items())],
+            'name': f'{self.samples} samples over {self.elapsed:.2f} s',
+            'exporter': 'snap2store profiler',
+        }
+
+
+class SamplingProfiler:
+    """Wall-clock stack sampling of every Python thread in the process.
+
+    The calling thread wakes every interval, reads all other threads' current
+    frames and counts each distinct stack, so the cost is bounded by the sampling
+    rate and is zero outside a run. Time spent in C code (PIL decoding, a torch
+    forward pass, a socket read) is attributed to the Python frame that called it.
+    Threads parked waiting for work are left out unless include_idle is set.
+    One run at a time; runs are capped at max_seconds.
+    """
+
+    def __init__(self, max_seconds=30.0, min_interval_ms=1.0):
+        self.max_seconds = float(max_seconds)
+        self.min_interval = float(min_interval_ms) / 1000.0
+        self._lock = threading.Lock()
+
+    def run(self, seconds, interval_ms=5.0, include_idle=False):
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("A profile is already running")
+        try:
+            return self._sample(min(float(seconds), self.max_seconds),
+                                max(float(interval_ms) / 1000.0, self.min_interval), include_idle)
+        finally:
+            self._lock.release()
+
+    def _sample(self, seconds, interval, include_idle):
+        own = threading.get_ident()
+        names = {}
+        stacks = Counter()
+        samples = 0
+        started = time.perf_counter()
+        deadline = started + seconds
+        while True:
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if ident not in names:
+                    names.update((thread.ident, thread.name) for thread in threading.enumerate())
+                if not include_idle and _idle(frame):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_key(frame.f_code))
+                    frame = frame.f_back
+                stacks[(names.get(ident, f'thread-{ident}'), tuple(reversed(stack)))] += 1
+            samples += 1
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            time.sleep(min(interval, deadline - now))
+        return SampledProfile(stacks, samples, time.perf_counter() - started)
+
+
+class TorchCapture:
+    """torch.profiler capture of the next few local model forward passes.
+
+    LocalModel.run_batch checks for an active capture with a single attribute read,
+    so nothing is paid while no capture is waiting. Each profiled batch records its
+    operator summary, and its Chrome trace when trace is set.
+    """
+
+    def __init__(self, batches=1, record_shapes=False, trace=False, top_ops=25):
+        self.batches = max(1, int(batches))
+        self.record_shapes = record_shapes
+        self.trace = trace
+        self.top_ops = top_ops
+        self.results = []
+        self._claimed = 0
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def claim(self):
+        """Whether the calling batch should be profiled"""
+        with self._lock:
+            if self._claimed >= self.batches:
+                return False
+            self._claimed += 1
+            return True
+
+    def profile(self, torch, fn, tensors):
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        started = time.perf_counter()
+        with torch.profiler.profile(activities=activities, record_shapes=self.record_shapes) as prof:
+            output = fn(tensors)
+        wall_ms = (time.perf_counter() - started) * 1000.0
+        self._record(prof, len(tensors), wall_ms)
+        return output
+
+    def _record(self, prof, batch_size, wall_ms):
+        averages = sorted(prof.key_averages(group_by_input_shape=self.record_shapes),
+                          key=lambda event: event.self_cpu_time_total, reverse=True)
+        result = {
+            'batch_size': batch_size,
+            'wall_ms': wall_ms,
+            'ops': [{
+                'name': event.key,
+                'calls': event.count,
+                'self_cpu_ms': event.self_cpu_time_total / 1000.0,
+                'cpu_total_ms': event.cpu_time_total / 1000.0,
+                **({'input_shapes': str(event.input_shapes)} if self.record_shapes else {}),
+            } for event in averages[:self.top_ops]],
+        }
+        if self.trace:
+            import json
+            import tempfile
+
+            with tempfile.NamedTemporaryFile(suffix='.json') as f:
+                prof.export_chrome_trace(f.name)
+                with open(f.name) as trace:
+                    result['trace'] = json.load(trace)
+        with self._lock:
+            self.results.append(result)
+            if len(self.results) >= self.batches:
+                self._done.set()
+
+    def wait(self, timeout):
+        self._done.wait(timeout)
+        with self._lock:
+            return list(self.results)
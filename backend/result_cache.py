@@ -0,0 +1,195 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from PIL import Image
+
+# Rough per-entry bookkeeping overhead on top of the serialized result
+ENTRY_OVERHEAD_BYTES = 256
+HASH_BITS = 64  # dhash's default 8 x 8
+# Hashes with fewer set (or clear) bits than this come from flat or low-texture images,
+# which all hash alike; those are only matched by their exact bytes
+MIN_HASH_BITS = 8
+
+
+def dhash(image, hash_size=8):
+    """Difference hash of a PIL image as a hash_size * hash_size bit integer.
+
+    Each bit says whether a pixel is brighter than its right-hand neighbour in a
+    small grayscale thumbnail, so re-encodes, small crops and lighting changes of
+    the same photo land within a few bits of each other.
+    """
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR, reducing_gap=2.0)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(a, b):
+    return (a ^ b).bit_count()
+
+
+def distinctive(phash):
+    """Whether a hash carries enough detail to match near-duplicates by.
+
+    A solid colour or a smooth gradient hashes to (nearly) all zeros or all ones
+    whatever its colour or size, so unrelated images would match each other.
+    """
+    return MIN_HASH_BITS <= phash.bit_count() <= HASH_BITS - MIN_HASH_BITS
+
+
+def hash_bands(max_distance):
+    """(shift, mask) of max_distance + 1 bit bands splitting a hash.
+
+    Two hashes within max_distance bits of each other agree exactly on at least
+    one band, so only entries sharing a band value need a distance check.
+    """
+    count = max_distance + 1
+    bands = []
+    start = 0
+    for band in range(count):
+        width = HASH_BITS // count + (band < HASH_BITS % count)
+        bands.append((start, (1 << width) - 1))
+        start += width
+    return bands
+
+
+class AnalysisCache:
+    """LRU cache of /analyze results keyed by SHA-256 of the upload plus its perceptual hash.
+
+    Exact byte matches are found by digest. Near-duplicates (the same cover snapped
+    again) are the closest perceptual hash within max_distance bits, looked up
+    through an index of hash bands so a lookup checks only entries sharing a band
+    rather than every entry. Images whose hash isn't distinctive are only matched
+    exactly. Entries expire after ttl_seconds and the cache is kept under both
+    max_entries and max_bytes.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=8 * 1024 * 1024, ttl_seconds=3600, max_distance=4):
+        self.max_entries = max(0, int(max_entries))
+        self.max_bytes = max(0, int(max_bytes))
+        self.ttl = float(ttl_seconds)
+        self.max_distance = int(max_distance)
+        # Bands only narrow the search while each is at least a bit wide
+        self._bands = hash_bands(self.max_distance) if 0 <= self.max_distance < HASH_BITS else []
+
+        self._entries = OrderedDict()  # digest -> (phash, result, size, expires_at)
+        self._band_index = [{} for _ in self._bands]  # per band: band value -> {digest, ...}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._exact_hits = 0
+        self._near_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def get(self, digest):
+        """Return the cached result for these exact bytes, or None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            if entry[3] < time.monotonic():
+                self._remove(digest)
+                self._expirations += 1
+                return None
+            self._entries.move_to_end(digest)
+            self._exact_hits += 1
+            return entry[1]
+
+    def find_similar(self, phash):
+        """Return the cached result with the closest perceptual hash within max_distance, or None."""
+        if not self.enabled or self.max_distance < 0 or not distinctive(phash):
+            self._count_miss()
+            return None
+        now = time.monotonic()
+        with self._lock:
+            if self._bands:
+                candidates = set()
+                for (shift, mask), index in zip(self._bands, self._band_index):
+                    candidates.update(index.get((phash >> shift) & mask, ()))
+            else:
+                candidates = [digest for digest, entry in self._entries.items() if entry[0] is not None]
+            best_digest, best_distance = None, self.max_distance + 1
+            for digest in candidates:
+                entry_phash, _, _, expires_at = self._entries[digest]
+                if expires_at < now:
+                    self._remove(digest)
+                    self._expirations += 1
+                    continue
+                distance = hamming_distance(phash, entry_phash)
+                if distance < best_distance:
+                    best_digest, best_distance = digest, distance
+
+            if best_digest is None or best_digest not in self._entries:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(best_digest)
+            self._near_hits += 1
+            return self._entries[best_digest][1]
+
+    def put(self, digest, phash, result):
+        if not self.enabled:
+            return
+        size = len(json.dumps(result)) + len(digest) + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        if phash is not None and not distinctive(phash):
+            phash = None
+        with self._lock:
+            if digest in self._entries:
+                self._remove(digest)
+            self._entries[digest] = (phash, result, size, time.monotonic() + self.ttl)
+            self._bytes += size
+            if phash is not None:
+                for (shift, mask), index in zip(self._bands, self._band_index):
+                    index.setdefault((phash >> shift) & mask, set()).add(digest)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._evictions += 1
+
+    def _remove(self, digest):
+        phash, _, size, _ = self._entries.pop(digest)
+        self._bytes -= size
+        if phash is not None:
+            for (shift, mask), index in zip(self._bands, self._band_index):
+                key = (phash >> shift) & mask
+                digests = index[key]
+                digests.discard(digest)
+                if not digests:
+                    del index[key]
+
+    def _count_miss(self):
+        with self._lock:
+            self._misses += 1
+
+    def stats(self):
+        with self._lock:
+            hits = self._exact_hits + self._near_hits
+            lookups = hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'max_distance': self.max_distance,
+                'exact_hits': self._exact_hits,
+                'near_hits': self._near_hits,
+                'misses': self._misses,
+                'hit_ratio': hits / lookups if lookups else 0.0,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+            }
@@ -0,0 +1,252 @@
+import threading
+import time
+from collections import OrderedDict
+
+from circuit_breaker import CircuitOpenError
+from places_cache import geohash_encode, haversine_km
+
+# Distance Matrix accepts at most 25 destinations per origin
+MAX_MATRIX_DESTINATIONS = 25
+
+
+class _TTLCache:
+    """Small thread-safe LRU with a per-entry TTL"""
+
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max(0, int(max_entries))
+        self.ttl = float(ttl_seconds)
+        self._entries = OrderedDict()  # key -> (value, stored_at)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[1] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RoutePlanner:
+    """Travel-time ranking and directions for candidate stores, cached per origin area.
+
+    Origins are quantized to a geohash cell (about 150 m at precision 7), so users
+    starting from the same area share cached legs and routes. Candidates are ranked
+    by real travel time with one Distance Matrix call covering every destination
+    whose leg isn't cached yet; directions are only fetched for the winner, and only
+    if no one in the same cell asked for that store recently.
+    """
+
+    def __init__(self, client, matrix_breaker, directions_breaker, origin_precision=7, mode='driving',
+                 max_entries=4096, ttl_seconds=600):
+        self.client = client
+        self.matrix_breaker = matrix_breaker
+        self.directions_breaker = directions_breaker
+        self.origin_precision = int(origin_precision)
+        self.mode = mode
+
+        self._legs = _TTLCache(max_entries, ttl_seconds)
+        self._routes = _TTLCache(max_entries, ttl_seconds)
+        self._lock = threading.Lock()
+        self._leg_hits = 0
+        self._leg_misses = 0
+        self._route_hits = 0
+        self._route_misses = 0
+        self._matrix_calls = 0
+        self._directions_calls = 0
+
+    def _key(self, origin, store):
+        return geohash_encode(origin[0], origin[1], self.origin_precision), store['place_id'], self.mode
+
+    def _call(self, breaker, method, **kwargs):
+        permit = breaker.allow()
+        if permit is None:
+            raise CircuitOpenError(breaker.name)
+        call_started = time.perf_counter()
+        try:
+            result = method(**kwargs)
+        except Exception as e:
+            breaker.record_failure(permit, (time.perf_counter() - call_started) * 1000.0, e)
+            raise
+        except BaseException:
+            breaker.release(permit)
+            raise
+        breaker.record_success(permit, (time.perf_counter() - call_started) * 1000.0)
+        return result
+
+    async def _acall(self, breaker, method, **kwargs):
+        permit = breaker.allow()
+        if permit is None:
+            raise CircuitOpenError(breaker.name)
+        call_started = time.perf_counter()
+        try:
+            result = await method(**kwargs)
+        except Exception as e:
+            breaker.record_failure(permit, (time.perf_counter() - call_started) * 1000.0, e)
+            raise
+        except BaseException:
+            breaker.release(permit)
+            raise
+        breaker.record_success(permit, (time.perf_counter() - call_started) * 1000.0)
+        return result
+
+    def rank(self, origin, stores):
+        """Stores ordered by travel time from origin, with travel_seconds/travel_meters where known.
+
+        Stores without a travel time (no place_id, no route, or Distance Matrix unavailable)
+        come after the others, ordered by straight-line distance. Upstream errors propagate
+        as RouteRankingError after the cached legs have been applied, so callers can fall
+        back to that order.
+        """
+        legs, missing = self._cached_legs(origin, stores)
+        error = None
+        if missing:
+            try:
+                result = self._call(self.matrix_breaker, self.client.distance_matrix, **self._matrix_request(origin, missing))
+                legs.update(self._store_legs(origin, missing, result))
+            except Exception as e:
+                error = e
+        return self._ranked(origin, stores, legs, error)
+
+    async def arank(self, client, origin, stores):
+        """rank() for async callers, with an async Maps client"""
+        legs, missing = self._cached_legs(origin, stores)
+        error = None
+        if missing:
+            try:
+                result = await self._acall(self.matrix_breaker, client.distance_matrix, **self._matrix_request(origin, missing))
+                legs.update(self._store_legs(origin, missing, result))
+            except Exception as e:
+                error = e
+        return self._ranked(origin, stores, legs, error)
+
+    def _cached_legs(self, origin, stores):
+        """({place_id: leg} for cached legs, stores still missing a leg)"""
+        legs = {}
+        missing = []
+        for store in stores:
+            if not store.get('place_id'):
+                continue
+            leg = self._legs.get(self._key(origin, store))
+            if leg is None:
+                missing.append(store)
+            else:
+                legs[store['place_id']] = leg
+        with self._lock:
+            self._leg_hits += len(legs)
+            self._leg_misses += len(missing)
+        return legs, missing[:MAX_MATRIX_DESTINATIONS]
+
+    def _matrix_request(self, origin, stores):
+        with self._lock:
+            self._matrix_calls += 1
+        return {
+            'origins': [origin],
+            'destinations': [(store['lat'], store['lng']) for store in stores],
+            'mode': self.mode,
+        }
+
+    def _store_legs(self, origin, stores, result):
+        legs = {}
+        elements = result['rows'][0]['elements'] if result.get('rows') else []
+        for store, element in zip(stores, elements):
+            if element.get('status') != 'OK':
+                continue
+            leg = {'seconds': element['duration']['value'], 'meters': element['distance']['value']}
+            legs[store['place_id']] = leg
+            self._legs.put(self._key(origin, store), leg)
+        return legs
+
+    def _ranked(self, origin, stores, legs, error):
+        ranked = []
+        for store in stores:
+            leg = legs.get(store.get('place_id'))
+            ranked.append(dict(store, travel_seconds=leg['seconds'], travel_meters=leg['meters']) if leg else dict(store))
+        ranked.sort(key=lambda s: (s.get('travel_seconds') is None, s.get('travel_seconds') or 0,
+                                   haversine_km(origin[0], origin[1], s['lat'], s['lng'])))
+        if error is not None:
+            raise RouteRankingError(ranked, error)
+        return ranked
+
+    def directions(self, origin, store):
+        """route_info dict for origin -> store ({} if no route), cached per origin cell"""
+        key, route_info = self._cached_route(origin, store)
+        if route_info is not None:
+            return route_info
+        directions_result = self._call(self.directions_breaker, self.client.directions,
+                                       **self._directions_request(origin, store))
+        return self._store_route(key, directions_result)
+
+    async def adirections(self, client, origin, store):
+        """directions() for async callers, with an async Maps client"""
+        key, route_info = self._cached_route(origin, store)
+        if route_info is not None:
+            return route_info
+        directions_result = await self._acall(self.directions_breaker, client.directions,
+                                              **self._directions_request(origin, store))
+        return self._store_route(key, directions_result)
+
+    def _cached_route(self, origin, store):
+        key = self._key(origin, store) if store.get('place_id') else None
+        route_info = self._routes.get(key) if key else None
+        with self._lock:
+            if route_info is None:
+                self._route_misses += 1
+            else:
+                self._route_hits += 1
+        return key, route_info
+
+    def _directions_request(self, origin, store):
+        with self._lock:
+            self._directions_calls += 1
+        return {'origin': origin, 'destination': (store['lat'], store['lng']), 'mode': self.mode}
+
+    def _store_route(self, key, directions_result):
+        if not directions_result:
+            return {}
+        route = directions_result[0]['legs'][0]
+        route_info = {
+            "distance": route['distance']['text'],
+            "duration": route['duration']['text'],
+            "steps": [step['html_instructions'] for step in route['steps'][:3]]  # First 3 steps
+        }
+        if key:
+            self._routes.put(key, route_info)
+        return route_info
+
+    def stats(self):
+        with self._lock:
+            leg_lookups = self._leg_hits + self._leg_misses
+            route_lookups = self._route_hits + self._route_misses
+            return {
+                'cached_legs': len(self._legs),
+                'cached_routes': len(self._routes),
+                'leg_hit_ratio': self._leg_hits / leg_lookups if leg_lookups else 0.0,
+                'route_hit_ratio': self._route_hits / route_lookups if route_lookups else 0.0,
+                'distance_matrix_calls': self._matrix_calls,
+                'directions_calls': self._directions_calls,
+            }
+
+
+class RouteRankingError(Exception):
+    """Distance Matrix failed; ranked holds the stores ordered with whatever legs were cached"""
+
+    def __init__(self, ranked, error):
+        super().__init__(str(error))
+        self.ranked = ranked
+        self.error = error
@@ -0,0 +1,212 @@
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+from limits.storage import Storage
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'S2SLIM01'
+HEADER = struct.Struct('<8sQQ')  # magic, buckets, slots per bucket
+HEADER_FIELDS = 8  # int64s reserved for the header
+SLOT_FIELDS = 4  # int64s per slot: key hash (0 when free), window end in microseconds, count, unused
+# Keys whose hash, bucket and last slot are remembered; limits build the same few keys per client
+LOCATED_CACHE_SIZE = 65536
+# At most one warning per this many seconds about live counters being reused
+EVICTION_WARNING_SECONDS = 60.0
+DEFAULT_PATH = os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'snap2store-limits')
+
+
+def key_hash(key):
+    """Nonzero signed 64-bit hash of a rate limit key, the same in every process"""
+    value = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little', signed=True)
+    return value or 1
+
+
+class SharedMemoryStorage(Storage):
+    """Fixed-window rate limit counters shared by every process on the host.
+
+    Registered with limits as shm://, so Flask-Limiter takes
+    storage_uri='shm:///dev/shm/snap2store-limits?buckets=8192&slots=8'. The
+    counters live in a memory-mapped file: a hash table of buckets, each a few
+    slots of (key hash, window end, count) int64s. Every update happens under an
+    flock on the file, which excludes the other processes, plus a thread lock,
+    because an flock doesn't exclude threads sharing the file descriptor. The
+    critical section is a few array reads and writes, so nothing waits long.
+    When every slot of a bucket holds a live window, the one ending soonest is
+    reused and its counter starts over, which lets that client through early; this
+    is logged and counted in stats() as evictions, and means the table is too small
+    for the live counters (roughly clients x limits per client). Expired windows are
+    reused in place, so unlike memory:// there is no expiry thread sweeping the keys.
+
+    Only the counters needed by the fixed window strategy are implemented; moving
+    and sliding windows still need a storage that supports them.
+    """
+
+    STORAGE_SCHEME = ['shm']
+
+    def __init__(self, uri=None, wrap_exceptions=False, **options):
+        parsed = urlparse(uri or 'shm://')
+        query = {name: values[-1] for name, values in parse_qs(parsed.query).items()}
+        self.path = parsed.path or DEFAULT_PATH
+        self.buckets = int(options.get('buckets', query.get('buckets', 8192)))
+        self.slots = int(options.get('slots', query.get('slots', 8)))
+        self._bucket_fields = self.slots * SLOT_FIELDS
+        self._size = (HEADER_FIELDS + self.buckets * self._bucket_fields) * 8
+        self._lock = threading.Lock()
+        self._located = {}
+        self._evictions = 0
+        self._warned_at = None
+        self._open()
+        os.register_at_fork(after_in_child=self._after_fork)
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    def _open(self):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < self._size:
+                os.ftruncate(self._fd, self._size)
+            self._mmap = mmap.mmap(self._fd, self._size)
+            magic, buckets, slots = HEADER.unpack_from(self._mmap)
+            if (magic, buckets, slots) != (MAGIC, self.buckets, self.slots):
+                if magic.strip(b'\0'):
+                    logger.warning(f"Rate limit counters in {self.path} have another layout; starting them over")
+                self._mmap[:] = bytes(self._size)
+                HEADER.pack_into(self._mmap, 0, MAGIC, self.buckets, self.slots)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._view = memoryview(self._mmap).cast('q')
+        logger.info(f"Rate limit counters shared through {self.path} ({self.buckets} x {self.slots} slots)")
+
+    def _after_fork(self):
+        # The child keeps the shared mapping, but an flock belongs to the open file, which
+        # the fork shared with the parent: open the file again so the lock tells them apart
+        inherited = self._fd
+        self._fd = os.open(self.path, os.O_RDWR)
+        os.close(inherited)
+        self._lock = threading.Lock()
+
+    @property
+    def base_exceptions(self):
+        return OSError, ValueError
+
+    def _locate(self, key):
+        """[key hash, field offset of its bucket, field offset of the slot it was last found in]"""
+        located = self._located.get(key)
+        if located is None:
+            if len(self._located) >= LOCATED_CACHE_SIZE:
+                self._located.clear()
+            h = key_hash(key)
+            located = self._located[key] = [h, HEADER_FIELDS + h % self.buckets * self._bucket_fields, None]
+        return located
+
+    def _slot(self, located, now, create):
+        """Field offset of the key's live slot; with create, claim one if it has none"""
+        view = self._view
+        h, base, offset = located
+        if offset is None or view[offset] != h:
+            end = base + self._bucket_fields
+            hashes = view[base:end:SLOT_FIELDS].tolist()
+            if h in hashes:
+                offset = located[2] = base + hashes.index(h) * SLOT_FIELDS
+            elif not create:
+                return None
+            else:
+                ends = view[base + 1:end:SLOT_FIELDS].tolist()
+                index = min(range(self.slots), key=ends.__getitem__)
+                if hashes[index] and ends[index] > now:
+                    self._evicted(now)
+                offset = located[2] = base + index * SLOT_FIELDS
+                view[offset] = h
+                view[offset + 1] = view[offset + 2] = 0
+                return offset
+        if view[offset + 1] > now:
+            return offset
+        if not create:
+            return None
+        view[offset + 1] = view[offset + 2] = 0
+        return offset
+
+    def _evicted(self, now):
+        self._evictions += 1
+        if self._warned_at is None or now - self._warned_at >= EVICTION_WARNING_SECONDS * 1e6:
+            self._warned_at = now
+            logger.warning(f"Rate limit counters in {self.path} are full: reset a live counter early "
+                           f"({self._evictions} so far); raise buckets or slots in RATE_LIMIT_STORAGE_URI")
+
+    def incr(self, key, expiry, amount=1, elastic_expiry=False):
+        located = self._locate(key)
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                now = time.time_ns() // 1000
+                offset = self._slot(located, now, create=True)
+                view = self._view
+                if view[offset + 1] == 0 or elastic_expiry:
+                    view[offset + 1] = now + int(expiry * 1e6)
+                count = view[offset + 2] = view[offset + 2] + amount
+                return count
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _read(self, key, field, default):
+        located = self._locate(key)
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                offset = self._slot(located, time.time_ns() // 1000, create=False)
+                return self._view[offset + field] if offset is not None else default
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def get(self, key):
+        return self._read(key, 2, 0)
+
+    def get_expiry(self, key):
+        end = self._read(key, 1, None)
+        return end / 1e6 if end is not None else time.time()
+
+    def clear(self, key):
+        located = self._locate(key)
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                offset = self._slot(located, time.time_ns() // 1000, create=False)
+                if offset is not None:
+                    self._view[offset:offset + SLOT_FIELDS] = memoryview(bytes(SLOT_FIELDS * 8)).cast('q')
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def check(self):
+        return not self._mmap.closed
+
+    def _live_counters(self):
+        now = time.time_ns() // 1000
+        return sum(1 for end in self._view[HEADER_FIELDS + 1::SLOT_FIELDS].tolist() if end > now)
+
+    def reset(self):
+        """Clear every counter; returns how many were live"""
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                live = self._live_counters()
+                self._mmap[HEADER_FIELDS * 8:] = bytes(self._size - HEADER_FIELDS * 8)
+                return live
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'slots': self.buckets * self.slots,
+            'live_counters': self._live_counters(),
+            'evictions': self._evictions,
+        }
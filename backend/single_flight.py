@@ -0,0 +1,92 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """Coalesce concurrent identical calls into one.
+
+    The first caller for a key runs the work; callers arriving with the same key
+    while it is in flight wait for that result (or exception) instead of repeating
+    it. Nothing is kept once the call finishes, so this only removes duplicate work
+    that overlaps in time; caching finished results is left to the caches.
+    do() serves threaded callers and ado() the ASGI app, which keep separate sets
+    of in-flight calls.
+    """
+
+    def __init__(self, name, enabled=True):
+        self.name = name
+        self.enabled = enabled
+        self._in_flight = {}  # key -> Future
+        self._tasks = {}  # key -> asyncio.Task
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._coalesced = 0
+        self._max_waiters = 0
+        self._waiters = {}
+
+    def do(self, key, fn, *args):
+        """fn(*args), shared with concurrent callers of the same key"""
+        if not self.enabled:
+            return fn(*args)
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is None:
+                future = self._in_flight[key] = Future()
+                leader = True
+            else:
+                leader = False
+            self._count(key, leader)
+        if not leader:
+            return future.result()
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._finish(key, self._in_flight)
+
+    async def ado(self, key, coro_fn, *args):
+        """await coro_fn(*args), shared with concurrent callers of the same key.
+
+        The work runs as its own task, so a caller that goes away (e.g. a client
+        disconnect) doesn't cancel it for the others.
+        """
+        if not self.enabled:
+            return await coro_fn(*args)
+        with self._lock:
+            task = self._tasks.get(key)
+            leader = task is None
+            if leader:
+                task = self._tasks[key] = asyncio.ensure_future(coro_fn(*args))
+                task.add_done_callback(lambda _: self._finish(key, self._tasks))
+            self._count(key, leader)
+        return await asyncio.shield(task)
+
+    def _count(self, key, leader):
+        # Called with the lock held
+        self._calls += 1
+        if not leader:
+            self._coalesced += 1
+            self._waiters[key] = self._waiters.get(key, 0) + 1
+            self._max_waiters = max(self._max_waiters, self._waiters[key])
+
+    def _finish(self, key, in_flight):
+        with self._lock:
+            in_flight.pop(key, None)
+            self._waiters.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'in_flight': len(self._in_flight) + len(self._tasks),
+                'calls': self._calls,
+                'coalesced': self._coalesced,
+                'coalesced_ratio': self._coalesced / self._calls if self._calls else 0.0,
+                'max_waiters': self._max_waiters,
+            }
@@ -0,0 +1,265 @@
+import math
+import threading
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180.0
+HALF_CIRCUMFERENCE_KM = math.pi * EARTH_RADIUS_KM
+
+
+def haversine_km(lat, lng, lats, lngs):
+    """Haversine distance from one point to arrays of points, all in radians"""
+    a = np.sin((lats - lat) / 2) ** 2 + math.cos(lat) * np.cos(lats) * np.sin((lngs - lng) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class _Snapshot:
+    """Immutable packed arrays plus a grid index, swapped in whole on every rebuild.
+
+    Stores are sorted by grid cell key (row * cols + col), so each row of cells in
+    a query window is one contiguous slice found with searchsorted.
+    """
+
+    def __init__(self, records, memberships, cell_degrees):
+        self.cell_degrees = cell_degrees
+        self.cols = int(math.ceil(360.0 / cell_degrees))
+        lats = np.fromiter((r['lat'] for r in records), dtype=np.float64, count=len(records))
+        lngs = np.fromiter((r['lng'] for r in records), dtype=np.float64, count=len(records))
+        keys = self._rows(lats) * self.cols + self._cols(lngs)
+        order = np.argsort(keys, kind='stable')
+
+        self.records = [records[i] for i in order]
+        self.positions = {record['place_id']: i for i, record in enumerate(self.records)}
+        self.keys = keys[order]
+        self.lat_rad = np.radians(lats[order])
+        self.lng_rad = np.radians(lngs[order])
+        self.categories = {name: member[order] for name, member in memberships.items()}
+
+    def _rows(self, lats):
+        return np.floor((np.asarray(lats) + 90.0) / self.cell_degrees).astype(np.int64)
+
+    def _cols(self, lngs):
+        return np.floor((np.asarray(lngs) + 180.0) / self.cell_degrees).astype(np.int64) % self.cols
+
+    def window(self, lat, lng, radius_km):
+        """Indices of stores in the grid cells overlapping a radius_km box around the point"""
+        lat_delta = radius_km / KM_PER_DEGREE
+        cos_lat = math.cos(math.radians(min(89.9, abs(lat) + lat_delta)))
+        lng_delta = radius_km / (KM_PER_DEGREE * cos_lat) if lat + lat_delta < 90 and lat - lat_delta > -90 else 180.0
+
+        rows = np.arange(self._rows(max(-90.0, lat - lat_delta)), self._rows(min(89.999999, lat + lat_delta)) + 1)
+        if lng_delta >= 180.0:
+            col_ranges = [(0, self.cols - 1)]
+        else:
+            first, last = int(self._cols(lng - lng_delta)), int(self._cols(lng + lng_delta))
+            # A window crossing the antimeridian wraps around to column 0
+            col_ranges = [(first, last)] if first <= last else [(first, self.cols - 1), (0, last)]
+
+        starts, ends = [], []
+        for first, last in col_ranges:
+            starts.append(np.searchsorted(self.keys, rows * self.cols + first, side='left'))
+            ends.append(np.searchsorted(self.keys, rows * self.cols + last, side='right'))
+        starts, ends = np.concatenate(starts), np.concatenate(ends)
+
+        # Expand the [start, end) slices into one index array without a Python loop
+        lengths = ends - starts
+        total = int(lengths.sum())
+        if not total:
+            return np.empty(0, dtype=np.int64)
+        offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        return offsets + np.arange(total)
+
+
+class StoreCatalog:
+    """In-memory catalog of stores with k-nearest and radius queries by haversine distance.
+
+    Latitude and longitude are packed into NumPy arrays and bucketed by a uniform
+    lat/lng grid, so a query only computes distances for stores in the cells around
+    the point. Each store can belong to several categories (the Places types of the
+    searches that returned it), kept as boolean masks over the same arrays.
+
+    Readers see an immutable (main snapshot, hidden mask, delta snapshot) view and
+    never take a lock. A write only rebuilds the small delta snapshot of stores
+    changed since the main one was built, and hides their older copies in it; once
+    merge_threshold stores have changed, a background thread rebuilds the main
+    snapshot from every store and swaps it in, so requests never pay a full re-sort.
+    """
+
+    def __init__(self, cell_degrees=0.05, max_stores=100000, merge_threshold=2048):
+        self.cell_degrees = float(cell_degrees)
+        self.max_stores = int(max_stores)
+        self.merge_threshold = max(1, int(merge_threshold))
+
+        self._records = {}  # place_id -> record, in insertion order
+        self._categories = {}  # category -> set of place_ids
+        self._changed = set()  # place_ids changed or removed since the main snapshot was copied
+        self._merging = set()  # changed place_ids a merge in progress is folding into the main snapshot
+        self._write_lock = threading.Lock()
+        self._merge_lock = threading.Lock()
+        self._merge_wanted = threading.Event()
+        self._merger = None
+        self._merges = 0
+        empty = _Snapshot([], {}, self.cell_degrees)
+        self._view = (empty, np.zeros(0, dtype=bool), empty)
+
+    def __len__(self):
+        return len(self._records)
+
+    def upsert(self, stores, category=None):
+        """Add or update stores (dicts with place_id, lat, lng); returns how many changed"""
+        with self._write_lock:
+            changed = 0
+            members = self._categories.setdefault(category, set()) if category is not None else None
+            for store in stores:
+                place_id = store.get('place_id')
+                if not place_id:
+                    continue
+                if self._records.get(place_id) != store:
+                    self._records.pop(place_id, None)
+                    self._records[place_id] = dict(store)
+                    self._changed.add(place_id)
+                    changed += 1
+                if members is not None and place_id not in members:
+                    members.add(place_id)
+                    self._changed.add(place_id)
+                    changed += 1
+            if members is not None and not members:
+                del self._categories[category]
+            if changed:
+                self._evict()
+                self._publish()
+                if len(self._changed) >= self.merge_threshold:
+                    self._request_merge()
+            return changed
+
+    def _evict(self):
+        while len(self._records) > self.max_stores:
+            place_id = next(iter(self._records))
+            del self._records[place_id]
+            self._changed.add(place_id)
+            for name, members in list(self._categories.items()):
+                members.discard(place_id)
+                if not members:
+                    del self._categories[name]
+
+    def _snapshot(self, records, categories):
+        memberships = {
+            name: np.fromiter((r['place_id'] in members for r in records), dtype=bool, count=len(records))
+            for name, members in categories.items()
+        }
+        return _Snapshot(records, memberships, self.cell_degrees)
+
+    def _publish(self):
+        """Swap in a view with a new delta snapshot of the changed stores; called with the write lock held"""
+        main = self._view[0]
+        touched = self._changed | self._merging
+        hidden = np.zeros(len(main.records), dtype=bool)
+        hidden[[main.positions[p] for p in touched if p in main.positions]] = True
+        delta = [self._records[p] for p in touched if p in self._records]
+        self._view = (main, hidden, self._snapshot(delta, self._categories))
+
+    def _request_merge(self):
+        if self._merger is None:
+            self._merger = threading.Thread(target=self._merge_loop, name='store-catalog-merge', daemon=True)
+            self._merger.start()
+        self._merge_wanted.set()
+
+    def _merge_loop(self):
+        while True:
+            self._merge_wanted.wait()
+            self._merge_wanted.clear()
+            self.merge()
+
+    def merge(self):
+        """Rebuild the main snapshot from every store, emptying the delta"""
+        with self._merge_lock:
+            with self._write_lock:
+                self._merging = self._changed
+                self._changed = set()
+                records = list(self._records.values())
+                categories = {name: set(members) for name, members in self._categories.items()}
+            main = self._snapshot(records, categories)
+            with self._write_lock:
+                self._merging = set()
+                self._view = (main,) + self._view[1:]
+                self._publish()
+                self._merges += 1
+
+    def _query_snapshot(self, snapshot, lat, lng, radius_km, category, place_ids):
+        indices = snapshot.window(lat, lng, radius_km)
+        if place_ids is not None:
+            records = snapshot.records
+            indices = indices[np.fromiter((records[i]['place_id'] in place_ids for i in indices),
+                                          dtype=bool, count=len(indices))]
+        if category is not None:
+            names = [category] if isinstance(category, str) else category
+            masks = [snapshot.categories[name] for name in names if name in snapshot.categories]
+            if not masks:
+                return np.empty(0, dtype=np.int64), np.empty(0)
+            member = masks[0] if len(masks) == 1 else np.logical_or.reduce(masks)
+            indices = indices[member[indices]]
+        distances = haversine_km(math.radians(lat), math.radians(lng), snapshot.lat_rad[indices], snapshot.lng_rad[indices])
+        within = distances <= radius_km
+        return indices[within], distances[within]
+
+    def _query(self, view, lat, lng, radius_km, category, place_ids=None):
+        """Indices into the view (main snapshot first, then delta) and distances of the stores in range"""
+        main, hidden, delta = view
+        indices, distances = self._query_snapshot(main, lat, lng, radius_km, category, place_ids)
+        if hidden.size:
+            shown = ~hidden[indices]
+            indices, distances = indices[shown], distances[shown]
+        if delta.records:
+            delta_indices, delta_distances = self._query_snapshot(delta, lat, lng, radius_km, category, place_ids)
+            indices = np.concatenate((indices, delta_indices + len(main.records)))
+            distances = np.concatenate((distances, delta_distances))
+        return indices, distances
+
+    def _results(self, view, indices, distances):
+        main, _, delta = view
+        offset = len(main.records)
+        return [dict(main.records[i] if i < offset else delta.records[i - offset], distance_km=round(float(d), 3))
+                for i, d in zip(indices, distances)]
+
+    def within(self, lat, lng, radius_km, category=None, place_ids=None):
+        """Stores within radius_km of the point, nearest first.
+
+        category may be a single category or a list, matching stores in any of them;
+        place_ids, a set, restricts the result to those stores.
+        """
+        view = self._view
+        indices, distances = self._query(view, lat, lng, radius_km, category, place_ids)
+        order = np.argsort(distances, kind='stable')
+        return self._results(view, indices[order], distances[order])
+
+    def nearest(self, lat, lng, k=10, max_radius_km=None, category=None, place_ids=None):
+        """Up to k nearest stores, optionally no further than max_radius_km, nearest first"""
+        view = self._view
+        if k <= 0 or not (view[0].records or view[2].records):
+            return []
+        limit = min(max_radius_km or HALF_CIRCUMFERENCE_KM, HALF_CIRCUMFERENCE_KM)
+        # Grow the search radius until it holds k stores; everything nearer is then inside it
+        radius = min(limit, self.cell_degrees * KM_PER_DEGREE)
+        while True:
+            indices, distances = self._query(view, lat, lng, radius, category, place_ids)
+            if len(indices) >= k or radius >= limit:
+                break
+            radius = min(limit, radius * 4)
+
+        if len(indices) > k:
+            top = np.argpartition(distances, k - 1)[:k]
+            indices, distances = indices[top], distances[top]
+        order = np.argsort(distances, kind='stable')
+        return self._results(view, indices[order], distances[order])
+
+    def stats(self):
+        main, hidden, delta = self._view
+        return {
+            'stores': len(self._records),
+            'categories': len(self._categories),
+            'delta_stores': len(delta.records),
+            'merges': self._merges,
+            'grid_cells': int(np.unique(main.keys[~hidden]).size),
+            'cell_degrees': self.cell_degrees,
+        }
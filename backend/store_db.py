@@ -0,0 +1,172 @@
+import logging
+import math
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from places_cache import haversine_km
+
+logger = logging.getLogger(__name__)
+
+KM_PER_DEGREE = 111.195
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stores (
+    id INTEGER PRIMARY KEY,
+    place_id TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    vicinity TEXT,
+    rating REAL,
+    lat REAL NOT NULL,
+    lng REAL NOT NULL,
+    source TEXT
+);
+CREATE TABLE IF NOT EXISTS store_media_types (
+    media_type TEXT NOT NULL,
+    store_id INTEGER NOT NULL REFERENCES stores(id) ON DELETE CASCADE,
+    PRIMARY KEY (media_type, store_id)
+) WITHOUT ROWID;
+CREATE VIRTUAL TABLE IF NOT EXISTS store_index USING rtree(id, min_lat, max_lat, min_lng, max_lng);
+"""
+
+UPSERT_STORE_SQL = """
+INSERT INTO stores (place_id, name, vicinity, rating, lat, lng, source) VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (place_id) DO UPDATE SET
+    name = excluded.name, vicinity = excluded.vicinity, rating = excluded.rating,
+    lat = excluded.lat, lng = excluded.lng, source = excluded.source
+RETURNING id
+"""
+UPSERT_INDEX_SQL = "INSERT OR REPLACE INTO store_index (id, min_lat, max_lat, min_lng, max_lng) VALUES (?, ?, ?, ?, ?)"
+INSERT_MEDIA_TYPE_SQL = "INSERT OR IGNORE INTO store_media_types (media_type, store_id) VALUES (?, ?)"
+
+# The SQL text is constant so every pooled connection keeps it prepared in its statement cache
+BOX_SQL = """
+SELECT s.place_id, s.name, s.vicinity, s.rating, s.lat, s.lng
+FROM store_index AS i JOIN stores AS s ON s.id = i.id
+WHERE i.max_lat >= ? AND i.min_lat <= ? AND i.max_lng >= ? AND i.min_lng <= ?
+"""
+BOX_MEDIA_TYPE_SQL = BOX_SQL + """
+  AND EXISTS (SELECT 1 FROM store_media_types AS m WHERE m.media_type = ? AND m.store_id = s.id)
+"""
+
+
+def create_schema(connection):
+    connection.executescript(SCHEMA)
+
+
+def ingest_stores(path, stores, source=None, batch_size=5000):
+    """Insert or update stores in the database at path, creating it if needed.
+
+    Each store is a dict with name, lat, lng, place_id and optional vicinity, rating
+    and media_types (an iterable of media types). Returns the number of stores written.
+    """
+    connection = sqlite3.connect(path)
+    try:
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        create_schema(connection)
+        written = 0
+        with connection:
+            for store in stores:
+                store_id = connection.execute(UPSERT_STORE_SQL, (
+                    store['place_id'], store['name'], store.get('vicinity'), store.get('rating'),
+                    store['lat'], store['lng'], source
+                )).fetchone()[0]
+                connection.execute(UPSERT_INDEX_SQL, (store_id, store['lat'], store['lat'], store['lng'], store['lng']))
+                connection.executemany(INSERT_MEDIA_TYPE_SQL, ((media_type, store_id) for media_type in store.get('media_types', ())))
+                written += 1
+                if written % batch_size == 0:
+                    connection.commit()
+                    logger.info(f"Ingested {written} stores")
+        return written
+    finally:
+        connection.close()
+
+
+class StoreDatabase:
+    """Read-only nearest-store queries over an ingested SQLite store database.
+
+    Stores are found through an R-tree bounding-box lookup around the point and
+    then ordered by haversine distance; the box grows until it holds k stores or
+    reaches max_radius_km. Connections are opened read-only once and handed out
+    from a pool, each keeping the query statements prepared.
+    """
+
+    def __init__(self, path, pool_size=4, mmap_bytes=256 * 1024 * 1024):
+        self.path = path
+        self._pool = queue.LifoQueue()
+        for _ in range(max(1, int(pool_size))):
+            connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False, cached_statements=16)
+            connection.execute(f'PRAGMA mmap_size={int(mmap_bytes)}')
+            self._pool.put(connection)
+        with self.connection() as connection:
+            self.store_count = connection.execute('SELECT COUNT(*) FROM stores').fetchone()[0]
+        self.queries = 0
+        self._queries_lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        connection = self._pool.get()
+        try:
+            yield connection
+        finally:
+            self._pool.put(connection)
+
+    def _boxes(self, lat, lng, radius_km):
+        lat_delta = radius_km / KM_PER_DEGREE
+        min_lat, max_lat = max(-90.0, lat - lat_delta), min(90.0, lat + lat_delta)
+        if min_lat <= -90.0 or max_lat >= 90.0:
+            return [(min_lat, max_lat, -180.0, 180.0)]
+        lng_delta = radius_km / (KM_PER_DEGREE * math.cos(math.radians(max(abs(min_lat), abs(max_lat)))))
+        if lng_delta >= 180.0:
+            return [(min_lat, max_lat, -180.0, 180.0)]
+        min_lng, max_lng = lng - lng_delta, lng + lng_delta
+        # Split a box crossing the antimeridian in two
+        if min_lng < -180.0:
+            return [(min_lat, max_lat, min_lng + 360.0, 180.0), (min_lat, max_lat, -180.0, max_lng)]
+        if max_lng > 180.0:
+            return [(min_lat, max_lat, min_lng, 180.0), (min_lat, max_lat, -180.0, max_lng - 360.0)]
+        return [(min_lat, max_lat, min_lng, max_lng)]
+
+    def _within(self, connection, lat, lng, radius_km, media_type):
+        stores = []
+        for box in self._boxes(lat, lng, radius_km):
+            if media_type:
+                rows = connection.execute(BOX_MEDIA_TYPE_SQL, box + (media_type,))
+            else:
+                rows = connection.execute(BOX_SQL, box)
+            for place_id, name, vicinity, rating, store_lat, store_lng in rows:
+                distance = haversine_km(lat, lng, store_lat, store_lng)
+                if distance <= radius_km:
+                    stores.append({
+                        "name": name,
+                        "lat": store_lat,
+                        "lng": store_lng,
+                        "vicinity": vicinity or 'Address not available',
+                        "rating": rating or 0,
+                        "place_id": place_id,
+                        "distance_km": round(distance, 3)
+                    })
+        return stores
+
+    def nearest(self, lat, lng, k=10, max_radius_km=10.0, media_type=None):
+        """Up to k stores nearest to the point within max_radius_km, nearest first"""
+        with self._queries_lock:
+            self.queries += 1
+        radius = min(1.0, max_radius_km)
+        with self.connection() as connection:
+            while True:
+                stores = self._within(connection, lat, lng, radius, media_type)
+                if len(stores) >= k or radius >= max_radius_km:
+                    break
+                radius = min(max_radius_km, radius * 4)
+        stores.sort(key=lambda store: store['distance_km'])
+        return stores[:k]
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'stores': self.store_count,
+            'queries': self.queries,
+        }
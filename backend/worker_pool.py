@@ -0,0 +1,248 @@
+import itertools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import log_pipeline
+
+logger = logging.getLogger(__name__)
+
+# How often a waiting request checks that its worker process is still alive
+LIVENESS_CHECK_SECONDS = 1.0
+
+
+def parse_affinity(spec, workers):
+    """Turn INFERENCE_CPU_AFFINITY into one CPU set per worker.
+
+    '' or 'none' leaves scheduling to the OS, 'auto' splits the CPUs this process may
+    use into equal contiguous chunks, and an explicit spec lists one CPU set per
+    worker separated by ';', e.g. '0-3;4-7' or '0,2;1,3'.
+    """
+    spec = (spec or '').strip().lower()
+    if spec in ('', 'none'):
+        return [None] * workers
+
+    if spec == 'auto':
+        cpus = sorted(os.sched_getaffinity(0))
+        if workers > len(cpus):
+            logger.warning(f"INFERENCE_CPU_AFFINITY=auto with {workers} workers on {len(cpus)} CPUs: "
+                           f"workers will share CPUs; use fewer workers or an explicit affinity")
+            return [{cpus[i % len(cpus)]} for i in range(workers)]
+        chunk = len(cpus) // workers
+        return [set(cpus[i * chunk:(i + 1) * chunk]) for i in range(workers)]
+
+    sets = []
+    for part in spec.split(';'):
+        cpus = set()
+        for item in part.split(','):
+            item = item.strip()
+            if '-' in item:
+                start, end = item.split('-')
+                cpus.update(range(int(start), int(end) + 1))
+            elif item:
+                cpus.add(int(item))
+        sets.append(cpus)
+    if len(sets) != workers:
+        raise ValueError(f"INFERENCE_CPU_AFFINITY lists {len(sets)} CPU sets for {workers} workers")
+    return sets
+
+
+def _worker_main(worker_id, local_model, cpus, threads, tasks, results):
+    """Worker process loop: run batches from tasks, report results with busy time"""
+    import torch
+
+    log_pipeline.direct()
+    # Pin first, so the intra-op pool the first forward pass starts lives on these CPUs
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    torch.set_num_threads(threads)
+    local_model.warm_up()
+
+    while True:
+        job = tasks.get()
+        if job is None:
+            break
+        job_id, tensors = job
+        started = time.perf_counter()
+        try:
+            output = local_model.run_batch(tensors)
+            error = None
+        except Exception as e:
+            output, error = None, f"{type(e).__name__}: {e}"
+        results.put((job_id, worker_id, output, error, time.perf_counter() - started))
+
+
+class InferenceWorkerPool:
+    """Run local model batches in N forked worker processes.
+
+    The model is loaded in the parent before forking, so every worker shares the
+    same weight pages copy-on-write instead of holding its own copy. Each worker can
+    be pinned to its own CPU set and given its own torch thread count, so workers
+    don't fight over cores or oversubscribe them. run_batch() hands a batch to the
+    worker with the fewest jobs in flight and blocks until it answers. A worker
+    found dead fails every job it held and is replaced by a fresh fork.
+
+    Fork is deliberate: spawn or forkserver would pickle the model into every
+    worker. It does mean workers are forked while the parent's other threads (log
+    writer, batchers, caches, catalog merges) may hold locks, so a worker must only
+    touch the model and its own queues, and log directly (log_pipeline.direct()).
+    The parent must also not have started a torch intra-op pool, which a fork
+    doesn't carry over: load the model with threads=1 and warmup=False, as app.py
+    does, and each worker sets its thread count after pinning and then warms up.
+    """
+
+    def __init__(self, local_model, workers, threads_per_worker=None, affinity=''):
+        import torch.multiprocessing as mp
+
+        self.local_model = local_model
+        self.workers = max(1, int(workers))
+        self.cpu_sets = parse_affinity(affinity, self.workers)
+        if threads_per_worker:
+            self.threads = [int(threads_per_worker)] * self.workers
+        else:
+            cpu_count = len(os.sched_getaffinity(0))
+            self.threads = [len(cpus) if cpus else max(1, cpu_count // self.workers) for cpus in self.cpu_sets]
+
+        self._mp = mp.get_context('fork')
+        self._processes = []
+        self._task_queues = []
+        self._results = None
+        self._pending = {}
+        self._job_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._started_at = None
+
+        self._in_flight = [0] * self.workers
+        self._jobs = [0] * self.workers
+        self._items = [0] * self.workers
+        self._busy = [0.0] * self.workers
+        self._errors = [0] * self.workers
+        self._restarts = [0] * self.workers
+
+    @property
+    def started(self):
+        return self._started_at is not None
+
+    def start(self):
+        """Load the model in this process, then fork the workers"""
+        with self._lock:
+            if self.started:
+                return
+            self.local_model.ensure_loaded()
+            if self.local_model.warmup or self.local_model.threads != 1:
+                logger.warning("Forking inference workers from a process that may have started a torch "
+                               "thread pool; load the model with threads=1 and warmup=False")
+            self._results = self._mp.Queue()
+            for worker_id in range(self.workers):
+                self._task_queues.append(None)
+                self._processes.append(None)
+                self._spawn(worker_id)
+            threading.Thread(target=self._collect_results, name='inference-results', daemon=True).start()
+            self._started_at = time.monotonic()
+            logger.info(
+                f"Started {self.workers} inference workers: "
+                + ", ".join(f"pid {p.pid} cpus {sorted(c) if c else 'any'} threads {t}"
+                            for p, c, t in zip(self._processes, self.cpu_sets, self.threads))
+            )
+
+    def _spawn(self, worker_id):
+        """Fork the process for worker_id with a fresh task queue; called with the lock held"""
+        tasks = self._mp.Queue()
+        process = self._mp.Process(
+            target=_worker_main,
+            args=(worker_id, self.local_model, self.cpu_sets[worker_id], self.threads[worker_id],
+                  tasks, self._results),
+            name=f'inference-worker-{worker_id}',
+            daemon=True
+        )
+        process.start()
+        self._task_queues[worker_id] = tasks
+        self._processes[worker_id] = process
+
+    def _replace(self, worker_id, process):
+        """Fail the jobs of a dead worker process and fork its replacement"""
+        with self._lock:
+            if self._processes[worker_id] is not process:
+                return  # Another request already replaced it
+            error = RuntimeError(f"Inference worker {worker_id} (pid {process.pid}) died "
+                                 f"with exit code {process.exitcode}")
+            lost = [job_id for job_id, (_, _, owner) in self._pending.items() if owner == worker_id]
+            futures = [self._pending.pop(job_id)[0] for job_id in lost]
+            self._in_flight[worker_id] = 0
+            self._errors[worker_id] += len(lost)
+            self._restarts[worker_id] += 1
+            # Jobs still queued for the dead process are failed above, so its queue goes with it
+            self._task_queues[worker_id].cancel_join_thread()
+            self._task_queues[worker_id].close()
+            self._spawn(worker_id)
+            replacement = self._processes[worker_id].pid
+        logger.error(f"{error}; failed {len(lost)} jobs, replaced it with pid {replacement}")
+        for future in futures:
+            future.set_exception(error)
+
+    def _collect_results(self):
+        while True:
+            job_id, worker_id, output, error, busy = self._results.get()
+            with self._lock:
+                pending = self._pending.pop(job_id, None)
+                if pending is None:
+                    continue  # Already failed when its worker was found dead
+                future, size, _ = pending
+                self._in_flight[worker_id] -= 1
+                self._jobs[worker_id] += 1
+                self._items[worker_id] += size
+                self._busy[worker_id] += busy
+                if error:
+                    self._errors[worker_id] += 1
+            if error:
+                future.set_exception(RuntimeError(f"Inference worker {worker_id} failed: {error}"))
+            else:
+                future.set_result(output)
+
+    def run_batch(self, tensors):
+        """Run a batch on the least busy worker; same contract as LocalModel.run_batch"""
+        if not self.started:
+            self.start()
+
+        future = Future()
+        while True:
+            with self._lock:
+                worker_id = min(range(self.workers), key=lambda i: self._in_flight[i])
+                process = self._processes[worker_id]
+                if process.is_alive():
+                    job_id = next(self._job_ids)
+                    self._pending[job_id] = (future, len(tensors), worker_id)
+                    self._in_flight[worker_id] += 1
+                    self._task_queues[worker_id].put((job_id, tensors))
+                    break
+            self._replace(worker_id, process)
+
+        while True:
+            try:
+                return future.result(timeout=LIVENESS_CHECK_SECONDS)
+            except TimeoutError:
+                if not process.is_alive():
+                    self._replace(worker_id, process)
+
+    def stats(self):
+        with self._lock:
+            uptime = time.monotonic() - self._started_at if self.started else 0.0
+            return {
+                'workers': self.workers,
+                'started': self.started,
+                'per_worker': [{
+                    'pid': process.pid,
+                    'alive': process.is_alive(),
+                    'cpus': sorted(self.cpu_sets[i]) if self.cpu_sets[i] else None,
+                    'threads': self.threads[i],
+                    'in_flight': self._in_flight[i],
+                    'jobs': self._jobs[i],
+                    'items': self._items[i],
+                    'errors': self._errors[i],
+                    'restarts': self._restarts[i],
+                    'busy_seconds': self._busy[i],
+                    'utilization': self._busy[i] / uptime if uptime else 0.0,
+                } for i, process in enumerate(self._processes)]
+            }